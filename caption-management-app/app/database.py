@@ -1,20 +1,148 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+"""
+Database engine and sessions.
+
+create_db_engine configures the engine for the backend in DATABASE_URL:
+
+- SQLite: every connection switches to WAL (readers no longer block the
+  writer, so the review portal keeps loading while generation jobs insert),
+  synchronous=NORMAL, a busy timeout so concurrent writers wait for the lock
+  instead of failing with "database is locked", and memory-mapped reads.
+- PostgreSQL: a fixed-size QueuePool with pre-ping, so connections the
+  server or a proxy closed are replaced instead of failing a request, and
+  recycling of long-lived connections.
+
+Routes that run many queries use get_async_db instead of get_db: the same
+database through an async engine (aiosqlite / asyncpg) with its own pool
+of the same size, so waiting on the database doesn't block the event loop.
+Async sessions can't lazy-load, so those routes load the relationships
+their templates use up front (selectinload / joinedload).
+"""
+
 import os
+
 from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./captions.db")
+DEFAULT_DATABASE_URL = "sqlite:///./captions.db"
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_TIMEOUT_SECONDS = 30
+DEFAULT_POOL_RECYCLE_SECONDS = 1800
+DEFAULT_SQLITE_BUSY_TIMEOUT_MS = 5000
+DEFAULT_SQLITE_MMAP_SIZE_MB = 256
+# Async driver used for each sync backend
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def _int_env(name: str, default: int, minimum: int = 0) -> int:
+    try:
+        return max(minimum, int(os.getenv(name, default)))
+    except ValueError:
+        return default
+
+
+def get_database_url() -> str:
+    """
+    Read DATABASE_URL. Postgres URLs without a driver (including the
+    postgres:// scheme Railway and Heroku hand out) use psycopg2, whichever
+    driver the installed SQLAlchemy version would default to.
+    """
+    url = os.getenv("DATABASE_URL", DEFAULT_DATABASE_URL)
+    for scheme in ("postgres://", "postgresql://"):
+        if url.startswith(scheme):
+            return "postgresql+psycopg2://" + url[len(scheme):]
+    return url
+
+
+def get_pool_settings() -> dict:
+    """Connection pool settings for server databases, from the environment."""
+    return {
+        "pool_size": _int_env("DB_POOL_SIZE", DEFAULT_POOL_SIZE, minimum=1),
+        "max_overflow": _int_env("DB_MAX_OVERFLOW", DEFAULT_MAX_OVERFLOW),
+        "pool_timeout": _int_env("DB_POOL_TIMEOUT_SECONDS", DEFAULT_POOL_TIMEOUT_SECONDS, minimum=1),
+        "pool_recycle": _int_env("DB_POOL_RECYCLE_SECONDS", DEFAULT_POOL_RECYCLE_SECONDS),
+    }
+
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+def get_sqlite_settings() -> dict:
+    """SQLite busy timeout (ms) and mmap size (bytes), from the environment."""
+    return {
+        "busy_timeout_ms": _int_env("SQLITE_BUSY_TIMEOUT_MS", DEFAULT_SQLITE_BUSY_TIMEOUT_MS),
+        "mmap_size": _int_env("SQLITE_MMAP_SIZE_MB", DEFAULT_SQLITE_MMAP_SIZE_MB) * 1024 * 1024,
+    }
+
+
+def _sqlite_pragmas(settings: dict):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # journal_mode is stored in the file; the rest only last for this connection
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={settings['busy_timeout_ms']}")
+        cursor.execute(f"PRAGMA mmap_size={settings['mmap_size']}")
+        cursor.close()
+    return set_pragmas
+
+
+def create_db_engine(url: str = None) -> Engine:
+    """Create an engine tuned for the URL's backend (default: DATABASE_URL)."""
+    url = make_url(url or get_database_url())
+
+    if url.get_backend_name() == "sqlite":
+        settings = get_sqlite_settings()
+        engine = create_engine(url, connect_args={
+            # Sessions are used from the event loop and from worker threads
+            "check_same_thread": False,
+            "timeout": settings["busy_timeout_ms"] / 1000,
+        })
+        event.listen(engine, "connect", _sqlite_pragmas(settings))
+        return engine
+
+    return create_engine(url, poolclass=QueuePool, pool_pre_ping=True, **get_pool_settings())
+
+
+def create_async_db_engine(url: str = None) -> AsyncEngine:
+    """Async engine for the same database and settings as create_db_engine."""
+    url = make_url(url or get_database_url())
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend} databases")
+    url = url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+    if backend == "sqlite":
+        settings = get_sqlite_settings()
+        engine = create_async_engine(url, connect_args={"timeout": settings["busy_timeout_ms"] / 1000})
+        event.listen(engine.sync_engine, "connect", _sqlite_pragmas(settings))
+        return engine
+
+    return create_async_engine(url, pool_pre_ping=True, **get_pool_settings())
+
+
+DATABASE_URL = get_database_url()
+
+engine = create_db_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+async_engine = create_async_db_engine(DATABASE_URL)
+# expire_on_commit=False: reading an attribute after commit would need a lazy load
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
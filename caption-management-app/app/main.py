@@ -1,58 +1,116 @@
-from fastapi import FastAPI, Request, Depends, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, Request, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse, FileResponse, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload, joinedload
 from datetime import datetime
+from typing import Optional
 import secrets
 import os
-import shutil
+import time
+import mimetypes
 from pathlib import Path
 import base64
+import json
 
-from .database import engine, get_db, Base
-from .models import Client, Strategy, Post, PreviousPost, Photo, Comment, Batch, PostStatus, ProfileAudit, AUDIT_CHECKLISTS, StrategyFile, OnboardingStatus, ClientProfile, PlatformStrategy
-from .services import caption_generator, metricool, strategy_parser
-from sqlalchemy import text
-
-# Create tables
-Base.metadata.create_all(bind=engine)
-
-# Run simple migrations for new columns (SQLite-safe)
-def run_migrations():
-    """Add new columns to existing tables if they don't exist"""
-    with engine.connect() as conn:
-        # Check and add new Post columns for learning system
-        try:
-            conn.execute(text("ALTER TABLE posts ADD COLUMN original_caption TEXT"))
-            print("[Migration] Added original_caption column to posts")
-        except Exception:
-            pass  # Column already exists
-        
-        try:
-            conn.execute(text("ALTER TABLE posts ADD COLUMN original_hashtags TEXT"))
-            print("[Migration] Added original_hashtags column to posts")
-        except Exception:
-            pass
-        
-        try:
-            conn.execute(text("ALTER TABLE posts ADD COLUMN was_edited BOOLEAN DEFAULT 0"))
-            print("[Migration] Added was_edited column to posts")
-        except Exception:
-            pass
-        
-        conn.commit()
-
-run_migrations()
+from .database import engine, async_engine, get_db, get_async_db, SessionLocal
+from . import migrations
+from .models import Client, Strategy, Post, PreviousPost, Photo, Comment, Batch, PostStatus, ProfileAudit, AUDIT_CHECKLISTS, StrategyFile, OnboardingStatus, ClientProfile, PlatformStrategy, GenerationJob
+from .services import metricool, generation_jobs, llm, expert_frameworks, dedup_index, embeddings, generation, scheduling, media_cache, metricool_sync, thumbnails, uploads, storage, strategy_files, post_stats
 
 APP_PASSWORD = os.getenv("APP_PASSWORD", "").strip()
 
+# Platforms captions can be generated and strategies kept for
+PLATFORMS = ["instagram", "facebook", "gbp", "linkedin", "tiktok", "twitter"]
+# Captions one generation job may ask for
+MAX_CAPTIONS_PER_JOB = 20
+
 app = FastAPI(title="Caption Management App")
 
 # Setup static files and templates
 BASE_DIR = Path(__file__).resolve().parent.parent
 app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+templates.env.globals["thumbnail_url"] = thumbnails.thumbnail_url
+
+
+@app.on_event("startup")
+async def check_schema_version():
+    # Migrations run at deploy time (python -m app.migrations upgrade), never here.
+    # Serving a stale schema fails in confusing ways later, so don't start at all
+    pending = migrations.pending_migrations(engine)
+    if pending:
+        raise RuntimeError(f"Database schema is {len(pending)} migration(s) behind - "
+                           f"run `python -m app.migrations upgrade`")
+
+
+@app.on_event("startup")
+async def check_media_signing_key():
+    storage.check_signing_key()
+
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await async_engine.dispose()
+
+
+@app.on_event("startup")
+async def open_metricool_client():
+    await metricool.start_client()
+
+
+@app.on_event("shutdown")
+async def close_metricool_client():
+    await metricool.close_client()
+
+
+@app.on_event("startup")
+async def warm_prompt_caches():
+    count = expert_frameworks.warm_prompt_section_cache()
+    print(f"[Startup] Precompiled {count} expert prompt section sets")
+
+
+@app.on_event("startup")
+async def start_background_workers():
+    await generation_jobs.start_workers()
+
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    await generation_jobs.stop_workers()
+
+
+@app.on_event("startup")
+async def start_metricool_sync():
+    await metricool_sync.start_sync_loop()
+
+
+@app.on_event("shutdown")
+async def stop_metricool_sync():
+    await metricool_sync.stop_sync_loop()
+
+
+@app.on_event("startup")
+async def start_thumbnail_backfill():
+    thumbnails.start_backfill()
+
+
+@app.on_event("shutdown")
+async def stop_thumbnail_pool():
+    thumbnails.shutdown_executor()
+
+
+@app.on_event("startup")
+async def resume_strategy_files():
+    strategy_files.start_resume()
+
+
+@app.on_event("shutdown")
+async def stop_strategy_parsing():
+    strategy_files.shutdown()
+
 
 # Ensure upload directory exists
 UPLOAD_DIR = BASE_DIR / "static" / "uploads"
@@ -72,10 +130,22 @@ def _is_public_path(path: str) -> bool:
         or path.startswith("/redoc")
         or path.startswith("/health")
         or path.startswith("/review")
+        or path.startswith("/thumbs/")
+        or path.startswith("/media/")
         or path == "/login"
     )
 
 
+@app.middleware("http")
+async def reject_oversized_uploads(request, call_next):
+    """Refuse bodies over the upload limit before the multipart form is spooled."""
+    content_length = request.headers.get("content-length")
+    if request.method == "POST" and content_length and content_length.isdigit():
+        if int(content_length) > uploads.get_max_request_bytes():
+            return JSONResponse({"error": "Upload is too large"}, status_code=413)
+    return await call_next(request)
+
+
 @app.middleware("http")
 async def simple_password_guard(request, call_next):
     # If no password configured, skip guard
@@ -137,14 +207,21 @@ async def logout():
 # ============================================================================
 
 @app.get("/", response_class=HTMLResponse)
-async def dashboard(request: Request, db: Session = Depends(get_db)):
+async def dashboard(request: Request, db: AsyncSession = Depends(get_async_db)):
     """Main agency dashboard"""
-    clients = db.query(Client).filter(Client.is_active == True).all()
-    recent_posts = db.query(Post).order_by(Post.created_at.desc()).limit(10).all()
+    clients = (await db.scalars(
+        select(Client).where(Client.is_active == True).options(joinedload(Client.strategy))
+    )).all()
+    stats = await post_stats.post_stats_by_client(db)
+    recent_posts = (await db.scalars(
+        select(Post).options(joinedload(Post.client)).order_by(Post.created_at.desc()).limit(10)
+    )).all()
 
     return templates.TemplateResponse("agency/dashboard.html", {
         "request": request,
         "clients": clients,
+        "post_stats": stats,
+        "totals": post_stats.combined(stats[client.id] for client in clients),
         "recent_posts": recent_posts,
         "metricool_status": metricool.validate_metricool_config()
     })
@@ -155,12 +232,13 @@ async def dashboard(request: Request, db: Session = Depends(get_db)):
 # ============================================================================
 
 @app.get("/clients", response_class=HTMLResponse)
-async def list_clients(request: Request, db: Session = Depends(get_db)):
+async def list_clients(request: Request, db: AsyncSession = Depends(get_async_db)):
     """List all clients"""
-    clients = db.query(Client).all()
+    clients = (await db.scalars(select(Client).options(joinedload(Client.strategy)))).all()
     return templates.TemplateResponse("agency/clients.html", {
         "request": request,
-        "clients": clients
+        "clients": clients,
+        "post_stats": await post_stats.post_stats_by_client(db)
     })
 
 
@@ -204,30 +282,38 @@ async def create_client(
     return RedirectResponse(f"/clients/{client.id}/onboarding", status_code=303)
 
 
+# Posts listed on the client page, newest first
+CLIENT_PAGE_POSTS = 20
+
+
 @app.get("/clients/{client_id}", response_class=HTMLResponse)
-async def view_client(request: Request, client_id: int, db: Session = Depends(get_db)):
+async def view_client(request: Request, client_id: int, db: AsyncSession = Depends(get_async_db)):
     """View client details and manage - unified dashboard"""
-    client = db.query(Client).filter(Client.id == client_id).first()
+    # Profile and platform strategies for the dashboard come with the client
+    client = await db.scalar(
+        select(Client).where(Client.id == client_id)
+        .options(joinedload(Client.client_profile), selectinload(Client.platform_strategies))
+    )
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
 
-    posts = db.query(Post).filter(Post.client_id == client_id).order_by(Post.created_at.desc()).all()
-    photos = db.query(Photo).filter(Photo.client_id == client_id).all()
-    
-    # Get profile and platform strategies for dashboard
-    profile = db.query(ClientProfile).filter(ClientProfile.client_id == client_id).first()
-    platform_strategies = db.query(PlatformStrategy).filter(PlatformStrategy.client_id == client_id).all()
-    strategies_by_platform = {s.platform: s for s in platform_strategies}
+    # Counts cover every post; only the latest are listed
+    stats = (await post_stats.post_stats_by_client(db, client_id))[client_id]
+    posts = (await db.scalars(
+        select(Post).where(Post.client_id == client_id)
+        .options(selectinload(Post.photo)).order_by(Post.created_at.desc()).limit(CLIENT_PAGE_POSTS)
+    )).all()
+    strategies_by_platform = {s.platform: s for s in client.platform_strategies}
     
     # Available platforms
-    platforms = ["instagram", "facebook", "gbp", "linkedin", "tiktok", "twitter"]
+    platforms = PLATFORMS
 
     return templates.TemplateResponse("agency/client_detail.html", {
         "request": request,
         "client": client,
         "posts": posts,
-        "photos": photos,
-        "profile": profile,
+        "post_stats": stats,
+        "profile": client.client_profile,
         "strategies_by_platform": strategies_by_platform,
         "platforms": platforms
     })
@@ -311,21 +397,13 @@ async def generate_captions(
     client_id: int,
     db: Session = Depends(get_db)
 ):
-    """Generate captions using AI - uses full profile if available"""
+    """Queue a caption generation job - the worker pool does the AI call"""
     client = db.query(Client).filter(Client.id == client_id).first()
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
 
     form_data = await request.form()
 
-    # Get previous posts for deduplication
-    previous = db.query(PreviousPost).filter(PreviousPost.client_id == client_id).all()
-    previous_captions = [p.caption for p in previous]
-
-    # Also include posts we've already created
-    existing_posts = db.query(Post).filter(Post.client_id == client_id).all()
-    previous_captions.extend([p.caption for p in existing_posts])
-
     # Get form parameters
     num_captions = int(form_data.get("num_captions", 5))
     platform = form_data.get("platform", "instagram")
@@ -333,96 +411,149 @@ async def generate_captions(
     specific_topic = form_data.get("specific_topic", None)
     batch_name = form_data.get("batch_name", f"Batch {datetime.now().strftime('%Y-%m-%d')}")
 
-    # Check if client has full profile documents
-    client_profile = db.query(ClientProfile).filter(ClientProfile.client_id == client_id).first()
-    platform_strategy = db.query(PlatformStrategy).filter(
-        PlatformStrategy.client_id == client_id,
-        PlatformStrategy.platform == platform
-    ).first()
+    job = generation_jobs.enqueue_generation_job(
+        db,
+        client_id=client_id,
+        platform=platform,
+        num_captions=num_captions,
+        batch_name=batch_name,
+        content_theme=content_theme if content_theme else None,
+        specific_topic=specific_topic if specific_topic else None
+    )
 
-    # Fetch recent edited posts for learning (before/after examples)
-    edited_posts = db.query(Post).filter(
-        Post.client_id == client_id,
-        Post.was_edited == True,
-        Post.original_caption.isnot(None)
-    ).order_by(Post.updated_at.desc()).limit(10).all()
-
-    edited_examples = []
-    for ep in edited_posts:
-        if ep.original_caption and ep.caption and ep.original_caption != ep.caption:
-            edited_examples.append({
-                "original": ep.original_caption,
-                "edited": ep.caption
-            })
-    
-    if edited_examples:
-        print(f"[Caption Generator] Found {len(edited_examples)} edited examples to learn from")
-
-    # Use full-context generator if profile is available
-    if client_profile and client_profile.profile_markdown:
-        print(f"[Caption Generator] Using FULL PROFILE context for {client.name}")
-        captions = caption_generator.generate_captions_with_full_context(
-            client_name=client.name,
-            profile_markdown=client_profile.profile_markdown,
-            master_strategy_markdown=client_profile.master_strategy_markdown,
-            platform_strategy_markdown=platform_strategy.strategy_markdown if platform_strategy else None,
-            previous_posts=previous_captions,
-            num_captions=num_captions,
-            platform=platform,
-            content_theme=content_theme if content_theme else None,
-            specific_topic=specific_topic if specific_topic else None,
-            edited_examples=edited_examples if edited_examples else None
-        )
-    else:
-        # Fall back to legacy strategy-dict based generation
-        if not client.strategy:
-            raise HTTPException(status_code=404, detail="Client strategy not found. Please upload a profile or configure strategy.")
+    # Check if this is an AJAX request
+    if request.headers.get("X-Requested-With") == "XMLHttpRequest":
+        return JSONResponse({
+            "success": True,
+            "job_id": job.id,
+            "status_url": f"/api/jobs/{job.id}"
+        }, status_code=202)
 
-        print(f"[Caption Generator] Using LEGACY strategy dict for {client.name}")
-        strategy_dict = {
-            "brand_voice": client.strategy.brand_voice,
-            "tone_keywords": client.strategy.tone_keywords or [],
-            "content_pillars": client.strategy.content_pillars or [],
-            "target_audience": client.strategy.target_audience,
-            "audience_pain_points": client.strategy.audience_pain_points or [],
-            "industry": client.strategy.industry,
-            "unique_selling_points": client.strategy.unique_selling_points or [],
-            "key_messages": client.strategy.key_messages or [],
-            "topics_to_avoid": client.strategy.topics_to_avoid or [],
-            "hashtag_sets": client.strategy.hashtag_sets or {}
-        }
+    return RedirectResponse(f"/clients/{client_id}?job={job.id}", status_code=303)
+
+
+@app.post("/clients/{client_id}/generate/stream")
+async def generate_captions_stream(
+    request: Request,
+    client_id: int,
+    db: Session = Depends(get_db)
+):
+    """
+    Generate captions and stream each saved post to the browser as a
+    server-sent event (post, then done or error).
+    """
+    client = db.query(Client).filter(Client.id == client_id).first()
+    if not client:
+        raise HTTPException(status_code=404, detail="Client not found")
 
-        captions = caption_generator.generate_captions(
-            strategy=strategy_dict,
-            previous_posts=previous_captions,
-            num_captions=num_captions,
-            platform=platform,
-            content_theme=content_theme if content_theme else None,
-            specific_topic=specific_topic if specific_topic else None
-        )
-
-    # Save generated captions as posts
-    for cap in captions:
-        if "error" not in cap:
-            caption_text = cap.get("caption", "")
-            hashtags = " ".join([f"#{h}" for h in cap.get("hashtags", [])])
-            post = Post(
+    form_data = await request.form()
+
+    num_captions = int(form_data.get("num_captions", 5))
+    platform = form_data.get("platform", "instagram")
+    content_theme = form_data.get("content_theme", None)
+    specific_topic = form_data.get("specific_topic", None)
+    batch_name = form_data.get("batch_name", f"Batch {datetime.now().strftime('%Y-%m-%d')}")
+
+    async def event_stream():
+        # The request's session is closed before the body is sent, so the stream uses its own
+        stream_db = SessionLocal()
+        try:
+            async for event in generation.stream_posts_for_client(
+                stream_db,
                 client_id=client_id,
-                caption=caption_text,
-                hashtags=hashtags,
                 platform=platform,
+                num_captions=num_captions,
                 batch_name=batch_name,
-                status=PostStatus.DRAFT,
-                # Store original for learning from edits
-                original_caption=caption_text,
-                original_hashtags=hashtags,
-                was_edited=False
-            )
-            db.add(post)
+                content_theme=content_theme if content_theme else None,
+                specific_topic=specific_topic if specific_topic else None
+            ):
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            stream_db.close()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # Don't let a proxy hold events back
+    })
 
-    db.commit()
 
-    return RedirectResponse(f"/clients/{client_id}", status_code=303)
+def _bulk_request_error(req) -> Optional[str]:
+    """Why one entry of a bulk generation request is invalid, or None. Normalizes num_captions."""
+    if not isinstance(req, dict):
+        return "Each request must be an object"
+    client_id = req.get("client_id")
+    if not isinstance(client_id, int) or isinstance(client_id, bool):
+        return f"Invalid client_id: {client_id!r}"
+
+    platforms = req.get("platforms")
+    if not platforms or not isinstance(platforms, list):
+        return f"platforms must be a non-empty list for client {client_id}"
+    unknown = [p for p in platforms if p not in PLATFORMS]
+    if unknown:
+        return f"Unknown platform(s) for client {client_id}: {', '.join(map(str, unknown))}"
+
+    try:
+        num_captions = int(req.get("num_captions", 5))
+    except (TypeError, ValueError):
+        num_captions = 0
+    if not 1 <= num_captions <= MAX_CAPTIONS_PER_JOB:
+        return f"num_captions must be a number from 1 to {MAX_CAPTIONS_PER_JOB} for client {client_id}"
+    req["num_captions"] = num_captions
+    return None
+
+
+@app.post("/api/generate/bulk")
+async def bulk_generate_captions(request: Request, db: Session = Depends(get_db)):
+    """
+    Queue generation for many clients x platforms at once.
+
+    Body: {"batch_name": "...", "requests": [{"client_id": 1, "platforms": ["instagram", "facebook"],
+           "num_captions": 5, "content_theme": null, "specific_topic": null}, ...]}
+    """
+    try:
+        payload = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "Body must be JSON"}, status_code=400)
+    requests = payload.get("requests") if isinstance(payload, dict) else None
+    if not requests or not isinstance(requests, list):
+        return JSONResponse({"error": "No generation requests provided"}, status_code=400)
+    batch_name = payload.get("batch_name") or f"Batch {datetime.now().strftime('%Y-%m-%d')}"
+
+    for req in requests:
+        error = _bulk_request_error(req)
+        if error:
+            return JSONResponse({"error": error}, status_code=400)
+
+    client_ids = {req["client_id"] for req in requests}
+    known_ids = {c.id for c in db.query(Client.id).filter(Client.id.in_(client_ids)).all()}
+    for req in requests:
+        if req["client_id"] not in known_ids:
+            return JSONResponse({"error": f"Client not found: {req['client_id']}"}, status_code=404)
+
+    run_id, jobs = generation_jobs.enqueue_bulk_run(db, requests, batch_name)
+
+    return JSONResponse({
+        "success": True,
+        "run_id": run_id,
+        "job_ids": [job.id for job in jobs],
+        "status_url": f"/api/generate/bulk/{run_id}"
+    }, status_code=202)
+
+
+@app.get("/api/generate/bulk/{run_id}")
+async def bulk_generation_status(run_id: str, db: Session = Depends(get_db)):
+    """Progress, per-job latency/token usage and failures for a bulk run"""
+    summary = generation_jobs.summarize_run(db, run_id)
+    if not summary:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return summary
+
+
+@app.post("/api/generate/bulk/{run_id}/retry")
+async def retry_bulk_generation(run_id: str, db: Session = Depends(get_db)):
+    """Re-queue only the failed jobs of a bulk run"""
+    requeued = generation_jobs.retry_failed_jobs(db, run_id)
+    return JSONResponse({"success": True, "requeued": requeued})
 
 
 # ============================================================================
@@ -467,6 +598,7 @@ async def update_post(
     if post.original_hashtags and new_hashtags != post.original_hashtags:
         post.was_edited = True
 
+    caption_changed = new_caption != post.caption
     post.caption = new_caption
     post.hashtags = new_hashtags
     post.platform = form_data.get("platform", post.platform)
@@ -481,6 +613,10 @@ async def update_post(
 
     db.commit()
 
+    if caption_changed:
+        dedup_index.index_captions(db, post.client_id, [("post", post.id, post.caption)])
+        await embeddings.embed_rows(db, [post])
+
     return RedirectResponse(f"/posts/{post_id}", status_code=303)
 
 
@@ -488,10 +624,10 @@ async def update_post(
 async def update_post_status(
     post_id: int,
     status: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update post status"""
-    post = db.query(Post).filter(Post.id == post_id).first()
+    post = await db.scalar(select(Post).where(Post.id == post_id))
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
@@ -499,7 +635,7 @@ async def update_post_status(
     if status == PostStatus.APPROVED:
         post.approved_at = datetime.utcnow()
 
-    db.commit()
+    await db.commit()
 
     return JSONResponse({"success": True, "status": status})
 
@@ -524,17 +660,21 @@ async def schedule_post_to_metricool(
     if not post.scheduled_date:
         return JSONResponse({"error": "No scheduled date set"}, status_code=400)
 
-    # Build full caption with hashtags
-    full_caption = post.caption
-    if post.hashtags:
-        full_caption += f"\n\n{post.hashtags}"
+    # Attach the photo, reusing its cached Metricool mediaId when there is one
+    media_id = None
+    if post.photo:
+        media = (await media_cache.get_media_ids(db, [post.photo]))[post.photo.id]
+        if "error" in media:
+            return JSONResponse({"error": media["error"]}, status_code=400)
+        media_id = media["media_id"]
 
     # Schedule in Metricool
     result = await metricool.schedule_post(
         blog_id=client.metricool_blog_id,
-        caption=full_caption,
+        caption=scheduling.build_full_caption(post),
         platform=post.platform,
-        scheduled_datetime=post.scheduled_date
+        scheduled_datetime=post.scheduled_date,
+        media_id=media_id
     )
 
     if "error" in result:
@@ -547,6 +687,40 @@ async def schedule_post_to_metricool(
     return JSONResponse({"success": True, "metricool_id": result.get("id")})
 
 
+@app.post("/batches/{batch_id}/schedule")
+async def schedule_batch_to_metricool(batch_id: int, db: Session = Depends(get_db)):
+    """Push every approved, dated post of a batch to Metricool"""
+    batch = db.query(Batch).filter(Batch.id == batch_id).first()
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    client = db.query(Client).filter(Client.id == batch.client_id).first()
+    result = await scheduling.schedule_batch(db, client, batch.name)
+    if "error" in result:
+        return JSONResponse({"error": result["error"]}, status_code=400)
+    return JSONResponse(result)
+
+
+@app.post("/clients/{client_id}/schedule-batch")
+async def schedule_client_batch_to_metricool(client_id: int, request: Request, db: Session = Depends(get_db)):
+    """Push every approved, dated post of a client's batch (by batch_name) to Metricool"""
+    client = db.query(Client).filter(Client.id == client_id).first()
+    if not client:
+        raise HTTPException(status_code=404, detail="Client not found")
+
+    if request.headers.get("content-type", "").startswith("application/json"):
+        batch_name = (await request.json()).get("batch_name")
+    else:
+        batch_name = (await request.form()).get("batch_name")
+    if not batch_name:
+        return JSONResponse({"error": "batch_name is required"}, status_code=400)
+
+    result = await scheduling.schedule_batch(db, client, batch_name)
+    if "error" in result:
+        return JSONResponse({"error": result["error"]}, status_code=400)
+    return JSONResponse(result)
+
+
 # ============================================================================
 # PHOTO MANAGEMENT
 # ============================================================================
@@ -570,6 +744,7 @@ async def view_photos(request: Request, client_id: int, db: Session = Depends(ge
 @app.post("/clients/{client_id}/photos")
 async def upload_photo(
     client_id: int,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     description: str = Form(""),
     tags: str = Form(""),
@@ -580,51 +755,113 @@ async def upload_photo(
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
 
-    # Create client folder
-    client_folder = UPLOAD_DIR / client.slug
-    client_folder.mkdir(exist_ok=True)
-
-    # Save file with unique name
-    ext = Path(file.filename).suffix
-    filename = f"{secrets.token_hex(8)}{ext}"
-    file_path = client_folder / filename
+    try:
+        stored = await uploads.store_upload(db, client, file, "photo")
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
 
-    with open(file_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    # The same image is already in the library - don't add it twice
+    existing = db.query(Photo).filter(Photo.client_id == client_id, Photo.content_hash == stored.content_hash).first()
+    if existing:
+        return RedirectResponse(f"/clients/{client_id}/photos", status_code=303)
 
     # Parse tags
     tag_list = [t.strip() for t in tags.split(",") if t.strip()]
 
     photo = Photo(
         client_id=client_id,
-        filename=filename,
+        filename=stored.filename,
         original_filename=file.filename,
-        file_path=f"/static/uploads/{client.slug}/{filename}",
+        file_path=stored.path,
+        content_hash=stored.content_hash,
         description=description,
         tags=tag_list
     )
     db.add(photo)
     db.commit()
 
+    # Resize after the response is sent; pages show the original until then
+    background_tasks.add_task(thumbnails.generate_for_photo, photo.id)
+
     return RedirectResponse(f"/clients/{client_id}/photos", status_code=303)
 
 
+@app.get("/thumbs/{name}")
+async def serve_thumbnail(name: str, request: Request):
+    """Serve a photo thumbnail (WebP when the browser accepts it), cacheable forever"""
+    found = await thumbnails.resolve_thumbnail(name, "image/webp" in request.headers.get("accept", ""))
+    if not found:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+
+    key, media_type = found
+    backend = storage.get_backend()
+    if isinstance(backend, storage.LocalStorageBackend):
+        return FileResponse(backend.local_path(key), media_type=media_type, headers={
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "Vary": "Accept"
+        })
+    # Bucket URLs expire, so the redirect itself is only cached for a while
+    return RedirectResponse(backend.url(key), status_code=307, headers={
+        "Cache-Control": "public, max-age=3600",
+        "Vary": "Accept"
+    })
+
+
+@app.get("/media/{key:path}")
+async def serve_media(key: str, request: Request, expires: str = "", signature: str = ""):
+    """Serve an uploaded file from a signed link, with Range support (resumable downloads, video seeking)"""
+    if not storage.verify_media_signature(key, expires, signature):
+        raise HTTPException(status_code=403, detail="Link expired or invalid")
+
+    backend = storage.get_backend()
+    if not isinstance(backend, storage.LocalStorageBackend):
+        return RedirectResponse(backend.url(key), status_code=307)
+
+    try:
+        size = await backend.size(key)
+    except ValueError:
+        size = None
+    if size is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": f"private, max-age={max(int(expires) - int(time.time()), 0)}"
+    }
+    try:
+        byte_range = storage.parse_range(request.headers.get("range"), size)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        return FileResponse(backend.local_path(key), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(backend.iter_range(key, start, end), status_code=206,
+                             media_type=media_type, headers=headers)
+
+
 # ============================================================================
 # CLIENT REVIEW PORTAL (Public-facing)
 # ============================================================================
 
 @app.get("/review/{review_token}", response_class=HTMLResponse)
-async def client_review_portal(request: Request, review_token: str, db: Session = Depends(get_db)):
+async def client_review_portal(request: Request, review_token: str, db: AsyncSession = Depends(get_async_db)):
     """Client-facing review portal"""
-    client = db.query(Client).filter(Client.review_token == review_token).first()
+    client = await db.scalar(select(Client).where(Client.review_token == review_token))
     if not client:
         raise HTTPException(status_code=404, detail="Invalid review link")
 
     # Get posts pending client review
-    posts = db.query(Post).filter(
-        Post.client_id == client.id,
-        Post.status == PostStatus.CLIENT_REVIEW
-    ).order_by(Post.scheduled_date).all()
+    posts = (await db.scalars(
+        select(Post).where(
+            Post.client_id == client.id,
+            Post.status == PostStatus.CLIENT_REVIEW
+        ).options(selectinload(Post.photo)).order_by(Post.scheduled_date)
+    )).all()
 
     return templates.TemplateResponse("client/review.html", {
         "request": request,
@@ -637,20 +874,20 @@ async def client_review_portal(request: Request, review_token: str, db: Session
 async def client_approve_post(
     review_token: str,
     post_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Client approves a post"""
-    client = db.query(Client).filter(Client.review_token == review_token).first()
+    client = await db.scalar(select(Client).where(Client.review_token == review_token))
     if not client:
         raise HTTPException(status_code=404, detail="Invalid review link")
 
-    post = db.query(Post).filter(Post.id == post_id, Post.client_id == client.id).first()
+    post = await db.scalar(select(Post).where(Post.id == post_id, Post.client_id == client.id))
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
     post.status = PostStatus.APPROVED
     post.approved_at = datetime.utcnow()
-    db.commit()
+    await db.commit()
 
     return JSONResponse({"success": True})
 
@@ -660,14 +897,14 @@ async def client_request_changes(
     request: Request,
     review_token: str,
     post_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Client requests changes to a post"""
-    client = db.query(Client).filter(Client.review_token == review_token).first()
+    client = await db.scalar(select(Client).where(Client.review_token == review_token))
     if not client:
         raise HTTPException(status_code=404, detail="Invalid review link")
 
-    post = db.query(Post).filter(Post.id == post_id, Post.client_id == client.id).first()
+    post = await db.scalar(select(Post).where(Post.id == post_id, Post.client_id == client.id))
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
@@ -685,7 +922,7 @@ async def client_request_changes(
 
     post.status = PostStatus.REVISION_REQUESTED
     post.client_comment = comment_text
-    db.commit()
+    await db.commit()
 
     return JSONResponse({"success": True})
 
@@ -695,13 +932,13 @@ async def client_request_changes(
 # ============================================================================
 
 @app.get("/api/clients/{client_id}/posts")
-async def api_get_posts(client_id: int, status: str = None, db: Session = Depends(get_db)):
+async def api_get_posts(client_id: int, status: str = None, db: AsyncSession = Depends(get_async_db)):
     """API to get posts for a client"""
-    query = db.query(Post).filter(Post.client_id == client_id)
+    query = select(Post).where(Post.client_id == client_id).options(selectinload(Post.photo))
     if status:
-        query = query.filter(Post.status == status)
+        query = query.where(Post.status == status)
 
-    posts = query.order_by(Post.created_at.desc()).all()
+    posts = (await db.scalars(query.order_by(Post.created_at.desc()))).all()
 
     return [{
         "id": p.id,
@@ -710,10 +947,30 @@ async def api_get_posts(client_id: int, status: str = None, db: Session = Depend
         "platform": p.platform,
         "status": p.status,
         "scheduled_date": p.scheduled_date.isoformat() if p.scheduled_date else None,
-        "photo_url": p.photo.file_path if p.photo else None
+        "photo_url": storage.media_url(p.photo.file_path) if p.photo else None,
+        "photo_thumbnail_url": thumbnails.thumbnail_url(p.photo) if p.photo else None,
+        "duplicate_score": p.duplicate_score,
+        "semantic_duplicate_score": p.semantic_duplicate_score,
+        "duplicate_of": p.duplicate_of
     } for p in posts]
 
 
+@app.get("/api/jobs/{job_id}")
+async def api_get_job(job_id: int, db: Session = Depends(get_db)):
+    """Poll the status of a caption generation job"""
+    job = db.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return generation_jobs.job_to_dict(job)
+
+
+@app.get("/api/metrics/llm")
+async def api_llm_metrics():
+    """Claude token usage and prompt-cache hits since this process started"""
+    return llm.get_usage_totals()
+
+
 @app.get("/api/metricool/brands")
 async def api_get_metricool_brands():
     """Get all Metricool brands for linking"""
@@ -738,6 +995,25 @@ async def link_metricool(
     return JSONResponse({"success": True})
 
 
+@app.post("/api/clients/{client_id}/metricool-sync")
+async def sync_client_with_metricool(client_id: int, db: Session = Depends(get_db)):
+    """Reconcile a client's posts with what is scheduled in Metricool"""
+    client = db.query(Client).filter(Client.id == client_id).first()
+    if not client:
+        raise HTTPException(status_code=404, detail="Client not found")
+
+    result = await metricool_sync.sync_client(db, client)
+    if "error" in result:
+        return JSONResponse({"error": result["error"]}, status_code=400)
+    return JSONResponse(result)
+
+
+@app.post("/api/metricool/sync")
+async def sync_all_with_metricool():
+    """Reconcile every Metricool-linked client now instead of waiting for the next scheduled sync"""
+    return JSONResponse({"results": await metricool_sync.sync_all_clients()})
+
+
 # ============================================================================
 # PREVIOUS POSTS (for deduplication)
 # ============================================================================
@@ -760,7 +1036,7 @@ async def import_previous_posts(
     decoded = content.decode("utf-8")
     reader = csv.DictReader(io.StringIO(decoded))
 
-    count = 0
+    imported = []
     for row in reader:
         caption = row.get("caption") or row.get("Caption") or row.get("text") or row.get("Text")
         if caption:
@@ -770,12 +1046,16 @@ async def import_previous_posts(
                 platform=row.get("platform", "unknown"),
                 posted_date=datetime.now()  # Could parse from row if available
             )
-            db.add(prev)
-            count += 1
+            imported.append(prev)
 
+    db.add_all(imported)
     db.commit()
 
-    return JSONResponse({"success": True, "imported": count})
+    # Add the imported captions to the near-duplicate index
+    dedup_index.index_captions(db, client_id, [("previous", prev.id, prev.caption) for prev in imported])
+    await embeddings.embed_rows(db, imported)
+
+    return JSONResponse({"success": True, "imported": len(imported)})
 
 
 # ============================================================================
@@ -924,10 +1204,6 @@ async def save_audit(
 # CLIENT ONBOARDING
 # ============================================================================
 
-STRATEGY_UPLOAD_DIR = BASE_DIR / "static" / "uploads" / "strategies"
-STRATEGY_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-
-
 @app.get("/clients/{client_id}/onboarding", response_class=HTMLResponse)
 async def onboarding_wizard(request: Request, client_id: int, db: Session = Depends(get_db)):
     """Client onboarding wizard - upload strategy files"""
@@ -967,111 +1243,55 @@ async def onboarding_wizard(request: Request, client_id: int, db: Session = Depe
 @app.post("/clients/{client_id}/onboarding/upload-strategy")
 async def upload_strategy_file(
     client_id: int,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: Session = Depends(get_db)
 ):
-    """Upload and parse a strategy document"""
+    """Upload a strategy document; it is parsed in the background (poll status_url)"""
     client = db.query(Client).filter(Client.id == client_id).first()
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
 
-    # Create client strategy folder
-    client_folder = STRATEGY_UPLOAD_DIR / client.slug
-    client_folder.mkdir(exist_ok=True)
-
-    # Save file
-    ext = Path(file.filename).suffix.lower()
-    filename = f"{secrets.token_hex(8)}{ext}"
-    file_path = client_folder / filename
-
-    content = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(content)
-
-    # Parse the document
-    extracted = strategy_parser.parse_strategy_document(content, file.filename, client.name)
+    try:
+        stored = await uploads.store_upload(db, client, file, "strategy")
+    except uploads.UploadError as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
 
-    # Save strategy file record
+    # Save strategy file record - it doubles as the parsing job's handle
     strategy_file = StrategyFile(
         client_id=client_id,
-        filename=filename,
+        filename=stored.filename,
         original_filename=file.filename,
-        file_path=f"/static/uploads/strategies/{client.slug}/{filename}",
-        file_type=ext.replace(".", ""),
-        extracted_summary=extracted.get("summary", ""),
-        processed=True
+        file_path=stored.path,
+        file_type=Path(stored.filename).suffix.lstrip("."),
+        content_hash=stored.content_hash,
+        parse_status="pending",
+        processed=False
     )
     db.add(strategy_file)
-
-    # Update strategy with extracted data
-    if client.strategy and "error" not in extracted:
-        strategy = client.strategy
-
-        # Merge extracted data with existing (don't overwrite existing values)
-        if extracted.get("brand_voice") and not strategy.brand_voice:
-            strategy.brand_voice = extracted["brand_voice"]
-
-        if extracted.get("tone_keywords"):
-            existing = strategy.tone_keywords or []
-            strategy.tone_keywords = list(dict.fromkeys(existing + extracted["tone_keywords"]))
-
-        if extracted.get("content_pillars"):
-            existing = strategy.content_pillars or []
-            strategy.content_pillars = list(dict.fromkeys(existing + extracted["content_pillars"]))
-
-        if extracted.get("target_audience") and not strategy.target_audience:
-            strategy.target_audience = extracted["target_audience"]
-
-        if extracted.get("audience_pain_points"):
-            existing = strategy.audience_pain_points or []
-            strategy.audience_pain_points = list(dict.fromkeys(existing + extracted["audience_pain_points"]))
-
-        if extracted.get("industry") and extracted["industry"] != "default" and not strategy.industry:
-            strategy.industry = extracted["industry"]
-
-        if extracted.get("unique_selling_points"):
-            existing = strategy.unique_selling_points or []
-            strategy.unique_selling_points = list(dict.fromkeys(existing + extracted["unique_selling_points"]))
-
-        if extracted.get("key_messages"):
-            existing = strategy.key_messages or []
-            strategy.key_messages = list(dict.fromkeys(existing + extracted["key_messages"]))
-
-        if extracted.get("topics_to_avoid"):
-            existing = strategy.topics_to_avoid or []
-            strategy.topics_to_avoid = list(dict.fromkeys(existing + extracted["topics_to_avoid"]))
-
-        if extracted.get("platforms"):
-            existing = strategy.platforms or []
-            strategy.platforms = list(dict.fromkeys(existing + extracted["platforms"]))
-
-        # Handle hashtags
-        if extracted.get("hashtags_primary") or extracted.get("hashtags_secondary"):
-            existing_sets = strategy.hashtag_sets or {"primary": [], "secondary": []}
-            if extracted.get("hashtags_primary"):
-                existing_sets["primary"] = list(dict.fromkeys(
-                    existing_sets.get("primary", []) + extracted["hashtags_primary"]
-                ))
-            if extracted.get("hashtags_secondary"):
-                existing_sets["secondary"] = list(dict.fromkeys(
-                    existing_sets.get("secondary", []) + extracted["hashtags_secondary"]
-                ))
-            strategy.hashtag_sets = existing_sets
-
-        if extracted.get("additional_notes"):
-            if strategy.additional_notes:
-                strategy.additional_notes += "\n\n" + extracted["additional_notes"]
-            else:
-                strategy.additional_notes = extracted["additional_notes"]
-
     db.commit()
 
+    background_tasks.add_task(strategy_files.process_strategy_file, strategy_file.id)
+
     return JSONResponse({
         "success": True,
         "file_id": strategy_file.id,
         "filename": file.filename,
-        "extracted": extracted
-    })
+        "status": strategy_file.parse_status,
+        "status_url": f"/clients/{client_id}/onboarding/files/{strategy_file.id}"
+    }, status_code=202)
+
+
+@app.get("/clients/{client_id}/onboarding/files/{file_id}")
+async def get_strategy_file_status(client_id: int, file_id: int, db: Session = Depends(get_db)):
+    """Parsing status of an uploaded strategy file, with the extracted fields once done"""
+    strategy_file = db.query(StrategyFile).filter(
+        StrategyFile.id == file_id,
+        StrategyFile.client_id == client_id
+    ).first()
+    if not strategy_file:
+        raise HTTPException(status_code=404, detail="File not found")
+    return strategy_files.status_payload(strategy_file)
 
 
 @app.post("/clients/{client_id}/onboarding/save-strategy")
@@ -1165,10 +1385,12 @@ async def delete_strategy_file(
     if not strategy_file:
         raise HTTPException(status_code=404, detail="File not found")
 
-    # Delete physical file
-    file_path = BASE_DIR / strategy_file.file_path.lstrip("/")
-    if file_path.exists():
-        file_path.unlink()
+    # Delete the physical file unless another upload of the same document still uses it
+    still_used = db.query(StrategyFile).filter(
+        StrategyFile.file_path == strategy_file.file_path,
+        StrategyFile.id != strategy_file.id
+    ).first() is not None
+    await uploads.release(db, client_id, strategy_file.file_path, still_used)
 
     db.delete(strategy_file)
     db.commit()
@@ -1220,8 +1442,10 @@ async def upload_client_profile(
 
     # If file uploaded, read it
     if file and hasattr(file, 'read'):
-        content = await file.read()
-        profile_content = content.decode('utf-8', errors='ignore')
+        try:
+            profile_content = await uploads.read_text_upload(file)
+        except uploads.UploadError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
 
     # Get or create profile record
     profile = db.query(ClientProfile).filter(ClientProfile.client_id == client_id).first()
@@ -1259,8 +1483,10 @@ async def upload_profile_file(
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
 
-    content = await file.read()
-    markdown_content = content.decode('utf-8', errors='ignore')
+    try:
+        markdown_content = await uploads.read_text_upload(file)
+    except uploads.UploadError as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
 
     # Get or create profile
     profile = db.query(ClientProfile).filter(ClientProfile.client_id == client_id).first()
@@ -1303,7 +1529,7 @@ async def view_platform_strategies(request: Request, client_id: int, db: Session
     strategies_by_platform = {s.platform: s for s in strategies}
 
     # Available platforms
-    platforms = ["instagram", "facebook", "gbp", "linkedin", "tiktok", "twitter"]
+    platforms = PLATFORMS
 
     return templates.TemplateResponse("agency/strategies.html", {
         "request": request,
@@ -1355,8 +1581,10 @@ async def upload_platform_strategy(
 
     # If file uploaded, read it
     if file and hasattr(file, 'read'):
-        content = await file.read()
-        strategy_content = content.decode('utf-8', errors='ignore')
+        try:
+            strategy_content = await uploads.read_text_upload(file)
+        except uploads.UploadError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
 
     if not strategy_content:
         raise HTTPException(status_code=400, detail="No content provided")
@@ -1397,8 +1625,10 @@ async def upload_strategy_file_direct(
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
 
-    content = await file.read()
-    markdown_content = content.decode('utf-8', errors='ignore')
+    try:
+        markdown_content = await uploads.read_text_upload(file)
+    except uploads.UploadError as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
 
     # Get or create platform strategy
     strategy = db.query(PlatformStrategy).filter(
@@ -0,0 +1,30 @@
+"""
+Schema Migrations
+
+Versioned, run-once schema changes, applied at deploy time with
+
+    python -m app.migrations upgrade     # apply pending migrations
+    python -m app.migrations status      # list applied / pending
+
+instead of on every import of the app. Applied versions are recorded in the
+schema_version table (version, name, applied_at, duration_ms), so each
+migration runs exactly once and the history of schema changes is visible in
+the database itself.
+
+Migrations live in app/migrations/versions as NNNN_description.py, each
+with an upgrade(conn) function and run in version order. Write them with
+the helpers in ops.py, which check the live schema first - a migration
+that meets a database already in the target state does nothing, and any
+other failure stops the deploy instead of being swallowed.
+
+Set TRANSACTIONAL = False in a migration that builds indexes on big tables:
+it then runs outside a transaction, so Postgres can use CREATE INDEX
+CONCURRENTLY and keep serving writes.
+
+App startup only checks whether migrations are pending (one query) and
+refuses to start if any are; it never changes the schema.
+"""
+
+from .runner import discover, applied_versions, pending_migrations, upgrade, SCHEMA_VERSION_TABLE
+
+__all__ = ["discover", "applied_versions", "pending_migrations", "upgrade", "SCHEMA_VERSION_TABLE"]
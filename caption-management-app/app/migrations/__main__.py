@@ -0,0 +1,46 @@
+"""
+Command line for the schema migrations (run from caption-management-app/):
+
+    python -m app.migrations upgrade [--target N] [--only sqlite|server]
+    python -m app.migrations status
+
+--only makes upgrade a no-op unless DATABASE_URL is that kind of database.
+Deploys use it to migrate a SQLite file from the start command (the only
+step that sees the volume it lives on) and server databases from the
+pre-deploy / release step.
+"""
+
+import sys
+import argparse
+
+from ..database import engine
+from . import applied_versions, discover, upgrade
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.migrations", description="Database schema migrations")
+    commands = parser.add_subparsers(dest="command", required=True)
+    upgrade_parser = commands.add_parser("upgrade", help="apply pending migrations")
+    upgrade_parser.add_argument("--target", type=int, default=None, help="stop after this version")
+    upgrade_parser.add_argument("--only", choices=["sqlite", "server"], default=None,
+                                help="skip unless DATABASE_URL is a SQLite file / a database server")
+    commands.add_parser("status", help="list applied and pending migrations")
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        backend = "sqlite" if engine.dialect.name == "sqlite" else "server"
+        if args.only and args.only != backend:
+            print(f"[Migration] Skipped: --only {args.only}, but DATABASE_URL is a {backend} database")
+            return 0
+        applied = upgrade(engine, target=args.target)
+        print(f"[Migration] {len(applied)} migration(s) applied" if applied else "[Migration] Schema is up to date")
+        return 0
+
+    applied = applied_versions(engine)
+    for migration in discover():
+        print(f"{'applied' if migration.version in applied else 'PENDING':>8}  {migration.version:04d}_{migration.name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+Schema operations for migrations. Each one checks the live schema first and
+does nothing if the change is already there, so a migration also works on a
+database that got part of the way some other way (e.g. created fresh from
+the models by 0001, or patched by hand).
+"""
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+from ..database import Base
+from .. import models  # noqa: F401  (registers the model tables on Base)
+
+
+def dialect(conn: Connection) -> str:
+    return conn.dialect.name
+
+
+def has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(col["name"] == column for col in inspect(conn).get_columns(table))
+
+
+def has_index(conn: Connection, table: str, name: str) -> bool:
+    return any(index["name"] == name for index in inspect(conn).get_indexes(table))
+
+
+def create_tables(conn: Connection, *tables: str):
+    """Create model tables (all of them if none are named) that don't exist yet, with their indexes."""
+    existing = set(inspect(conn).get_table_names())
+    selected = [table for name, table in Base.metadata.tables.items()
+                if name not in existing and (not tables or name in tables)]
+    if selected:
+        Base.metadata.create_all(conn, tables=selected)
+        print(f"[Migration] Created tables: {', '.join(table.name for table in selected)}")
+
+
+def add_column(conn: Connection, table: str, definition: str):
+    """Add a column given as "name TYPE [DEFAULT ...]" unless the table already has it."""
+    column = definition.split()[0]
+    if has_column(conn, table, column):
+        return
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {definition}"))
+    print(f"[Migration] Added {column} column to {table}")
+
+
+def create_index(conn: Connection, name: str, table: str, columns: str, unique: bool = False):
+    """
+    Create an index unless it exists. On Postgres, when the migration runs
+    outside a transaction (TRANSACTIONAL = False), the index is built
+    CONCURRENTLY so the table stays writable; an invalid index left by an
+    interrupted concurrent build is dropped and built again.
+    """
+    concurrently = dialect(conn) == "postgresql" and conn.get_isolation_level() == "AUTOCOMMIT"
+    if concurrently:
+        valid = conn.execute(text(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+        ), {"name": name}).scalar()
+        if valid is False:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    if has_index(conn, table, name):
+        return
+
+    conn.execute(text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX {'CONCURRENTLY ' if concurrently else ''}"
+        f"IF NOT EXISTS {name} ON {table} ({columns})"
+    ))
+    print(f"[Migration] Created index {name} on {table}")
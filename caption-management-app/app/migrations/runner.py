@@ -0,0 +1,115 @@
+"""Finds, orders and applies the migrations in app/migrations/versions."""
+
+import re
+import time
+import importlib
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.engine import Engine
+
+SCHEMA_VERSION_TABLE = "schema_version"
+VERSIONS_DIR = Path(__file__).resolve().parent / "versions"
+VERSION_FILE_RE = re.compile(r"^(\d{4})_(\w+)\.py$")
+# Postgres advisory lock id, so two deploys can't migrate at the same time
+LOCK_ID = 720_180_022
+
+_metadata = MetaData()
+schema_version = Table(
+    SCHEMA_VERSION_TABLE, _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+    Column("duration_ms", Integer),
+)
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+
+    @property
+    def module_name(self) -> str:
+        return f"{__package__}.versions.{self.version:04d}_{self.name}"
+
+    def load(self):
+        return importlib.import_module(self.module_name)
+
+
+def discover() -> list[Migration]:
+    """All migrations, in version order (read from file names; nothing is imported)."""
+    migrations = []
+    for path in VERSIONS_DIR.glob("*.py"):
+        match = VERSION_FILE_RE.match(path.name)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2)))
+    migrations.sort(key=lambda migration: migration.version)
+
+    versions = [migration.version for migration in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration version numbers in {VERSIONS_DIR}")
+    return migrations
+
+
+def applied_versions(engine: Engine) -> set[int]:
+    """Versions recorded in schema_version (empty if the table doesn't exist yet)."""
+    with engine.connect() as conn:
+        if not inspect(conn).has_table(SCHEMA_VERSION_TABLE):
+            return set()
+        return set(conn.execute(select(schema_version.c.version)).scalars())
+
+
+def pending_migrations(engine: Engine) -> list[Migration]:
+    applied = applied_versions(engine)
+    return [migration for migration in discover() if migration.version not in applied]
+
+
+def _record(engine: Engine, migration: Migration, started: float):
+    with engine.begin() as conn:
+        conn.execute(schema_version.insert().values(
+            version=migration.version,
+            name=migration.name,
+            applied_at=datetime.utcnow(),
+            duration_ms=int((time.perf_counter() - started) * 1000)
+        ))
+
+
+def _apply(engine: Engine, migration: Migration):
+    module = migration.load()
+    started = time.perf_counter()
+    if getattr(module, "TRANSACTIONAL", True):
+        with engine.begin() as conn:
+            module.upgrade(conn)
+    else:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            module.upgrade(conn)
+    _record(engine, migration, started)
+
+
+def upgrade(engine: Engine, target: Optional[int] = None) -> list[Migration]:
+    """Apply pending migrations up to target (default: all), in order. Returns those applied."""
+    schema_version.create(engine, checkfirst=True)
+
+    lock = None
+    if engine.dialect.name == "postgresql":
+        lock = engine.connect()
+        lock.execute(text("SELECT pg_advisory_lock(:id)"), {"id": LOCK_ID})
+
+    applied = []
+    try:
+        # Re-read under the lock, another deploy may just have finished
+        for migration in pending_migrations(engine):
+            if target is not None and migration.version > target:
+                break
+            print(f"[Migration] Applying {migration.version:04d}_{migration.name}")
+            _apply(engine, migration)
+            applied.append(migration)
+    finally:
+        if lock is not None:
+            lock.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": LOCK_ID})
+            lock.close()
+    return applied
@@ -0,0 +1,14 @@
+"""
+Create every model table that doesn't exist yet.
+
+On a new database this builds the whole schema (tables, columns and indexes
+as the models declare them now); the later migrations then find their
+changes already in place. On databases from before versioned migrations it
+adds only the tables they are missing.
+"""
+
+from ..ops import create_tables
+
+
+def upgrade(conn):
+    create_tables(conn)
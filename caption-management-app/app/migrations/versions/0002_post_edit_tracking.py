@@ -0,0 +1,9 @@
+"""Original AI caption and an edited flag on posts, for learning from edits."""
+
+from ..ops import add_column
+
+
+def upgrade(conn):
+    add_column(conn, "posts", "original_caption TEXT")
+    add_column(conn, "posts", "original_hashtags TEXT")
+    add_column(conn, "posts", "was_edited BOOLEAN DEFAULT FALSE")
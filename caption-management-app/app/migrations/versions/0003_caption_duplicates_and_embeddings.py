@@ -0,0 +1,22 @@
+"""Near-duplicate flags on posts and binary caption embeddings on posts and previous posts."""
+
+from sqlalchemy import inspect, text
+
+from ..ops import add_column, dialect
+
+
+def upgrade(conn):
+    add_column(conn, "posts", "duplicate_score FLOAT")
+    add_column(conn, "posts", "duplicate_of VARCHAR(50)")
+
+    binary = "BYTEA" if dialect(conn) == "postgresql" else "BLOB"
+    for table in ["posts", "previous_posts"]:
+        add_column(conn, table, f"caption_embedding {binary}")
+        add_column(conn, table, "embedding_model VARCHAR(100)")
+
+    # previous_posts.caption_embedding used to be declared JSON (never written); SQLite stores the bytes as-is
+    if dialect(conn) == "postgresql":
+        columns = {col["name"]: col for col in inspect(conn).get_columns("previous_posts")}
+        if "JSON" in str(columns["caption_embedding"]["type"]).upper():
+            conn.execute(text("ALTER TABLE previous_posts ALTER COLUMN caption_embedding TYPE BYTEA USING NULL"))
+            print("[Migration] Changed previous_posts.caption_embedding to BYTEA")
@@ -0,0 +1,10 @@
+"""Content hashes on photos (Metricool mediaId reuse) and strategy files (uploads stored by content)."""
+
+from ..ops import add_column, create_index
+
+
+def upgrade(conn):
+    add_column(conn, "photos", "content_hash VARCHAR(64)")
+    create_index(conn, "ix_photos_content_hash", "photos", "content_hash")
+    add_column(conn, "strategy_files", "content_hash VARCHAR(64)")
+    create_index(conn, "ix_strategy_files_content_hash", "strategy_files", "content_hash")
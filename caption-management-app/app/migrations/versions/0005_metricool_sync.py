@@ -0,0 +1,8 @@
+"""Metricool reconciliation: change hash per post, and looking posts up by Metricool id."""
+
+from ..ops import add_column, create_index
+
+
+def upgrade(conn):
+    add_column(conn, "posts", "metricool_sync_hash VARCHAR(64)")
+    create_index(conn, "ix_posts_metricool_post_id", "posts", "metricool_post_id")
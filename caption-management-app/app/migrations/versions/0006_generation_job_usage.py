@@ -0,0 +1,9 @@
+"""Bulk run id, latency and token usage on generation jobs."""
+
+from ..ops import add_column
+
+
+def upgrade(conn):
+    for definition in ["run_id VARCHAR(32)", "input_tokens INTEGER", "output_tokens INTEGER", "latency_ms INTEGER",
+                       "cache_read_tokens INTEGER", "cache_creation_tokens INTEGER"]:
+        add_column(conn, "generation_jobs", definition)
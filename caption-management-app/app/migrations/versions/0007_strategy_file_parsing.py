@@ -0,0 +1,10 @@
+"""Background parsing status on strategy files (files from before were parsed during upload, hence 'done')."""
+
+from ..ops import add_column
+
+
+def upgrade(conn):
+    add_column(conn, "strategy_files", "parse_status VARCHAR(20) DEFAULT 'done'")
+    add_column(conn, "strategy_files", "parse_error TEXT")
+    add_column(conn, "strategy_files", "page_count INTEGER")
+    add_column(conn, "strategy_files", "extracted_data JSON")
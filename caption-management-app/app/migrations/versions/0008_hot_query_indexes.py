@@ -0,0 +1,19 @@
+"""
+Indexes for the hot client-scoped queries (see scripts/audit_query_plans.py).
+Built outside a transaction so Postgres can create them CONCURRENTLY.
+"""
+
+from ..ops import create_index
+
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    create_index(conn, "ix_posts_client_created", "posts", "client_id, created_at")
+    create_index(conn, "ix_posts_client_status_scheduled", "posts", "client_id, status, scheduled_date")
+    create_index(conn, "ix_posts_client_edited_updated", "posts", "client_id, was_edited, updated_at")
+    create_index(conn, "ix_posts_client_batch_status", "posts", "client_id, batch_name, status")
+    create_index(conn, "ix_posts_created_at", "posts", "created_at")
+    create_index(conn, "ix_previous_posts_client_id", "previous_posts", "client_id")
+    create_index(conn, "ix_photos_client_id", "photos", "client_id")
+    create_index(conn, "ix_platform_strategies_client_platform", "platform_strategies", "client_id, platform")
@@ -0,0 +1,7 @@
+"""Semantic (embedding) duplicate score on posts, separate from the word-overlap score."""
+
+from ..ops import add_column
+
+
+def upgrade(conn):
+    add_column(conn, "posts", "semantic_duplicate_score FLOAT")
@@ -0,0 +1,14 @@
+"""When each caption embedding was written, so loaded vector indexes pick up captions re-embedded in place."""
+
+from sqlalchemy import text
+
+from ..ops import add_column
+
+
+def upgrade(conn):
+    for table in ("previous_posts", "posts"):
+        add_column(conn, table, "embedded_at TIMESTAMP")
+        conn.execute(text(
+            f"UPDATE {table} SET embedded_at = CURRENT_TIMESTAMP "
+            "WHERE caption_embedding IS NOT NULL AND embedded_at IS NULL"
+        ))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, JSON, Enum
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, JSON, Enum, Float, LargeBinary, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -26,6 +26,13 @@ class Platform(str, enum.Enum):
     GBP = "gbp"  # Google Business Profile
 
 
+class JobStatus(str, enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
 class OnboardingStatus(str, enum.Enum):
     NOT_STARTED = "not_started"
     IN_PROGRESS = "in_progress"
@@ -62,6 +69,9 @@ class Client(Base):
     # Full profile and platform strategies
     client_profile = relationship("ClientProfile", back_populates="client", uselist=False, cascade="all, delete-orphan")
     platform_strategies = relationship("PlatformStrategy", back_populates="client", cascade="all, delete-orphan")
+    generation_jobs = relationship("GenerationJob", back_populates="client", cascade="all, delete-orphan")
+    caption_fingerprints = relationship("CaptionFingerprint", back_populates="client", cascade="all, delete-orphan")
+    metricool_sync_state = relationship("MetricoolSyncState", back_populates="client", uselist=False, cascade="all, delete-orphan")
 
 
 class Strategy(Base):
@@ -105,6 +115,14 @@ class Strategy(Base):
 
 class Post(Base):
     __tablename__ = "posts"
+    # One per hot query - see scripts/audit_query_plans.py
+    __table_args__ = (
+        Index("ix_posts_client_created", "client_id", "created_at"),  # client page, posts API
+        Index("ix_posts_client_status_scheduled", "client_id", "status", "scheduled_date"),  # review portal, posts API by status, Metricool sync
+        Index("ix_posts_client_edited_updated", "client_id", "was_edited", "updated_at"),  # learning from edits during generation
+        Index("ix_posts_client_batch_status", "client_id", "batch_name", "status"),  # batch scheduling
+        Index("ix_posts_created_at", "created_at"),  # dashboard recent posts
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     client_id = Column(Integer, ForeignKey("clients.id"))
@@ -134,7 +152,16 @@ class Post(Base):
     revision_notes = Column(Text, nullable=True)
 
     # Metricool integration
-    metricool_post_id = Column(String(100), nullable=True)
+    metricool_post_id = Column(String(100), nullable=True, index=True)
+    metricool_sync_hash = Column(String(64), nullable=True)  # Hash of the Metricool copy as of the last sync
+
+    # Near-duplicate check, filled in when the post is generated
+    duplicate_score = Column(Float, nullable=True)  # Word overlap (MinHash Jaccard) with the closest earlier caption
+    semantic_duplicate_score = Column(Float, nullable=True)  # Cosine similarity, set when the embedding check flagged it
+    duplicate_of = Column(String(50), nullable=True)  # e.g. "previous:12" or "post:40", set when above threshold
+    caption_embedding = Column(LargeBinary, nullable=True)  # Packed float16 vector, see services/embeddings.py
+    embedding_model = Column(String(100), nullable=True)
+    embedded_at = Column(DateTime, nullable=True)  # When caption_embedding was written
 
     # Timestamps
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -153,14 +180,16 @@ class PreviousPost(Base):
     __tablename__ = "previous_posts"
 
     id = Column(Integer, primary_key=True, index=True)
-    client_id = Column(Integer, ForeignKey("clients.id"))
+    client_id = Column(Integer, ForeignKey("clients.id"), index=True)
 
     caption = Column(Text)
     platform = Column(String(50))
     posted_date = Column(DateTime)
 
     # For similarity checking
-    caption_embedding = Column(JSON, nullable=True)  # Store embedding for similarity search
+    caption_embedding = Column(LargeBinary, nullable=True)  # Packed float16 vector, see services/embeddings.py
+    embedding_model = Column(String(100), nullable=True)  # Provider/model that produced caption_embedding
+    embedded_at = Column(DateTime, nullable=True)  # When caption_embedding was written
 
     client = relationship("Client", back_populates="previous_posts")
 
@@ -169,12 +198,13 @@ class Photo(Base):
     __tablename__ = "photos"
 
     id = Column(Integer, primary_key=True, index=True)
-    client_id = Column(Integer, ForeignKey("clients.id"))
+    client_id = Column(Integer, ForeignKey("clients.id"), index=True)
 
     filename = Column(String(255))
     original_filename = Column(String(255))
     file_path = Column(String(500))
     thumbnail_path = Column(String(500), nullable=True)
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 of the file
 
     # Metadata
     description = Column(Text, nullable=True)  # For AI matching
@@ -255,6 +285,7 @@ class StrategyFile(Base):
     original_filename = Column(String(255))
     file_path = Column(String(500))
     file_type = Column(String(50))  # pdf, docx, txt, etc.
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 of the file
 
     # Extracted content summary
     extracted_summary = Column(Text, nullable=True)
@@ -262,6 +293,12 @@ class StrategyFile(Base):
     # Whether this file was processed
     processed = Column(Boolean, default=False)
 
+    # Background parsing: pending -> extracting -> analyzing -> done / failed
+    parse_status = Column(String(20), default="pending")
+    parse_error = Column(Text, nullable=True)
+    page_count = Column(Integer, nullable=True)
+    extracted_data = Column(JSON, nullable=True)  # Fields Claude extracted, shown once parsing is done
+
     # Timestamps
     uploaded_at = Column(DateTime, default=datetime.utcnow)
 
@@ -302,6 +339,7 @@ class PlatformStrategy(Base):
     Stores full markdown strategy for each platform (IG, FB, GBP, etc.)
     """
     __tablename__ = "platform_strategies"
+    __table_args__ = (Index("ix_platform_strategies_client_platform", "client_id", "platform"),)
 
     id = Column(Integer, primary_key=True, index=True)
     client_id = Column(Integer, ForeignKey("clients.id"))
@@ -320,6 +358,47 @@ class PlatformStrategy(Base):
     client = relationship("Client", back_populates="platform_strategies")
 
 
+class GenerationJob(Base):
+    """
+    Queued caption generation request.
+    Created by the generate route and drained by the background worker pool,
+    so long LLM round trips never hold an HTTP request open.
+    """
+    __tablename__ = "generation_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    client_id = Column(Integer, ForeignKey("clients.id"))
+    run_id = Column(String(32), nullable=True, index=True)  # Groups jobs created by one bulk request
+
+    # Generation parameters
+    platform = Column(String(50), nullable=False)
+    num_captions = Column(Integer, default=5)
+    content_theme = Column(String(255), nullable=True)
+    specific_topic = Column(Text, nullable=True)
+    batch_name = Column(String(100))
+
+    # Progress tracking
+    status = Column(String(50), default=JobStatus.PENDING, index=True)
+    attempts = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    post_ids = Column(JSON, nullable=True)  # IDs of Posts created by this job
+
+    # Cost and latency of the last attempt
+    input_tokens = Column(Integer, nullable=True)
+    output_tokens = Column(Integer, nullable=True)
+    cache_read_tokens = Column(Integer, nullable=True)  # Input tokens served from the prompt cache
+    cache_creation_tokens = Column(Integer, nullable=True)  # Input tokens written to the prompt cache
+    latency_ms = Column(Integer, nullable=True)
+
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+
+    # Relationship
+    client = relationship("Client", back_populates="generation_jobs")
+
+
 # Define the audit checklists for each platform
 AUDIT_CHECKLISTS = {
     "facebook": {
@@ -403,3 +482,95 @@ AUDIT_CHECKLISTS = {
         ]
     }
 }
+
+
+class CaptionFingerprint(Base):
+    """
+    MinHash signature of a PreviousPost or Post caption.
+    Loaded into the per-client LSH index used for near-duplicate lookups.
+    """
+    __tablename__ = "caption_fingerprints"
+    __table_args__ = (UniqueConstraint("source", "source_id", name="uq_caption_fingerprint_source"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    client_id = Column(Integer, ForeignKey("clients.id"), index=True)
+    source = Column(String(20), nullable=False)  # "previous" or "post"
+    source_id = Column(Integer, nullable=False)
+    signature = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    client = relationship("Client", back_populates="caption_fingerprints")
+
+
+class MetricoolMedia(Base):
+    """
+    Metricool mediaId returned for a photo, keyed by file content hash and
+    where it is stored (public URL or bucket location). Reused until it expires.
+    """
+    __tablename__ = "metricool_media"
+    __table_args__ = (UniqueConstraint("content_hash", "media_url", name="uq_metricool_media_hash_url"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(64), nullable=False, index=True)
+    media_url = Column(String(1000), nullable=False)  # storage.location() of the file
+    media_id = Column(String(500), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
+
+
+class MetricoolSyncState(Base):
+    """
+    Per-client cursor for reconciling Posts with Metricool's scheduled posts.
+    Each sync only fetches posts published on or after window_start.
+    """
+    __tablename__ = "metricool_sync_state"
+
+    id = Column(Integer, primary_key=True, index=True)
+    client_id = Column(Integer, ForeignKey("clients.id"), unique=True)
+
+    window_start = Column(DateTime, nullable=True)
+    last_synced_at = Column(DateTime, nullable=True)
+    last_status = Column(String(20), nullable=True)  # "ok" or "error"
+    last_error = Column(Text, nullable=True)
+    fetched = Column(Integer, default=0)  # Metricool posts returned by the last sync
+    changed = Column(Integer, default=0)  # Local posts updated by the last sync
+
+    client = relationship("Client", back_populates="metricool_sync_state")
+
+
+class StoredObject(Base):
+    """
+    A file written by the upload storage layer (services/uploads.py).
+    One row per distinct content per client and kind, so re-uploads reuse it.
+    """
+    __tablename__ = "stored_objects"
+    __table_args__ = (UniqueConstraint("client_id", "kind", "content_hash", name="uq_stored_object_content"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    client_id = Column(Integer, ForeignKey("clients.id"), index=True)
+    kind = Column(String(20), nullable=False)  # "photo" or "strategy"
+    content_hash = Column(String(64), nullable=False)
+    path = Column(String(500), nullable=False)  # Public path, e.g. /static/uploads/acme/ab12...jpg
+    filename = Column(String(255))
+    original_filename = Column(String(255))
+    content_type = Column(String(100), nullable=True)
+    size = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class StrategyExtraction(Base):
+    """
+    Strategy fields Claude extracted from a document, keyed by the file's
+    content hash so uploading the same document again costs nothing.
+    Rows from an older extractor_version are recomputed.
+    """
+    __tablename__ = "strategy_extractions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(64), nullable=False, unique=True, index=True)
+    extractor_version = Column(Integer, nullable=False)
+    extracted_data = Column(JSON, nullable=False)
+    page_count = Column(Integer, nullable=True)
+    chunk_count = Column(Integer, default=1)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
@@ -1,8 +1,8 @@
-import os
-from anthropic import Anthropic
-from typing import Optional
+from typing import Optional, AsyncIterator
 import json
 
+from . import llm
+from .response_parser import JSONArrayStreamParser, parse_json_array, validate_item
 from .expert_frameworks import (
     build_enhanced_caption_prompt,
     get_experts_for_client,
@@ -10,60 +10,69 @@ from .expert_frameworks import (
     PLATFORM_BENCHMARKS
 )
 
-client = None
-
-def get_anthropic_client():
-    global client
-    if client is None:
-        api_key = os.getenv("ANTHROPIC_API_KEY")
-        if api_key:
-            client = Anthropic(api_key=api_key)
-    return client
-
 
 def get_available_industries() -> list[str]:
     """Return list of industries with mapped expert councils."""
     return list(INDUSTRY_EXPERT_MAPPING.keys())
 
 
-def generate_captions_with_full_context(
+def normalize_hashtags(hashtags: list) -> list[str]:
+    """Hashtags without the leading '#' (it is added when the post is saved)."""
+    return [str(h).strip().lstrip("#") for h in hashtags if str(h).strip().lstrip("#")]
+
+
+CAPTION_SCHEMA = {
+    "caption": {"type": str, "required": True},
+    "hashtags": {"type": list, "default": [], "clean": normalize_hashtags},
+    "hook": {"type": str},
+    "content_pillar": {"type": str},
+    "cta": {"type": str},
+    "format_recommendation": {"type": str},
+    "reasoning": {"type": str},
+}
+
+PHOTO_MATCH_SCHEMA = {
+    "photo_id": {"type": int, "required": True},
+    "relevance_score": {"type": float, "default": 0.0},
+    "reasoning": {"type": str},
+}
+
+
+def parse_captions_response(response_text: str) -> list[dict]:
+    """
+    Pull the caption objects out of a generation response.
+    Malformed captions are logged and skipped; the rest are kept.
+    Returns [{"error": ...}] only when nothing usable came back.
+    """
+    result = parse_json_array(response_text, CAPTION_SCHEMA)
+    if not result.items:
+        return [{"error": f"Generation failed: {result.describe_failures() or 'no captions in response'}"}]
+
+    if result.failures:
+        print(f"[Caption Generator] Dropped {len(result.failures)} malformed caption(s): {result.describe_failures()}")
+    if result.truncated:
+        print(f"[Caption Generator] Response was cut off, kept {len(result.items)} complete caption(s)")
+    return result.items
+
+
+def build_full_context_prefix(
     client_name: str,
     profile_markdown: str,
     master_strategy_markdown: Optional[str],
     platform_strategy_markdown: Optional[str],
-    previous_posts: list[str],
-    num_captions: int = 5,
-    platform: str = "instagram",
-    content_theme: Optional[str] = None,
-    specific_topic: Optional[str] = None,
-    edited_examples: Optional[list[dict]] = None
-) -> list[dict]:
+    platform: str
+) -> str:
     """
-    Generate captions using FULL profile and strategy documents.
-    
-    This is the enhanced generator that uses all the rich context from your
-    Claude Skills outputs (CLIENT_PROFILE.md, MASTER_STRATEGY.md, platform strategies).
-    
-    Args:
-        client_name: Name of the client
-        profile_markdown: Full 00_CLIENT_PROFILE.md content
-        master_strategy_markdown: Full 00_MASTER_STRATEGY.md content (optional)
-        platform_strategy_markdown: Full platform-specific strategy (e.g., 00_IG_STRATEGY.md)
-        previous_posts: List of previous caption texts to avoid duplication
-        num_captions: Number of captions to generate
-        platform: Target platform (instagram, facebook, gbp, linkedin, tiktok)
-        content_theme: Optional content pillar to focus on
-        specific_topic: Optional specific topic to address
-        edited_examples: List of {original, edited} dicts showing how user refined captions
-    """
-    anthropic = get_anthropic_client()
-    if not anthropic:
-        return [{"error": "Anthropic API key not configured"}]
+    Build the stable part of the full-context prompt: profile, master strategy,
+    platform strategy and platform specs.
 
+    This only changes when the client's documents change, so it is sent as a
+    cached system prefix and repeat generations for the same client/platform
+    read it from the prompt cache instead of paying for it again.
+    """
     # Get platform specs
     platform_specs = PLATFORM_BENCHMARKS.get(platform.lower(), PLATFORM_BENCHMARKS.get("instagram", {}))
-    
-    # Build the comprehensive prompt with full context
+
     prompt = f"""You are an expert social media copywriter for {client_name}.
 
 You have access to their COMPLETE strategy documentation. Use ALL of this context to create perfectly on-brand captions.
@@ -116,10 +125,39 @@ You have access to their COMPLETE strategy documentation. Use ALL of this contex
             prompt += f"- Mix: {ht['mix']}\n"
         prompt += "\n"
 
-    # Add previous posts for deduplication
-    prompt += f"""---
+    return prompt
+
+
+def build_full_context_request(
+    client_name: str,
+    profile_markdown: str,
+    master_strategy_markdown: Optional[str],
+    platform_strategy_markdown: Optional[str],
+    previous_posts: list[str],
+    num_captions: int = 5,
+    platform: str = "instagram",
+    content_theme: Optional[str] = None,
+    specific_topic: Optional[str] = None,
+    edited_examples: Optional[list[dict]] = None
+) -> tuple[str, str]:
+    """
+    Build the (system, prompt) pair for full-context generation.
+
+    The system part is the cached per-client prefix from
+    build_full_context_prefix; the prompt holds everything that changes per
+    request (previous posts, learned edits, the generation task).
+    """
+    # Stable per-client context goes in the cached system prefix
+    context = build_full_context_prefix(
+        client_name=client_name,
+        profile_markdown=profile_markdown,
+        master_strategy_markdown=master_strategy_markdown,
+        platform_strategy_markdown=platform_strategy_markdown,
+        platform=platform
+    )
 
-# PREVIOUS POSTS (DO NOT DUPLICATE THEMES OR HOOKS)
+    # Add previous posts for deduplication
+    prompt = f"""# PREVIOUS POSTS (DO NOT DUPLICATE THEMES OR HOOKS)
 
 {chr(10).join([f"- {post[:200]}..." if len(post) > 200 else f"- {post}" for post in previous_posts[-20:]]) if previous_posts else "No previous posts yet."}
 
@@ -201,65 +239,77 @@ Return a JSON array with exactly """ + str(num_captions) + """ objects:
 
 Generate {num_captions} unique, perfectly on-brand captions now. Every caption should sound like it came directly from {client_name}'s internal team.""".replace("{num_captions}", str(num_captions)).replace("{client_name}", client_name)
 
-    try:
-        response = anthropic.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4096,
-            messages=[{"role": "user", "content": prompt}]
-        )
+    return context, prompt
 
-        # Extract JSON from response
-        response_text = response.content[0].text
-
-        # Try to parse JSON from the response
-        if "```json" in response_text:
-            json_start = response_text.find("```json") + 7
-            json_end = response_text.find("```", json_start)
-            json_str = response_text[json_start:json_end].strip()
-        elif "```" in response_text:
-            json_start = response_text.find("```") + 3
-            json_end = response_text.find("```", json_start)
-            json_str = response_text[json_start:json_end].strip()
-        else:
-            json_start = response_text.find("[")
-            json_end = response_text.rfind("]") + 1
-            json_str = response_text[json_start:json_end]
-
-        captions = json.loads(json_str)
-        return captions
 
-    except Exception as e:
-        return [{"error": f"Generation failed: {str(e)}"}]
-
-
-def generate_captions(
-    strategy: dict,
+async def generate_captions_with_full_context(
+    client_name: str,
+    profile_markdown: str,
+    master_strategy_markdown: Optional[str],
+    platform_strategy_markdown: Optional[str],
     previous_posts: list[str],
     num_captions: int = 5,
     platform: str = "instagram",
     content_theme: Optional[str] = None,
     specific_topic: Optional[str] = None,
-    use_expert_frameworks: bool = True
+    edited_examples: Optional[list[dict]] = None
 ) -> list[dict]:
     """
-    Generate captions based on client strategy, avoiding duplication with previous posts.
-
-    Uses selective expert frameworks (Schwartz, Ogilvy, Cialdini, etc.) based on
-    client industry to produce higher-quality, on-brand captions.
-
+    Generate captions using FULL profile and strategy documents.
+    
+    This is the enhanced generator that uses all the rich context from your
+    Claude Skills outputs (CLIENT_PROFILE.md, MASTER_STRATEGY.md, platform strategies).
+    
     Args:
-        strategy: Client strategy dict with brand_voice, content_pillars, etc.
+        client_name: Name of the client
+        profile_markdown: Full 00_CLIENT_PROFILE.md content
+        master_strategy_markdown: Full 00_MASTER_STRATEGY.md content (optional)
+        platform_strategy_markdown: Full platform-specific strategy (e.g., 00_IG_STRATEGY.md)
         previous_posts: List of previous caption texts to avoid duplication
         num_captions: Number of captions to generate
-        platform: Target platform (instagram, facebook, linkedin, tiktok)
+        platform: Target platform (instagram, facebook, gbp, linkedin, tiktok)
         content_theme: Optional content pillar to focus on
         specific_topic: Optional specific topic to address
-        use_expert_frameworks: Whether to use the enhanced expert council system
+        edited_examples: List of {original, edited} dicts showing how user refined captions
     """
-    anthropic = get_anthropic_client()
-    if not anthropic:
+    if not llm.get_async_anthropic_client():
         return [{"error": "Anthropic API key not configured"}]
 
+    context, prompt = build_full_context_request(
+        client_name=client_name,
+        profile_markdown=profile_markdown,
+        master_strategy_markdown=master_strategy_markdown,
+        platform_strategy_markdown=platform_strategy_markdown,
+        previous_posts=previous_posts,
+        num_captions=num_captions,
+        platform=platform,
+        content_theme=content_theme,
+        specific_topic=specific_topic,
+        edited_examples=edited_examples
+    )
+
+    try:
+        response = await llm.create_message(prompt, max_tokens=4096, system=context, cache_system=True)
+
+        return parse_captions_response(response.content[0].text)
+
+    except Exception as e:
+        return [{"error": f"Generation failed: {str(e)}"}]
+
+
+def build_strategy_prompt(
+    strategy: dict,
+    previous_posts: list[str],
+    num_captions: int = 5,
+    platform: str = "instagram",
+    content_theme: Optional[str] = None,
+    specific_topic: Optional[str] = None,
+    use_expert_frameworks: bool = True
+) -> str:
+    """
+    Build the generation prompt from a legacy strategy dict, using the expert
+    council prompt unless use_expert_frameworks is False.
+    """
     # Use the enhanced expert-driven prompt
     if use_expert_frameworks:
         prompt = build_enhanced_caption_prompt(
@@ -272,7 +322,7 @@ def generate_captions(
         )
 
         # Log which experts are being used (helpful for debugging)
-        industry = strategy.get('industry', 'default')
+        industry = strategy.get('industry') or 'default'
         experts = get_experts_for_client(industry, content_theme)
         expert_names = [e['name'] for e in experts['primary']]
         print(f"[Caption Generator] Using expert council: {', '.join(expert_names)} for {industry}")
@@ -297,45 +347,100 @@ def generate_captions(
 Return a JSON array with {num_captions} caption objects with: caption, hashtags, content_pillar, hook, cta, reasoning.
 """
 
+    return prompt
+
+
+async def generate_captions(
+    strategy: dict,
+    previous_posts: list[str],
+    num_captions: int = 5,
+    platform: str = "instagram",
+    content_theme: Optional[str] = None,
+    specific_topic: Optional[str] = None,
+    use_expert_frameworks: bool = True
+) -> list[dict]:
+    """
+    Generate captions based on client strategy, avoiding duplication with previous posts.
+
+    Uses selective expert frameworks (Schwartz, Ogilvy, Cialdini, etc.) based on
+    client industry to produce higher-quality, on-brand captions.
+
+    Args:
+        strategy: Client strategy dict with brand_voice, content_pillars, etc.
+        previous_posts: List of previous caption texts to avoid duplication
+        num_captions: Number of captions to generate
+        platform: Target platform (instagram, facebook, linkedin, tiktok)
+        content_theme: Optional content pillar to focus on
+        specific_topic: Optional specific topic to address
+        use_expert_frameworks: Whether to use the enhanced expert council system
+    """
+    if not llm.get_async_anthropic_client():
+        return [{"error": "Anthropic API key not configured"}]
+
+    prompt = build_strategy_prompt(
+        strategy=strategy,
+        previous_posts=previous_posts,
+        num_captions=num_captions,
+        platform=platform,
+        content_theme=content_theme,
+        specific_topic=specific_topic,
+        use_expert_frameworks=use_expert_frameworks
+    )
+
     try:
-        response = anthropic.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4096,
-            messages=[{"role": "user", "content": prompt}]
-        )
+        response = await llm.create_message(prompt, max_tokens=4096)
 
-        # Extract JSON from response
-        response_text = response.content[0].text
-
-        # Try to parse JSON from the response
-        # Handle both direct JSON and markdown-wrapped JSON
-        if "```json" in response_text:
-            json_start = response_text.find("```json") + 7
-            json_end = response_text.find("```", json_start)
-            json_str = response_text[json_start:json_end].strip()
-        elif "```" in response_text:
-            json_start = response_text.find("```") + 3
-            json_end = response_text.find("```", json_start)
-            json_str = response_text[json_start:json_end].strip()
-        else:
-            # Try to find JSON array directly
-            json_start = response_text.find("[")
-            json_end = response_text.rfind("]") + 1
-            json_str = response_text[json_start:json_end]
-
-        captions = json.loads(json_str)
-        return captions
+        return parse_captions_response(response.content[0].text)
 
     except Exception as e:
         return [{"error": f"Generation failed: {str(e)}"}]
 
 
+async def stream_captions(
+    prompt: str,
+    system: Optional[str] = None,
+    cache_system: bool = False
+) -> AsyncIterator[dict]:
+    """
+    Stream a generation prompt and yield each caption object as soon as it is
+    complete in Claude's output. Yields a single {"error": ...} dict on failure;
+    captions already yielded before a failure stay valid.
+    """
+    if not llm.get_async_anthropic_client():
+        yield {"error": "Anthropic API key not configured"}
+        return
+
+    parser = JSONArrayStreamParser()
+    count = 0
+    try:
+        async for text in llm.stream_message(prompt, max_tokens=4096, system=system, cache_system=cache_system):
+            for item in parser.feed(text):
+                caption, error = validate_item(item, CAPTION_SCHEMA)
+                if error:
+                    print(f"[Caption Generator] Skipped malformed caption: {error}")
+                    continue
+                count += 1
+                yield caption
+    except Exception as e:
+        yield {"error": f"Generation failed: {str(e)}"}
+        return
+
+    parser.finish()
+    for failure in parser.failures:
+        print(f"[Caption Generator] Skipped malformed caption {failure['index'] + 1}: {failure['error']}")
+    if not count:
+        yield {"error": "Generation failed: no captions found in the response"}
+
+
 def check_similarity(new_caption: str, previous_posts: list[str], threshold: float = 0.7) -> dict:
     """
-    Check if a new caption is too similar to previous posts.
+    Check if a new caption is too similar to a list of previous posts.
     Returns similarity info.
+
+    This scans every post, so it is only meant for small ad-hoc lists. For a
+    client's saved history use dedup_index.find_similar, which is indexed.
     """
-    # Simple word overlap check (could be enhanced with embeddings later)
+    # Simple word overlap check
     new_words = set(new_caption.lower().split())
 
     most_similar = None
@@ -360,12 +465,11 @@ def check_similarity(new_caption: str, previous_posts: list[str], threshold: flo
     }
 
 
-def suggest_photo_match(caption: str, photo_descriptions: list[dict]) -> list[dict]:
+async def suggest_photo_match(caption: str, photo_descriptions: list[dict]) -> list[dict]:
     """
     Suggest photos that might match a caption based on descriptions/tags.
     """
-    anthropic = get_anthropic_client()
-    if not anthropic or not photo_descriptions:
+    if not llm.get_async_anthropic_client() or not photo_descriptions:
         return []
 
     prompt = f"""Given this social media caption:
@@ -388,22 +492,11 @@ Which photos would best match this caption? Return a JSON array of photo IDs ran
 Only include photos with relevance_score > 0.5. Return empty array if no good matches."""
 
     try:
-        response = anthropic.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1024,
-            messages=[{"role": "user", "content": prompt}]
-        )
+        response = await llm.create_message(prompt, max_tokens=1024)
 
-        response_text = response.content[0].text
-        if "```json" in response_text:
-            json_start = response_text.find("```json") + 7
-            json_end = response_text.find("```", json_start)
-            json_str = response_text[json_start:json_end].strip()
-        else:
-            json_start = response_text.find("[")
-            json_end = response_text.rfind("]") + 1
-            json_str = response_text[json_start:json_end]
-
-        return json.loads(json_str)
-    except:
+        result = parse_json_array(response.content[0].text, PHOTO_MATCH_SCHEMA)
+        if result.failures:
+            print(f"[Caption Generator] Dropped photo matches: {result.describe_failures()}")
+        return result.items
+    except Exception:
         return []
@@ -0,0 +1,306 @@
+"""
+Near-Duplicate Caption Index
+
+Each caption (PreviousPost or Post) is reduced to a MinHash signature of its
+word set and stored as a CaptionFingerprint row. Per client, the signatures
+are loaded once into an in-memory LSH index (banded buckets), so "which
+earlier captions are close to this one?" only compares against the handful
+of captions that share a bucket instead of scanning every previous post.
+
+The in-memory index syncs itself from the fingerprint table by row id on
+every lookup, so captions indexed by another process show up without a full
+reload. Older rows that predate the table are fingerprinted on first load.
+
+Similarity is the estimated Jaccard overlap of the two word sets (0-1).
+Set DUPLICATE_THRESHOLD to change when a generated post is flagged
+(default 0.6).
+"""
+
+import os
+import re
+import random
+import hashlib
+import threading
+from array import array
+from typing import Optional
+
+from sqlalchemy import and_
+from sqlalchemy.orm import Session
+
+from ..models import CaptionFingerprint, PreviousPost, Post
+
+NUM_PERM = 128
+BANDS = 32
+ROWS_PER_BAND = NUM_PERM // BANDS
+DEFAULT_THRESHOLD = 0.6
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_WORD_RE = re.compile(r"[a-z0-9']+")
+
+# Fixed seed so signatures stay comparable across processes and restarts
+_rng = random.Random(20240611)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+]
+
+_indexes: dict[int, "LSHIndex"] = {}
+_lock = threading.Lock()
+
+
+def get_threshold() -> float:
+    """Read the duplicate threshold from the environment."""
+    try:
+        return float(os.getenv("DUPLICATE_THRESHOLD", DEFAULT_THRESHOLD))
+    except ValueError:
+        return DEFAULT_THRESHOLD
+
+
+def caption_signature(caption: str) -> Optional[tuple]:
+    """MinHash signature of a caption's word set, or None if it has no words."""
+    words = set(_WORD_RE.findall((caption or "").lower()))
+    if not words:
+        return None
+
+    hashes = [int.from_bytes(hashlib.blake2b(w.encode(), digest_size=8).digest(), "little") for w in words]
+    return tuple(
+        min((a * h + b) % _MERSENNE_PRIME for h in hashes) & _MAX_HASH
+        for a, b in _PERMUTATIONS
+    )
+
+
+def signature_to_bytes(signature: tuple) -> bytes:
+    return array("I", signature).tobytes()
+
+
+def signature_from_bytes(data: bytes) -> tuple:
+    signature = array("I")
+    signature.frombytes(data)
+    return tuple(signature)
+
+
+def estimate_similarity(a: tuple, b: tuple) -> float:
+    """Estimated Jaccard similarity: the share of matching MinHash slots."""
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERM
+
+
+class LSHIndex:
+    """In-memory banded LSH index over the fingerprints of one client."""
+
+    def __init__(self):
+        self.signatures: dict[tuple, tuple] = {}
+        self.buckets: list[dict[tuple, set]] = [{} for _ in range(BANDS)]
+        self.last_row_id = 0
+        self.backfilled = False
+
+    @staticmethod
+    def _bands(signature: tuple):
+        for band in range(BANDS):
+            start = band * ROWS_PER_BAND
+            yield band, signature[start:start + ROWS_PER_BAND]
+
+    def add(self, key: tuple, signature: tuple):
+        """Insert or replace the signature stored under key ((source, source_id))."""
+        self.remove(key)
+        self.signatures[key] = signature
+        for band, chunk in self._bands(signature):
+            self.buckets[band].setdefault(chunk, set()).add(key)
+
+    def remove(self, key: tuple):
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for band, chunk in self._bands(signature):
+            bucket = self.buckets[band].get(chunk)
+            if bucket:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band][chunk]
+
+    def query(self, signature: tuple, threshold: float, limit: int = 5, exclude: Optional[set] = None) -> list[tuple]:
+        """Keys whose estimated similarity is >= threshold, best first, as (key, score) pairs."""
+        candidates = set()
+        for band, chunk in self._bands(signature):
+            bucket = self.buckets[band].get(chunk)
+            if bucket:
+                candidates |= bucket
+        if exclude:
+            candidates -= exclude
+
+        scored = []
+        for key in candidates:
+            score = estimate_similarity(signature, self.signatures[key])
+            if score >= threshold:
+                scored.append((key, score))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:limit]
+
+    def __len__(self):
+        return len(self.signatures)
+
+
+def _backfill(db: Session, client_id: int) -> int:
+    """Fingerprint captions that were saved before they were being indexed."""
+    missing = []
+    for source, model in (("previous", PreviousPost), ("post", Post)):
+        rows = db.query(model.id, model.caption).outerjoin(
+            CaptionFingerprint,
+            and_(CaptionFingerprint.source == source, CaptionFingerprint.source_id == model.id)
+        ).filter(
+            model.client_id == client_id,
+            CaptionFingerprint.id.is_(None)
+        ).all()
+        missing.extend((source, row_id, caption) for row_id, caption in rows)
+
+    count = 0
+    for source, source_id, caption in missing:
+        signature = caption_signature(caption)
+        if signature is None:
+            continue
+        db.add(CaptionFingerprint(
+            client_id=client_id,
+            source=source,
+            source_id=source_id,
+            signature=signature_to_bytes(signature)
+        ))
+        count += 1
+
+    if count:
+        db.commit()
+        print(f"[Dedup Index] Fingerprinted {count} existing captions for client {client_id}")
+    return count
+
+
+def get_client_index(db: Session, client_id: int) -> LSHIndex:
+    """Return the client's index, loading any fingerprint rows added since the last call."""
+    with _lock:
+        index = _indexes.get(client_id)
+        if index is None:
+            index = _indexes[client_id] = LSHIndex()
+
+        if not index.backfilled:
+            _backfill(db, client_id)
+            index.backfilled = True
+
+        rows = db.query(
+            CaptionFingerprint.id, CaptionFingerprint.source, CaptionFingerprint.source_id, CaptionFingerprint.signature
+        ).filter(
+            CaptionFingerprint.client_id == client_id,
+            CaptionFingerprint.id > index.last_row_id
+        ).order_by(CaptionFingerprint.id).all()
+
+        for row_id, source, source_id, signature in rows:
+            index.add((source, source_id), signature_from_bytes(signature))
+            index.last_row_id = row_id
+
+        return index
+
+
+def _store_fingerprints(db: Session, client_id: int, items: list[tuple]) -> list[tuple]:
+    """
+    Replace the fingerprint rows for (source, source_id, caption) items.
+    Returns (key, signature) pairs; signature is None for captions with no words.
+    """
+    for source in {item[0] for item in items}:
+        source_ids = [item[1] for item in items if item[0] == source]
+        # Chunked to stay under SQLite's bound-parameter limit on big imports
+        for start in range(0, len(source_ids), 500):
+            db.query(CaptionFingerprint).filter(
+                CaptionFingerprint.source == source,
+                CaptionFingerprint.source_id.in_(source_ids[start:start + 500])
+            ).delete(synchronize_session=False)
+
+    indexed = []
+    for source, source_id, caption in items:
+        signature = caption_signature(caption)
+        if signature is None:
+            indexed.append(((source, source_id), None))
+            continue
+        db.add(CaptionFingerprint(
+            client_id=client_id,
+            source=source,
+            source_id=source_id,
+            signature=signature_to_bytes(signature)
+        ))
+        indexed.append(((source, source_id), signature))
+    return indexed
+
+
+def index_captions(db: Session, client_id: int, items: list[tuple]):
+    """
+    Fingerprint new or edited captions and add them to the client's index.
+    items are (source, source_id, caption) with source "previous" or "post".
+    """
+    if not items:
+        return
+    indexed = _store_fingerprints(db, client_id, items)
+    db.commit()
+
+    with _lock:
+        index = _indexes.get(client_id)
+        if index is not None:
+            for key, signature in indexed:
+                if signature is None:
+                    index.remove(key)
+                else:
+                    index.add(key, signature)
+
+
+def find_similar(
+    db: Session,
+    client_id: int,
+    caption: str,
+    threshold: Optional[float] = None,
+    limit: int = 5,
+    exclude: Optional[set] = None
+) -> list[dict]:
+    """Closest earlier captions for a client with similarity at or above the threshold."""
+    signature = caption_signature(caption)
+    if signature is None:
+        return []
+
+    index = get_client_index(db, client_id)
+    matches = index.query(signature, get_threshold() if threshold is None else threshold, limit, exclude)
+    return [{"source": source, "source_id": source_id, "similarity": round(score, 3)}
+            for (source, source_id), score in matches]
+
+
+def flag_duplicates(db: Session, client_id: int, posts: list[Post]) -> int:
+    """
+    Score freshly generated posts against everything the client already has
+    (and against each other), store the score on each post, and index them.
+    Returns how many were flagged as duplicates.
+    """
+    threshold = get_threshold()
+    index = get_client_index(db, client_id)
+
+    # The first load of a client's index may already hold this batch (backfill),
+    # so each post is only compared with history and the posts before it
+    pending = {("post", post.id) for post in posts}
+
+    flagged = 0
+    with _lock:
+        for post in posts:
+            key = ("post", post.id)
+            signature = caption_signature(post.caption)
+            if signature is None:
+                pending.discard(key)
+                continue
+
+            matches = index.query(signature, 0.0, limit=1, exclude=pending)
+            best_key, best_score = matches[0] if matches else (None, 0.0)
+            post.duplicate_score = round(best_score, 3)
+            if best_key and best_score >= threshold:
+                post.duplicate_of = f"{best_key[0]}:{best_key[1]}"
+                flagged += 1
+
+            index.add(key, signature)
+            pending.discard(key)
+
+    _store_fingerprints(db, client_id, [("post", post.id, post.caption) for post in posts])
+    db.commit()
+
+    if flagged:
+        print(f"[Dedup Index] Flagged {flagged} of {len(posts)} new posts as near-duplicates for client {client_id}")
+    return flagged
@@ -0,0 +1,353 @@
+"""
+Caption Embeddings
+
+Computes embedding vectors for previous posts and generated posts, stores
+them on the rows (caption_embedding, as packed float16 bytes) and keeps a
+per-client in-memory NumPy matrix for cosine top-k search.
+
+Providers are pluggable via EMBEDDING_PROVIDER:
+- "local" (default): offline feature-hashing of words and word pairs.
+  No network, deterministic, good enough for topical similarity and tests.
+- "voyage": Voyage AI embeddings API (needs VOYAGE_API_KEY, optional
+  VOYAGE_EMBEDDING_MODEL, default voyage-3-lite).
+
+Every stored vector is tagged with the provider's model id, so switching
+providers re-embeds rows lazily instead of mixing incompatible vectors, and
+with embedded_at, so a loaded index also picks up captions another process
+re-embedded in place (an edited post keeps its id).
+"""
+
+import os
+import re
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Union
+
+import httpx
+import numpy as np
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from ..models import PreviousPost, Post
+
+DEFAULT_SEMANTIC_THRESHOLD = 0.85
+EMBED_BATCH_SIZE = 128
+# Rows embedded shortly before the sync cursor are read again: one embedded
+# earlier may have committed after a later one was already loaded
+SYNC_OVERLAP = timedelta(seconds=30)
+
+_WORD_RE = re.compile(r"[a-z0-9']+")
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "from", "has", "have", "i", "in",
+    "is", "it", "its", "of", "on", "or", "our", "so", "that", "the", "this", "to", "was", "we",
+    "with", "you", "your", "us", "all", "just", "can", "will", "more", "get", "if", "my", "me",
+}
+
+_provider: Optional["EmbeddingProvider"] = None
+_indexes: dict[int, "VectorIndex"] = {}
+_lock = threading.Lock()
+
+
+class EmbeddingProvider:
+    """Turns texts into L2-normalized float32 vectors of a fixed dimension."""
+
+    model_id: str = ""
+    dim: int = 0
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Offline embedding: signed feature hashing of words and adjacent word
+    pairs with sublinear term weights. Captions that talk about the same
+    things land close together; no model or network needed.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.model_id = f"local-hash-{dim}"
+
+    def _bucket(self, feature: str) -> tuple[int, float]:
+        digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+        return digest % self.dim, 1.0 if (digest >> 63) else -1.0
+
+    def embed_one(self, text: str) -> np.ndarray:
+        words = [w for w in _WORD_RE.findall((text or "").lower()) if w not in STOP_WORDS]
+        counts: dict[str, float] = {}
+        for word in words:
+            counts[word] = counts.get(word, 0) + 1.0
+        for first, second in zip(words, words[1:]):
+            pair = f"{first} {second}"
+            counts[pair] = counts.get(pair, 0) + 0.5
+
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, count in counts.items():
+            bucket, sign = self._bucket(feature)
+            weight = 1.0 + np.log(count) if count >= 1 else count
+            vector[bucket] += sign * weight
+        return _normalize(vector)
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.vstack([self.embed_one(text) for text in texts])
+
+
+class VoyageEmbeddingProvider(EmbeddingProvider):
+    """Voyage AI embeddings API."""
+
+    API_URL = "https://api.voyageai.com/v1/embeddings"
+    MODEL_DIMS = {"voyage-3-lite": 512, "voyage-3": 1024, "voyage-3-large": 1024}
+
+    def __init__(self, api_key: str, model: str = "voyage-3-lite"):
+        self.api_key = api_key
+        self.model = model
+        self.dim = self.MODEL_DIMS.get(model, 1024)
+        self.model_id = f"voyage:{model}"
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            response = await client.post(
+                self.API_URL,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                json={"input": [text or " " for text in texts], "model": self.model, "input_type": "document"}
+            )
+            response.raise_for_status()
+            data = sorted(response.json()["data"], key=lambda item: item["index"])
+
+        return np.vstack([_normalize(np.asarray(item["embedding"], dtype=np.float32)) for item in data])
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def get_provider() -> EmbeddingProvider:
+    """Return the configured embedding provider (local hashing unless set otherwise)."""
+    global _provider
+    if _provider is None:
+        name = os.getenv("EMBEDDING_PROVIDER", "local").strip().lower()
+        api_key = os.getenv("VOYAGE_API_KEY")
+        if name == "voyage" and api_key:
+            _provider = VoyageEmbeddingProvider(api_key, os.getenv("VOYAGE_EMBEDDING_MODEL", "voyage-3-lite"))
+        else:
+            if name not in ("local", ""):
+                print(f"[Embeddings] Provider '{name}' not available, using local hashing embeddings")
+            _provider = HashingEmbeddingProvider()
+    return _provider
+
+
+def get_semantic_threshold() -> float:
+    """Read the cosine similarity above which a generated post counts as a duplicate."""
+    try:
+        return float(os.getenv("SEMANTIC_DUPLICATE_THRESHOLD", DEFAULT_SEMANTIC_THRESHOLD))
+    except ValueError:
+        return DEFAULT_SEMANTIC_THRESHOLD
+
+
+def vector_to_bytes(vector: np.ndarray) -> bytes:
+    """Pack a vector as float16 bytes (half the size of float32, far smaller than JSON)."""
+    return np.asarray(vector, dtype=np.float16).tobytes()
+
+
+def vector_from_bytes(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.float16).astype(np.float32)
+
+
+async def embed_texts(texts: list[str]) -> np.ndarray:
+    """Embed texts with the configured provider, in batches."""
+    provider = get_provider()
+    batches = [await provider.embed(texts[i:i + EMBED_BATCH_SIZE]) for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    return np.vstack(batches) if batches else np.zeros((0, provider.dim), dtype=np.float32)
+
+
+class VectorIndex:
+    """In-memory matrix of one client's caption vectors, keyed by (source, source_id)."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.keys: list[tuple] = []
+        self.rows: dict[tuple, int] = {}
+        self._data = np.zeros((64, dim), dtype=np.float32)
+        self.synced_at: dict[str, Optional[datetime]] = {"previous": None, "post": None}
+        self.backfilled = False
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._data[:len(self.keys)]
+
+    def add(self, key: tuple, vector: np.ndarray):
+        """Insert or replace the vector stored under key."""
+        row = self.rows.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row == len(self._data):
+                self._data = np.vstack([self._data, np.zeros_like(self._data)])
+            self.keys.append(key)
+            self.rows[key] = row
+        self._data[row] = vector
+
+    def remove(self, key: tuple):
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        last = len(self.keys) - 1
+        if row != last:
+            moved = self.keys[last]
+            self._data[row] = self._data[last]
+            self.keys[row] = moved
+            self.rows[moved] = row
+        self.keys.pop()
+
+    def search(self, vector: np.ndarray, k: int = 10, exclude: Optional[set] = None) -> list[tuple]:
+        """Top-k (key, cosine) pairs, best first."""
+        if not self.keys or k <= 0:
+            return []
+
+        scores = self.matrix @ vector
+        for key in exclude or ():
+            row = self.rows.get(key)
+            if row is not None:
+                scores[row] = -np.inf
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.keys[i], float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+Captioned = Union[PreviousPost, Post]
+
+
+def _source(row: Captioned) -> str:
+    return "previous" if isinstance(row, PreviousPost) else "post"
+
+
+async def embed_rows(db: Session, rows: list[Captioned]):
+    """
+    Compute and store embeddings for PreviousPost/Post rows, then add them to
+    any loaded client index. Commits the session.
+    """
+    if not rows:
+        return
+
+    provider = get_provider()
+    vectors = await embed_texts([row.caption or "" for row in rows])
+    embedded_at = datetime.utcnow()
+    for row, vector in zip(rows, vectors):
+        row.caption_embedding = vector_to_bytes(vector)
+        row.embedding_model = provider.model_id
+        row.embedded_at = embedded_at
+    db.commit()
+
+    with _lock:
+        for row, vector in zip(rows, vectors):
+            index = _indexes.get(row.client_id)
+            if index is not None:
+                index.add((_source(row), row.id), vector_from_bytes(vector_to_bytes(vector)))
+
+
+async def _backfill(db: Session, client_id: int, model_id: str) -> int:
+    """Embed a client's captions that have no vector yet (or one from another provider)."""
+    count = 0
+    for model in (PreviousPost, Post):
+        while True:
+            rows = db.query(model).filter(
+                model.client_id == client_id,
+                or_(model.caption_embedding.is_(None), model.embedding_model.is_(None), model.embedding_model != model_id)
+            ).limit(EMBED_BATCH_SIZE * 4).all()
+            if not rows:
+                break
+            await embed_rows(db, rows)
+            count += len(rows)
+
+    if count:
+        print(f"[Embeddings] Embedded {count} existing captions for client {client_id}")
+    return count
+
+
+async def get_client_index(db: Session, client_id: int) -> VectorIndex:
+    """Return the client's vector index, loading rows embedded or re-embedded since the last call."""
+    provider = get_provider()
+
+    index = _indexes.get(client_id)
+    if index is None or index.dim != provider.dim:
+        index = VectorIndex(provider.dim)
+        with _lock:
+            _indexes[client_id] = index
+
+    if not index.backfilled:
+        await _backfill(db, client_id, provider.model_id)
+        index.backfilled = True
+
+    with _lock:
+        for source, model in (("previous", PreviousPost), ("post", Post)):
+            query = db.query(model.id, model.caption_embedding, model.embedded_at).filter(
+                model.client_id == client_id,
+                model.embedding_model == provider.model_id
+            )
+            synced_at = index.synced_at[source]
+            if synced_at is not None:
+                # Keyed on embedded_at, not id, so re-embedded rows replace their stale vector
+                query = query.filter(model.embedded_at >= synced_at - SYNC_OVERLAP)
+            for row_id, data, embedded_at in query.all():
+                index.add((source, row_id), vector_from_bytes(data))
+                if embedded_at and (synced_at is None or embedded_at > synced_at):
+                    synced_at = embedded_at
+            index.synced_at[source] = synced_at
+
+    return index
+
+
+async def search(
+    db: Session,
+    client_id: int,
+    text: str,
+    k: int = 10,
+    exclude: Optional[set] = None
+) -> list[dict]:
+    """Captions of a client most similar in meaning to text, best first."""
+    index = await get_client_index(db, client_id)
+    vector = (await embed_texts([text]))[0]
+    return [{"source": source, "source_id": source_id, "score": round(score, 3)}
+            for (source, source_id), score in index.search(vector, k, exclude)]
+
+
+async def flag_semantic_duplicates(db: Session, client_id: int, posts: list[Post]) -> int:
+    """
+    Embed freshly generated posts and flag any that are a close paraphrase of
+    an earlier caption but were not already caught by the word-overlap check.
+    Returns how many were newly flagged.
+    """
+    await embed_rows(db, posts)
+    index = await get_client_index(db, client_id)
+    threshold = get_semantic_threshold()
+
+    flagged = 0
+    for i, post in enumerate(posts):
+        if post.duplicate_of or post.caption_embedding is None:
+            continue
+        # Compare against history and the posts that came before it in this batch
+        later = {("post", p.id) for p in posts[i:]}
+        matches = index.search(vector_from_bytes(post.caption_embedding), k=1, exclude=later)
+        if matches and matches[0][1] >= threshold:
+            (source, source_id), score = matches[0]
+            post.duplicate_of = f"{source}:{source_id}"
+            # duplicate_score keeps the word-overlap estimate from dedup_index
+            post.semantic_duplicate_score = round(score, 3)
+            flagged += 1
+
+    if flagged:
+        db.commit()
+        print(f"[Embeddings] Flagged {flagged} of {len(posts)} new posts as paraphrases for client {client_id}")
+    return flagged
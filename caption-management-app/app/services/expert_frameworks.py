@@ -13,6 +13,7 @@ Integrated with Sidekick Marketer skills:
 - Platform benchmarks (2024-2025 research data)
 """
 
+from functools import lru_cache
 from typing import Optional, List, Dict
 
 # =============================================================================
@@ -1016,8 +1017,8 @@ def get_experts_for_client(industry: str, content_pillar: str = None) -> dict:
     Select the right 3-4 experts for a client based on industry.
     Optionally adjust for content pillar.
     """
-    # Get base experts for industry
-    industry_key = industry.lower().replace(" ", "_").replace("&", "_")
+    # Get base experts for industry (new clients may not have one yet)
+    industry_key = (industry or "default").lower().replace(" ", "_").replace("&", "_")
     expert_config = INDUSTRY_EXPERT_MAPPING.get(industry_key, INDUSTRY_EXPERT_MAPPING["default"])
 
     selected = {
@@ -1154,6 +1155,95 @@ def build_static_image_section() -> str:
     return "\n".join(lines)
 
 
+# =============================================================================
+# PRECOMPILED PROMPT SECTIONS
+# =============================================================================
+
+# Values the section cache is keyed on. Themes are free text, so only the
+# pillars the banks know are cached; any other theme is built per call.
+PROMPT_SECTION_PILLARS = (
+    set(PILLAR_EXPERT_EMPHASIS) | set(PILLAR_HOOK_MAPPING) | set(PILLAR_CTA_MAPPING) | set(CAPTION_TEMPLATES)
+)
+PROMPT_SECTION_PLATFORMS = set(PLATFORM_BENCHMARKS) | set(EXPERTS["gary_vaynerchuk"]["platform_rules"])
+
+
+def _build_prompt_sections(industry: str, content_theme: Optional[str], platform: str) -> dict:
+    """Build every prompt section that only varies by (industry, pillar, platform)."""
+    # Select the right experts for this client
+    experts = get_experts_for_client(industry, content_theme)
+
+    # Platform-specific rules (updated for 2024)
+    platform_rules = EXPERTS["gary_vaynerchuk"]["platform_rules"].get(
+        platform.lower(),
+        "Optimize for the platform's native format and algorithm"
+    )
+
+    # Get platform-specific format recommendation
+    format_rec = STATIC_IMAGE_STRATEGY["format_recommendations"].get(
+        platform.lower(),
+        "Strong visual + caption that tells the full story"
+    )
+
+    # Hooks, CTAs and templates are chosen by content pillar
+    pillar = content_theme or "education"
+
+    return {
+        "primary_expert_names": [e["name"] for e in experts["primary"]],
+        "expert_section": build_expert_prompt_section(experts),
+        "quality_gates": build_quality_gates_section(),
+        "algorithm_section": build_algorithm_section(),
+        "static_image_section": build_static_image_section(),
+        "platform_rules": platform_rules,
+        "format_rec": format_rec,
+        "hooks_section": build_hooks_section(pillar),
+        "cta_section": build_cta_section(pillar),
+        "template_section": build_template_section(pillar),
+        "platform_specs_section": build_platform_specs_section(platform),
+    }
+
+
+# Keyed on PROMPT_SECTION_* values only, so the cache can't outgrow the warmed set
+_cached_prompt_sections = lru_cache(maxsize=None)(_build_prompt_sections)
+
+
+def get_prompt_sections(industry: Optional[str], content_theme: Optional[str], platform: str) -> dict:
+    """
+    Prompt sections for (industry, pillar, platform).
+
+    The section text is derived purely from the module-level banks (EXPERTS,
+    HOOK_BANK, CTA_BANK, CAPTION_TEMPLATES, PLATFORM_BENCHMARKS), so known
+    combinations are memoized and warmed at startup by
+    warm_prompt_section_cache(); a theme or platform outside the banks is
+    built uncached. Treat the returned dict as read-only - it is shared
+    between callers.
+    """
+    industry_key = (industry or "default").lower().replace(" ", "_").replace("&", "_")
+    if industry_key not in INDUSTRY_EXPERT_MAPPING:
+        industry_key = "default"
+    pillar_key = content_theme.lower().replace(" ", "_").replace("-", "_") if content_theme else None
+    platform_key = platform.lower()
+
+    if (pillar_key is None or pillar_key in PROMPT_SECTION_PILLARS) and platform_key in PROMPT_SECTION_PLATFORMS:
+        return _cached_prompt_sections(industry_key, pillar_key, platform_key)
+    return _build_prompt_sections(industry_key, content_theme, platform)
+
+
+def warm_prompt_section_cache() -> int:
+    """
+    Precompile sections for every known industry x pillar x platform.
+    Returns the number of combinations built.
+    """
+    pillars = [None] + sorted(PROMPT_SECTION_PILLARS)
+
+    count = 0
+    for industry in INDUSTRY_EXPERT_MAPPING:
+        for pillar in pillars:
+            for platform in PROMPT_SECTION_PLATFORMS:
+                _cached_prompt_sections(industry, pillar, platform)
+                count += 1
+    return count
+
+
 def build_enhanced_caption_prompt(
     strategy: dict,
     previous_posts: list,
@@ -1178,50 +1268,25 @@ def build_enhanced_caption_prompt(
     - Platform benchmarks with 2024-2025 data
     """
 
-    # 1. Select the right experts for this client
-    industry = strategy.get("industry", "default")
-    experts = get_experts_for_client(industry, content_theme)
-
-    # 2. Build the expert framework section
-    expert_section = build_expert_prompt_section(experts)
-
-    # 3. Get awareness stage guidance
+    industry = strategy.get("industry") or "default"
+
+    # Everything that only depends on (industry, pillar, platform) comes
+    # precompiled from the section cache
+    sections = get_prompt_sections(industry, content_theme, platform)
+    expert_section = sections["expert_section"]
+    quality_gates = sections["quality_gates"]
+    algorithm_section = sections["algorithm_section"]
+    static_image_section = sections["static_image_section"]
+    platform_rules = sections["platform_rules"]
+    format_rec = sections["format_rec"]
+    hooks_section = sections["hooks_section"]
+    cta_section = sections["cta_section"]
+    template_section = sections["template_section"]
+    platform_specs_section = sections["platform_specs_section"]
+
+    # Awareness stage depends on the client's audience description
     awareness_guidance = get_awareness_guidance(strategy.get("target_audience", ""))
 
-    # 4. Build quality gates
-    quality_gates = build_quality_gates_section()
-
-    # 5. Build algorithm reality section (2024-25 update)
-    algorithm_section = build_algorithm_section()
-
-    # 6. Build static image strategy (since most clients don't have video)
-    static_image_section = build_static_image_section()
-
-    # 7. Platform-specific rules (updated for 2024)
-    platform_rules = EXPERTS["gary_vaynerchuk"]["platform_rules"].get(
-        platform.lower(),
-        "Optimize for the platform's native format and algorithm"
-    )
-
-    # Get platform-specific format recommendation
-    format_rec = STATIC_IMAGE_STRATEGY["format_recommendations"].get(
-        platform.lower(),
-        "Strong visual + caption that tells the full story"
-    )
-
-    # 8. NEW: Build hooks section based on content pillar
-    pillar = content_theme or "education"
-    hooks_section = build_hooks_section(pillar)
-
-    # 9. NEW: Build CTA section based on content pillar
-    cta_section = build_cta_section(pillar)
-
-    # 10. NEW: Build template section based on content pillar
-    template_section = build_template_section(pillar)
-
-    # 11. NEW: Build platform specs section with benchmarks
-    platform_specs_section = build_platform_specs_section(platform)
-
     prompt = f"""You are an expert social media copywriter applying proven frameworks.
 
 **IMPORTANT CONTEXT**: These are captions for STATIC IMAGE posts (not video). The caption must carry the full storytelling weight.
@@ -1340,6 +1405,6 @@ Return a JSON array with exactly {num_captions} objects:
 ]
 ```
 
-Generate {num_captions} unique, on-brand captions now. Remember: You're channeling {experts['primary'][0]['name']} and {experts['primary'][1]['name']}, not writing generic social media content."""
+Generate {num_captions} unique, on-brand captions now. Remember: You're channeling {sections['primary_expert_names'][0]} and {sections['primary_expert_names'][1]}, not writing generic social media content."""
 
     return prompt
@@ -0,0 +1,245 @@
+"""
+Caption Generation Pipeline
+
+Turns a generation request (client, platform, theme, count) into saved
+draft Posts: loads the client's context from the database, picks the
+full-profile or legacy strategy generator, and persists the results.
+
+Shared by the HTTP routes and the background job workers. The streaming
+variant saves each post the moment its caption is complete, so the UI can
+show it right away and a dropped connection keeps what was already written.
+"""
+
+from typing import Optional, AsyncIterator
+
+from sqlalchemy.orm import Session
+
+from ..models import Client, Post, PostStatus, ClientProfile, PlatformStrategy
+from . import caption_generator, dedup_index, embeddings, post_selection
+
+
+class GenerationError(Exception):
+    """Raised when captions cannot be generated for a request."""
+
+
+async def _prepare_generation(
+    db: Session,
+    client: Client,
+    platform: str,
+    num_captions: int,
+    content_theme: Optional[str],
+    specific_topic: Optional[str]
+) -> tuple[str, dict]:
+    """
+    Gather everything the generator needs for a client.
+    Returns ("full", kwargs) when profile documents exist, otherwise
+    ("legacy", kwargs) for the strategy-dict generator.
+    """
+    # A bounded, relevance-ranked slice of the client's history for the "do not duplicate" section
+    previous_captions = await post_selection.select_previous_captions(
+        db, client.id, content_theme=content_theme, specific_topic=specific_topic
+    )
+
+    # Check if client has full profile documents
+    client_profile = db.query(ClientProfile).filter(ClientProfile.client_id == client.id).first()
+    platform_strategy = db.query(PlatformStrategy).filter(
+        PlatformStrategy.client_id == client.id,
+        PlatformStrategy.platform == platform
+    ).first()
+
+    # Fetch recent edited posts for learning (before/after examples)
+    edited_posts = db.query(Post).filter(
+        Post.client_id == client.id,
+        Post.was_edited == True,
+        Post.original_caption.isnot(None)
+    ).order_by(Post.updated_at.desc()).limit(10).all()
+
+    edited_examples = []
+    for ep in edited_posts:
+        if ep.original_caption and ep.caption and ep.original_caption != ep.caption:
+            edited_examples.append({
+                "original": ep.original_caption,
+                "edited": ep.caption
+            })
+
+    if edited_examples:
+        print(f"[Caption Generator] Found {len(edited_examples)} edited examples to learn from")
+
+    # Use full-context generator if profile is available
+    if client_profile and client_profile.profile_markdown:
+        print(f"[Caption Generator] Using FULL PROFILE context for {client.name}")
+        return "full", {
+            "client_name": client.name,
+            "profile_markdown": client_profile.profile_markdown,
+            "master_strategy_markdown": client_profile.master_strategy_markdown,
+            "platform_strategy_markdown": platform_strategy.strategy_markdown if platform_strategy else None,
+            "previous_posts": previous_captions,
+            "num_captions": num_captions,
+            "platform": platform,
+            "content_theme": content_theme if content_theme else None,
+            "specific_topic": specific_topic if specific_topic else None,
+            "edited_examples": edited_examples if edited_examples else None
+        }
+
+    # Fall back to legacy strategy-dict based generation
+    if not client.strategy:
+        raise GenerationError("Client strategy not found. Please upload a profile or configure strategy.")
+
+    print(f"[Caption Generator] Using LEGACY strategy dict for {client.name}")
+    strategy_dict = {
+        "brand_voice": client.strategy.brand_voice,
+        "tone_keywords": client.strategy.tone_keywords or [],
+        "content_pillars": client.strategy.content_pillars or [],
+        "target_audience": client.strategy.target_audience,
+        "audience_pain_points": client.strategy.audience_pain_points or [],
+        "industry": client.strategy.industry,
+        "unique_selling_points": client.strategy.unique_selling_points or [],
+        "key_messages": client.strategy.key_messages or [],
+        "topics_to_avoid": client.strategy.topics_to_avoid or [],
+        "hashtag_sets": client.strategy.hashtag_sets or {}
+    }
+    return "legacy", {
+        "strategy": strategy_dict,
+        "previous_posts": previous_captions,
+        "num_captions": num_captions,
+        "platform": platform,
+        "content_theme": content_theme if content_theme else None,
+        "specific_topic": specific_topic if specific_topic else None
+    }
+
+
+def _caption_to_post(cap: dict, client_id: int, platform: str, batch_name: str) -> Post:
+    caption_text = cap.get("caption", "")
+    hashtags = " ".join([f"#{h}" for h in cap.get("hashtags", [])])
+    return Post(
+        client_id=client_id,
+        caption=caption_text,
+        hashtags=hashtags,
+        platform=platform,
+        batch_name=batch_name,
+        status=PostStatus.DRAFT,
+        # Store original for learning from edits
+        original_caption=caption_text,
+        original_hashtags=hashtags,
+        was_edited=False
+    )
+
+
+async def _flag_duplicates(db: Session, client_id: int, posts: list[Post]):
+    """Score the new captions against the client's history and flag near-duplicates."""
+    dedup_index.flag_duplicates(db, client_id, posts)
+    await embeddings.flag_semantic_duplicates(db, client_id, posts)
+
+
+async def generate_posts_for_client(
+    db: Session,
+    client_id: int,
+    platform: str,
+    num_captions: int,
+    batch_name: str,
+    content_theme: Optional[str] = None,
+    specific_topic: Optional[str] = None
+) -> list[int]:
+    """
+    Generate captions for a client and save them as draft posts.
+
+    Uses the full profile documents when available, otherwise falls back to
+    the legacy strategy dict. Returns the IDs of the created Posts.
+    """
+    client = db.query(Client).filter(Client.id == client_id).first()
+    if not client:
+        raise GenerationError("Client not found")
+
+    mode, kwargs = await _prepare_generation(db, client, platform, num_captions, content_theme, specific_topic)
+    if mode == "full":
+        captions = await caption_generator.generate_captions_with_full_context(**kwargs)
+    else:
+        captions = await caption_generator.generate_captions(**kwargs)
+
+    # Save generated captions as posts
+    posts = [_caption_to_post(cap, client_id, platform, batch_name) for cap in captions if "error" not in cap]
+
+    if not posts:
+        errors = [cap["error"] for cap in captions if "error" in cap]
+        raise GenerationError(errors[0] if errors else "No captions were generated")
+
+    # Single batched insert for the whole set
+    db.add_all(posts)
+    db.commit()
+
+    await _flag_duplicates(db, client_id, posts)
+
+    return [post.id for post in posts]
+
+
+async def stream_posts_for_client(
+    db: Session,
+    client_id: int,
+    platform: str,
+    num_captions: int,
+    batch_name: str,
+    content_theme: Optional[str] = None,
+    specific_topic: Optional[str] = None
+) -> AsyncIterator[dict]:
+    """
+    Streaming version of generate_posts_for_client.
+
+    Yields {"event": "post", "post": {...}} as each caption is saved, then
+    {"event": "done", ...} with the IDs and duplicate flags, or
+    {"event": "error", "error": ...} if generation stops early (posts saved
+    before the error are kept).
+    """
+    client = db.query(Client).filter(Client.id == client_id).first()
+    if not client:
+        yield {"event": "error", "error": "Client not found"}
+        return
+
+    try:
+        mode, kwargs = await _prepare_generation(db, client, platform, num_captions, content_theme, specific_topic)
+        if mode == "full":
+            system, prompt = caption_generator.build_full_context_request(**kwargs)
+            captions = caption_generator.stream_captions(prompt, system=system, cache_system=True)
+        else:
+            prompt = caption_generator.build_strategy_prompt(**kwargs)
+            captions = caption_generator.stream_captions(prompt)
+    except GenerationError as e:
+        yield {"event": "error", "error": str(e)}
+        return
+    except Exception as e:
+        # The response has already started - report it as an event, not a traceback
+        print(f"[Caption Generator] Preparing the prompt for client {client_id} failed: {e}")
+        yield {"event": "error", "error": f"Generation failed: {str(e)}"}
+        return
+
+    posts = []
+    error = None
+    try:
+        async for cap in captions:
+            if "error" in cap:
+                error = cap["error"]
+                break
+
+            post = _caption_to_post(cap, client_id, platform, batch_name)
+            db.add(post)
+            db.commit()
+            posts.append(post)
+            yield {"event": "post", "post": {
+                "id": post.id,
+                "caption": post.caption,
+                "hashtags": post.hashtags,
+                "platform": post.platform,
+                "url": f"/posts/{post.id}"
+            }}
+    finally:
+        # Runs on disconnect too: release the Claude stream and still check what was saved
+        await captions.aclose()
+        if posts:
+            await _flag_duplicates(db, client_id, posts)
+
+    if error and not posts:
+        yield {"event": "error", "error": error}
+        return
+
+    yield {"event": "done", "post_ids": [p.id for p in posts], "error": error, "duplicates": {
+        p.id: p.duplicate_of for p in posts if p.duplicate_of
+    }}
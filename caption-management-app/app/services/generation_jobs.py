@@ -0,0 +1,361 @@
+"""
+Background Generation Job Queue
+
+Generation requests are stored as GenerationJob rows and drained by a small
+pool of asyncio workers started with the app. Because the queue lives in the
+database, pending jobs survive a restart. A job cancelled by shutdown goes
+back to PENDING before the worker exits, and jobs left mid-run by a process
+that died outright are put back in the queue by the stale-job check the
+workers run at startup and every few minutes.
+
+Workers claim jobs with a conditional UPDATE, so several app instances can
+share one queue without running the same job twice.
+
+Bulk runs (many clients x platforms at once) are just groups of jobs sharing
+a run_id. Each job records its latency and token usage, and failed jobs in a
+run can be re-queued without touching the ones that already succeeded.
+
+Set GENERATION_WORKERS to change the pool size (default 2) and
+GENERATION_PER_CLIENT_LIMIT to cap how many jobs for the same client run at
+once (default 1). Overall Claude concurrency and rate are still governed by
+ANTHROPIC_MAX_CONCURRENCY / ANTHROPIC_REQUESTS_PER_MINUTE.
+"""
+
+import os
+import time
+import asyncio
+import secrets
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from ..models import GenerationJob, JobStatus
+from . import llm
+from .generation import generate_posts_for_client, GenerationError
+
+DEFAULT_WORKERS = 2
+DEFAULT_PER_CLIENT_LIMIT = 1
+POLL_INTERVAL_SECONDS = 5
+# A RUNNING job older than this is assumed to belong to a dead process
+STALE_JOB_AFTER = timedelta(minutes=15)
+REQUEUE_CHECK_INTERVAL_SECONDS = 300
+
+_workers: list[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+_next_requeue_check = 0.0
+
+
+def get_worker_count() -> int:
+    """Read the worker pool size from the environment."""
+    try:
+        return max(1, int(os.getenv("GENERATION_WORKERS", DEFAULT_WORKERS)))
+    except ValueError:
+        return DEFAULT_WORKERS
+
+
+def get_per_client_limit() -> int:
+    """Read the per-client concurrent job limit from the environment."""
+    try:
+        return max(1, int(os.getenv("GENERATION_PER_CLIENT_LIMIT", DEFAULT_PER_CLIENT_LIMIT)))
+    except ValueError:
+        return DEFAULT_PER_CLIENT_LIMIT
+
+
+def enqueue_generation_job(
+    db: Session,
+    client_id: int,
+    platform: str,
+    num_captions: int,
+    batch_name: str,
+    content_theme: Optional[str] = None,
+    specific_topic: Optional[str] = None
+) -> GenerationJob:
+    """Store a new pending job and wake an idle worker."""
+    job = GenerationJob(
+        client_id=client_id,
+        platform=platform,
+        num_captions=num_captions,
+        batch_name=batch_name,
+        content_theme=content_theme,
+        specific_topic=specific_topic,
+        status=JobStatus.PENDING
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+
+    notify_workers()
+    return job
+
+
+def enqueue_bulk_run(db: Session, requests: list[dict], batch_name: str) -> tuple[str, list[GenerationJob]]:
+    """
+    Queue one job per client x platform in a single insert.
+
+    Each request is a dict with client_id, platforms, and optionally
+    num_captions, content_theme and specific_topic.
+    Returns the run_id and the created jobs.
+    """
+    run_id = secrets.token_hex(8)
+    jobs = []
+    for req in requests:
+        for platform in req["platforms"]:
+            jobs.append(GenerationJob(
+                run_id=run_id,
+                client_id=req["client_id"],
+                platform=platform,
+                num_captions=req.get("num_captions", 5),
+                batch_name=req.get("batch_name") or batch_name,
+                content_theme=req.get("content_theme") or None,
+                specific_topic=req.get("specific_topic") or None,
+                status=JobStatus.PENDING
+            ))
+
+    db.add_all(jobs)
+    db.commit()
+
+    notify_workers()
+    return run_id, jobs
+
+
+def retry_failed_jobs(db: Session, run_id: str) -> int:
+    """Re-queue the failed jobs of a bulk run. Returns how many were re-queued."""
+    count = db.query(GenerationJob).filter(
+        GenerationJob.run_id == run_id,
+        GenerationJob.status == JobStatus.FAILED
+    ).update({
+        GenerationJob.status: JobStatus.PENDING,
+        GenerationJob.error: None
+    }, synchronize_session=False)
+    db.commit()
+
+    if count:
+        notify_workers()
+    return count
+
+
+def summarize_run(db: Session, run_id: str) -> Optional[dict]:
+    """Aggregate progress, latency and token usage for a bulk run."""
+    jobs = db.query(GenerationJob).filter(GenerationJob.run_id == run_id).order_by(GenerationJob.id).all()
+    if not jobs:
+        return None
+
+    counts = {status.value: 0 for status in JobStatus}
+    for job in jobs:
+        counts[job.status] = counts.get(job.status, 0) + 1
+
+    latencies = [job.latency_ms for job in jobs if job.latency_ms is not None]
+
+    return {
+        "run_id": run_id,
+        "total_jobs": len(jobs),
+        "status_counts": counts,
+        "done": counts[JobStatus.PENDING.value] == 0 and counts[JobStatus.RUNNING.value] == 0,
+        "posts_created": sum(len(job.post_ids or []) for job in jobs),
+        "input_tokens": sum(job.input_tokens or 0 for job in jobs),
+        "output_tokens": sum(job.output_tokens or 0 for job in jobs),
+        "cache_read_tokens": sum(job.cache_read_tokens or 0 for job in jobs),
+        "avg_latency_ms": int(sum(latencies) / len(latencies)) if latencies else None,
+        "max_latency_ms": max(latencies) if latencies else None,
+        "failures": [
+            {"job_id": job.id, "client_id": job.client_id, "platform": job.platform, "error": job.error}
+            for job in jobs if job.status == JobStatus.FAILED
+        ],
+        "jobs": [job_to_dict(job) for job in jobs]
+    }
+
+
+def notify_workers():
+    """Wake idle workers so new jobs start without waiting for the next poll."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def job_to_dict(job: GenerationJob) -> dict:
+    """Serialize a job for the status API."""
+    return {
+        "id": job.id,
+        "run_id": job.run_id,
+        "client_id": job.client_id,
+        "platform": job.platform,
+        "num_captions": job.num_captions,
+        "content_theme": job.content_theme,
+        "specific_topic": job.specific_topic,
+        "batch_name": job.batch_name,
+        "status": job.status,
+        "attempts": job.attempts,
+        "error": job.error,
+        "post_ids": job.post_ids or [],
+        "input_tokens": job.input_tokens,
+        "output_tokens": job.output_tokens,
+        "cache_read_tokens": job.cache_read_tokens,
+        "cache_creation_tokens": job.cache_creation_tokens,
+        "latency_ms": job.latency_ms,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "completed_at": job.completed_at.isoformat() if job.completed_at else None
+    }
+
+
+def claim_next_job(db: Session) -> Optional[GenerationJob]:
+    """
+    Atomically move the oldest pending job to RUNNING and return it.
+    Skips clients that already have GENERATION_PER_CLIENT_LIMIT jobs running.
+    Returns None when there is nothing runnable.
+    """
+    busy_clients = db.query(GenerationJob.client_id).filter(
+        GenerationJob.status == JobStatus.RUNNING
+    ).group_by(GenerationJob.client_id).having(func.count(GenerationJob.id) >= get_per_client_limit())
+
+    while True:
+        job = db.query(GenerationJob).filter(
+            GenerationJob.status == JobStatus.PENDING,
+            GenerationJob.client_id.notin_(busy_clients)
+        ).order_by(GenerationJob.id).first()
+
+        if not job:
+            return None
+
+        claimed = db.query(GenerationJob).filter(
+            GenerationJob.id == job.id,
+            GenerationJob.status == JobStatus.PENDING
+        ).update({
+            GenerationJob.status: JobStatus.RUNNING,
+            GenerationJob.started_at: datetime.utcnow(),
+            GenerationJob.attempts: GenerationJob.attempts + 1
+        }, synchronize_session=False)
+        db.commit()
+
+        if claimed:
+            db.refresh(job)
+            return job
+        # Another worker got there first - try the next one
+
+
+async def run_job(db: Session, job: GenerationJob):
+    """Execute a claimed job and record the outcome, latency and token usage."""
+    started = time.perf_counter()
+    with llm.track_usage() as usage:
+        try:
+            post_ids = await generate_posts_for_client(
+                db,
+                client_id=job.client_id,
+                platform=job.platform,
+                num_captions=job.num_captions,
+                batch_name=job.batch_name,
+                content_theme=job.content_theme,
+                specific_topic=job.specific_topic
+            )
+            job.status = JobStatus.COMPLETED
+            job.post_ids = post_ids
+            job.error = None
+        except asyncio.CancelledError:
+            # Shutdown or redeploy: hand the job back to the queue so it
+            # doesn't stay RUNNING (and block its client) forever
+            db.rollback()
+            job.status = JobStatus.PENDING
+            job.started_at = None
+            db.commit()
+            print(f"[Generation Jobs] Job {job.id} interrupted, re-queued")
+            raise
+        except GenerationError as e:
+            db.rollback()
+            job.status = JobStatus.FAILED
+            job.error = str(e)
+        except Exception as e:
+            db.rollback()
+            job.status = JobStatus.FAILED
+            job.error = f"Generation failed: {str(e)}"
+            print(f"[Generation Jobs] Job {job.id} crashed: {e}")
+
+    job.latency_ms = int((time.perf_counter() - started) * 1000)
+    job.input_tokens = usage["input_tokens"]
+    job.output_tokens = usage["output_tokens"]
+    job.cache_read_tokens = usage["cache_read_input_tokens"]
+    job.cache_creation_tokens = usage["cache_creation_input_tokens"]
+    job.completed_at = datetime.utcnow()
+    db.commit()
+
+
+def requeue_interrupted_jobs() -> int:
+    """Put jobs left RUNNING by a previous process back in the queue."""
+    db = SessionLocal()
+    try:
+        count = db.query(GenerationJob).filter(
+            GenerationJob.status == JobStatus.RUNNING,
+            GenerationJob.started_at < datetime.utcnow() - STALE_JOB_AFTER
+        ).update({GenerationJob.status: JobStatus.PENDING}, synchronize_session=False)
+        db.commit()
+        return count
+    finally:
+        db.close()
+
+
+def _requeue_stale_jobs():
+    """Run the stale-job check if it is due; shared by all workers in the process."""
+    global _next_requeue_check
+    now = time.monotonic()
+    if now < _next_requeue_check:
+        return
+    _next_requeue_check = now + REQUEUE_CHECK_INTERVAL_SECONDS
+
+    requeued = requeue_interrupted_jobs()
+    if requeued:
+        print(f"[Generation Jobs] Re-queued {requeued} interrupted job(s)")
+
+
+async def _worker_loop(worker_id: int):
+    while True:
+        try:
+            _requeue_stale_jobs()
+        except Exception as e:
+            print(f"[Generation Jobs] Worker {worker_id} stale-job check failed: {e}")
+
+        db = SessionLocal()
+        try:
+            job = claim_next_job(db)
+            if job:
+                print(f"[Generation Jobs] Worker {worker_id} running job {job.id}")
+                await run_job(db, job)
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Generation Jobs] Worker {worker_id} error: {e}")
+        finally:
+            db.close()
+
+        # Queue is empty - sleep until notified or the next poll. asyncio.wait
+        # rather than wait_for: on Python 3.11 wait_for swallows a cancel that
+        # arrives as the event fires, and stop_workers would wait forever
+        wakeup = asyncio.ensure_future(_wakeup.wait())
+        try:
+            await asyncio.wait({wakeup}, timeout=POLL_INTERVAL_SECONDS)
+        finally:
+            wakeup.cancel()
+        _wakeup.clear()
+
+
+async def start_workers():
+    """Start the worker pool. Called from the app startup hook."""
+    global _wakeup, _next_requeue_check
+    if _workers:
+        return
+
+    _wakeup = asyncio.Event()
+    # First worker iteration checks for stale jobs right away
+    _next_requeue_check = 0.0
+
+    for i in range(get_worker_count()):
+        _workers.append(asyncio.create_task(_worker_loop(i + 1)))
+
+
+async def stop_workers():
+    """Cancel the worker pool. Called from the app shutdown hook."""
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
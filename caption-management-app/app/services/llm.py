@@ -0,0 +1,225 @@
+"""
+Shared Claude Access
+
+Every service that talks to Claude (caption generation, photo matching,
+strategy parsing) goes through this module so that:
+- calls use AsyncAnthropic and never block the event loop
+- a process-wide semaphore caps how many requests are in flight at once
+- an optional requests-per-minute limit spaces out request starts
+- token usage (including prompt-cache hits) can be collected per unit of
+  work with track_usage(), and is also totalled for the whole process
+
+Set ANTHROPIC_MAX_CONCURRENCY to tune the concurrency limit (default 4) and
+ANTHROPIC_REQUESTS_PER_MINUTE to enable the rate limit (default off).
+"""
+
+import os
+import time
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, AsyncIterator
+
+from anthropic import AsyncAnthropic
+
+DEFAULT_MODEL = "claude-sonnet-4-20250514"
+DEFAULT_MAX_CONCURRENCY = 4
+
+_client: Optional[AsyncAnthropic] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_rate_limiter: Optional["RateLimiter"] = None
+_usage: ContextVar[Optional[dict]] = ContextVar("llm_usage", default=None)
+
+USAGE_FIELDS = ["input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"]
+
+
+def _empty_usage() -> dict:
+    usage = {"requests": 0}
+    usage.update({field: 0 for field in USAGE_FIELDS})
+    return usage
+
+
+# Running totals since process start, exposed via get_usage_totals()
+_usage_totals = _empty_usage()
+
+
+class RateLimiter:
+    """Spaces out request starts so at most `per_minute` begin each minute."""
+
+    def __init__(self, per_minute: int):
+        self.interval = 60.0 / per_minute
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def get_async_anthropic_client() -> Optional[AsyncAnthropic]:
+    """Return the shared AsyncAnthropic client, or None if no API key is set."""
+    global _client
+    if _client is None:
+        api_key = os.getenv("ANTHROPIC_API_KEY")
+        if api_key:
+            _client = AsyncAnthropic(api_key=api_key)
+    return _client
+
+
+def get_max_concurrency() -> int:
+    """Read the concurrent request limit from the environment."""
+    try:
+        return max(1, int(os.getenv("ANTHROPIC_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)))
+    except ValueError:
+        return DEFAULT_MAX_CONCURRENCY
+
+
+def get_concurrency_limiter() -> asyncio.Semaphore:
+    """Semaphore shared by all Claude calls in this process."""
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(get_max_concurrency())
+    return _semaphore
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """Shared requests-per-minute limiter, or None when no limit is set."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        try:
+            per_minute = int(os.getenv("ANTHROPIC_REQUESTS_PER_MINUTE", "0"))
+        except ValueError:
+            per_minute = 0
+        if per_minute > 0:
+            _rate_limiter = RateLimiter(per_minute)
+    return _rate_limiter
+
+
+@contextmanager
+def track_usage():
+    """
+    Collect token usage for every Claude call made inside the block
+    (including calls made by awaited coroutines in the same task).
+
+    Usage:
+        with llm.track_usage() as usage:
+            await caption_generator.generate_captions(...)
+        print(usage["input_tokens"])
+    """
+    usage = _empty_usage()
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+
+def record_usage(response):
+    """Add a response's token counts to the process totals and the active track_usage() block."""
+    response_usage = getattr(response, "usage", None)
+    if response_usage is None:
+        return
+
+    targets = [_usage_totals]
+    if _usage.get() is not None:
+        targets.append(_usage.get())
+
+    for usage in targets:
+        usage["requests"] += 1
+        for field in USAGE_FIELDS:
+            usage[field] += getattr(response_usage, field, 0) or 0
+
+
+def get_usage_totals() -> dict:
+    """Token usage since process start, with the share of input served from the prompt cache."""
+    totals = dict(_usage_totals)
+    total_input = totals["input_tokens"] + totals["cache_read_input_tokens"] + totals["cache_creation_input_tokens"]
+    totals["cache_hit_ratio"] = round(totals["cache_read_input_tokens"] / total_input, 3) if total_input else 0.0
+    return totals
+
+
+def _system_kwargs(system: Optional[str], cache_system: bool) -> dict:
+    if not system:
+        return {}
+    if cache_system:
+        return {"system": [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]}
+    return {"system": system}
+
+
+async def create_message(
+    prompt: str,
+    max_tokens: int = 4096,
+    model: str = DEFAULT_MODEL,
+    system: Optional[str] = None,
+    cache_system: bool = False
+):
+    """
+    Send a single-turn prompt to Claude, waiting for a free slot first.
+
+    `system` is sent as the system prompt. With cache_system=True it gets a
+    cache_control breakpoint, so a large stable prefix (client documents) is
+    only billed in full the first time within the cache window.
+
+    Raises RuntimeError if the API key is not configured; callers are expected
+    to check get_async_anthropic_client() up front and return their own error.
+    """
+    anthropic = get_async_anthropic_client()
+    if not anthropic:
+        raise RuntimeError("Anthropic API key not configured")
+
+    async with get_concurrency_limiter():
+        rate_limiter = get_rate_limiter()
+        if rate_limiter:
+            await rate_limiter.wait()
+
+        response = await anthropic.messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            messages=[{"role": "user", "content": prompt}],
+            **_system_kwargs(system, cache_system)
+        )
+
+    record_usage(response)
+    return response
+
+
+async def stream_message(
+    prompt: str,
+    max_tokens: int = 4096,
+    model: str = DEFAULT_MODEL,
+    system: Optional[str] = None,
+    cache_system: bool = False
+) -> AsyncIterator[str]:
+    """
+    Streaming version of create_message: yields text deltas as Claude writes
+    them. Holds a concurrency slot for the whole stream and records token
+    usage once the final message arrives.
+
+    Usage:
+        async for text in llm.stream_message(prompt):
+            ...
+    """
+    anthropic = get_async_anthropic_client()
+    if not anthropic:
+        raise RuntimeError("Anthropic API key not configured")
+
+    async with get_concurrency_limiter():
+        rate_limiter = get_rate_limiter()
+        if rate_limiter:
+            await rate_limiter.wait()
+
+        async with anthropic.messages.stream(
+            model=model,
+            max_tokens=max_tokens,
+            messages=[{"role": "user", "content": prompt}],
+            **_system_kwargs(system, cache_system)
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+            response = await stream.get_final_message()
+
+    record_usage(response)
@@ -0,0 +1,148 @@
+"""
+Metricool Media Cache
+
+Metricool needs every image normalized (fetched from a public URL and
+turned into a mediaId) before it can be attached to a post. The same
+library photo is often scheduled many times - once per platform, again in
+later batches - so mediaIds are stored in the metricool_media table, keyed
+by the photo's content hash and storage location, and reused until they
+expire.
+
+- A changed file gets a new hash, and a changed PUBLIC_BASE_URL or bucket a
+  new location, so neither ever reuses a stale mediaId. (Presigned S3 URLs
+  change every few hours, so the location is the key, not the URL.)
+- Entries older than METRICOOL_MEDIA_TTL_DAYS (default 30) are normalized
+  again and replaced.
+- invalidate_photo() drops a photo's entries explicitly, e.g. after
+  Metricool rejects a mediaId.
+"""
+
+import os
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from ..models import Photo, MetricoolMedia
+from . import metricool, storage
+
+DEFAULT_TTL_DAYS = 30
+
+
+def get_ttl() -> timedelta:
+    """Read how long a cached mediaId stays valid."""
+    try:
+        days = float(os.getenv("METRICOOL_MEDIA_TTL_DAYS", DEFAULT_TTL_DAYS))
+    except ValueError:
+        days = DEFAULT_TTL_DAYS
+    return timedelta(days=days)
+
+
+def get_public_media_url(photo: Photo) -> Optional[str]:
+    """Absolute URL Metricool can fetch the photo from, or None (local storage without PUBLIC_BASE_URL)."""
+    if not photo.file_path:
+        return None
+    return storage.get_backend().external_url(storage.key_for(photo.file_path))
+
+
+async def hash_stored(key: str) -> Optional[str]:
+    """SHA-256 of a stored file, read in chunks. None if it doesn't exist."""
+    backend = storage.get_backend()
+    size = await backend.size(key)
+    if size is None:
+        return None
+    digest = hashlib.sha256()
+    if size:
+        async for chunk in backend.iter_range(key, 0, size - 1):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def ensure_content_hash(photo: Photo) -> Optional[str]:
+    """Return the photo's content hash, computing it from the file for photos uploaded before hashing."""
+    if not photo.content_hash and photo.file_path:
+        photo.content_hash = await hash_stored(storage.key_for(photo.file_path))
+    return photo.content_hash
+
+
+async def get_media_ids(db: Session, photos: list[Photo], semaphore: Optional[asyncio.Semaphore] = None) -> dict[int, dict]:
+    """
+    Resolve Metricool mediaIds for photos, normalizing only those without a
+    fresh cache entry (concurrently, bounded by semaphore if given).
+    Returns {photo_id: {"media_id": ...} or {"error": ...}} and commits the cache.
+    """
+    backend = storage.get_backend()
+    results = {}
+    keys = {}
+    urls = {}
+    for photo in photos:
+        url = get_public_media_url(photo)
+        if not url:
+            results[photo.id] = {"error": "Photo has no public URL (set PUBLIC_BASE_URL)"}
+            continue
+        content_hash = await ensure_content_hash(photo)
+        if not content_hash:
+            results[photo.id] = {"error": "Photo file not found"}
+            continue
+        keys[photo.id] = (content_hash, backend.location(storage.key_for(photo.file_path)))
+        urls[keys[photo.id]] = url
+
+    now = datetime.utcnow()
+    cached = {}
+    if keys:
+        entries = db.query(MetricoolMedia).filter(
+            MetricoolMedia.content_hash.in_({content_hash for content_hash, _ in keys.values()})
+        ).all()
+        cached = {(entry.content_hash, entry.media_url): entry for entry in entries}
+
+    expired_before = now - get_ttl()
+    misses = {}
+    for photo_id, key in keys.items():
+        entry = cached.get(key)
+        if entry and entry.created_at and entry.created_at >= expired_before:
+            entry.last_used_at = now
+            results[photo_id] = {"media_id": entry.media_id}
+        else:
+            misses.setdefault(key, []).append(photo_id)
+
+    async def normalize(url: str) -> Optional[str]:
+        if semaphore is None:
+            return await metricool.normalize_media(url)
+        async with semaphore:
+            return await metricool.normalize_media(url)
+
+    # Each distinct (hash, location) is normalized once, however many photos share it
+    media_ids = await asyncio.gather(*(normalize(urls[key]) for key in misses))
+    for (key, photo_ids), media_id in zip(misses.items(), media_ids):
+        if not media_id:
+            for photo_id in photo_ids:
+                results[photo_id] = {"error": "Metricool could not process the photo"}
+            continue
+
+        entry = cached.get(key)
+        if entry is None:
+            entry = MetricoolMedia(content_hash=key[0], media_url=key[1])
+            db.add(entry)
+        entry.media_id = media_id
+        entry.created_at = now
+        entry.last_used_at = now
+        for photo_id in photo_ids:
+            results[photo_id] = {"media_id": media_id}
+
+    db.commit()
+
+    if photos:
+        hits = len(keys) - sum(len(ids) for ids in misses.values())
+        print(f"[Media Cache] {hits} cached, {len(misses)} normalized for {len(photos)} photos")
+    return results
+
+
+def invalidate_photo(db: Session, photo: Photo) -> int:
+    """Drop cached mediaIds for a photo's content; the caller commits. Returns how many were removed."""
+    if not photo.content_hash:
+        return 0
+    return db.query(MetricoolMedia).filter(
+        MetricoolMedia.content_hash == photo.content_hash
+    ).delete(synchronize_session=False)
@@ -1,9 +1,146 @@
+"""
+Metricool API Client
+
+All calls share one pooled httpx.AsyncClient, opened by the app's startup
+hook and closed on shutdown, so a run of scheduling calls reuses warm
+connections instead of doing a TCP+TLS handshake each time. HTTP/2 is used
+when the optional h2 package is installed.
+
+Requests time out explicitly and are retried with exponential backoff on
+429 and 5xx responses (honouring Retry-After) and on connection errors.
+Scheduling POSTs are only retried when Metricool can't have acted on them
+(429 or a failed connect), so a flaky 502 never creates a duplicate post.
+
+A 429 also pauses every other in-flight call until the Retry-After has
+passed (plus a little jitter), so a batch of concurrent requests backs off
+together instead of each one hitting the limit in turn. 429s have their
+own, larger retry budget since a rate-limited request was never processed.
+
+Set METRICOOL_BASE_URL to point at another API host (e.g. a local fake).
+"""
+
 import os
+import random
+import asyncio
 import httpx
 from typing import Optional
 from datetime import datetime
 
-METRICOOL_BASE_URL = "https://app.metricool.com/api"
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+METRICOOL_BASE_URL = os.getenv("METRICOOL_BASE_URL", "https://app.metricool.com/api").rstrip("/")
+
+MAX_RETRIES = 3
+MAX_RATE_LIMIT_RETRIES = 8  # a 429 means the request was not processed, so it is always safe to retry
+BACKOFF_BASE_SECONDS = 0.5
+MAX_RETRY_AFTER_SECONDS = 30.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+TIMEOUT = httpx.Timeout(20.0, connect=5.0)
+LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0)
+SCHEDULED_POSTS_PAGE_SIZE = 100
+SCHEDULED_POSTS_MAX_PAGES = 50
+
+_client: Optional[httpx.AsyncClient] = None
+# Event-loop time before which no request is sent, set when Metricool rate limits us
+_cooldown_until = 0.0
+
+
+def _new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=METRICOOL_BASE_URL,
+        timeout=TIMEOUT,
+        limits=LIMITS,
+        http2=HTTP2_AVAILABLE
+    )
+
+
+async def start_client():
+    """Open the shared connection pool. Called from the app startup hook."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _new_client()
+
+
+async def close_client():
+    """Close the shared connection pool. Called from the app shutdown hook."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """The shared client (opened on first use when running outside the app, e.g. scripts)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _new_client()
+    return _client
+
+
+def _retry_delay(response: Optional[httpx.Response], attempt: int) -> float:
+    """Seconds to wait before the next attempt: Retry-After if given, else jittered backoff."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(max(float(retry_after), 0.0), MAX_RETRY_AFTER_SECONDS)
+            except ValueError:
+                pass
+    return BACKOFF_BASE_SECONDS * (2 ** attempt) * (0.5 + random.random())
+
+
+async def _request(method: str, path: str, idempotent: bool = True, **kwargs) -> httpx.Response:
+    """
+    Send a request through the shared client, retrying transient failures.
+    Non-idempotent requests are only retried on 429 or when the connection
+    could not be made. Returns the last response; raises on transport errors.
+    """
+    global _cooldown_until
+    client = get_client()
+    loop = asyncio.get_running_loop()
+    attempt = 0
+    rate_limited = 0
+    while True:
+        wait = _cooldown_until - loop.time()
+        if wait > 0:
+            # Spread the waiting requests out so they don't all hit the limit again together
+            await asyncio.sleep(wait + random.uniform(0, BACKOFF_BASE_SECONDS))
+        try:
+            response = await client.request(method, path, **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+            if attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(_retry_delay(None, attempt))
+            attempt += 1
+            continue
+        except httpx.TransportError:
+            if not idempotent or attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(_retry_delay(None, attempt))
+            attempt += 1
+            continue
+
+        if response.status_code == 429:
+            if rate_limited == MAX_RATE_LIMIT_RETRIES:
+                return response
+            # Pause every call, not just this one, until the limit resets
+            delay = _retry_delay(response, rate_limited)
+            _cooldown_until = max(_cooldown_until, loop.time() + delay)
+            rate_limited += 1
+            print(f"[Metricool] {method} {path} rate limited, retrying in {delay:.1f}s")
+            continue
+
+        if not idempotent or response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+            return response
+
+        delay = _retry_delay(response, attempt)
+        print(f"[Metricool] {method} {path} returned {response.status_code}, retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+        attempt += 1
 
 
 def get_headers():
@@ -30,17 +167,17 @@ async def get_brands() -> list[dict]:
     if not headers or not user_id:
         return [{"error": "Metricool credentials not configured"}]
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                f"{METRICOOL_BASE_URL}/admin/simpleProfiles",
-                params={"userId": user_id},
-                headers=headers
-            )
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            return [{"error": f"Failed to fetch brands: {str(e)}"}]
+    try:
+        response = await _request(
+            "GET",
+            "/admin/simpleProfiles",
+            params={"userId": user_id},
+            headers=headers
+        )
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        return [{"error": f"Failed to fetch brands: {str(e)}"}]
 
 
 async def normalize_media(media_url: str) -> Optional[str]:
@@ -52,18 +189,18 @@ async def normalize_media(media_url: str) -> Optional[str]:
     if not headers:
         return None
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                f"{METRICOOL_BASE_URL}/actions/normalize/image/url",
-                params={"url": media_url},
-                headers=headers
-            )
-            response.raise_for_status()
-            return response.json().get("mediaId")
-        except Exception as e:
-            print(f"Media normalization failed: {e}")
-            return None
+    try:
+        response = await _request(
+            "GET",
+            "/actions/normalize/image/url",
+            params={"url": media_url},
+            headers=headers
+        )
+        response.raise_for_status()
+        return response.json().get("mediaId")
+    except Exception as e:
+        print(f"Media normalization failed: {e}")
+        return None
 
 
 async def schedule_post(
@@ -121,40 +258,67 @@ async def schedule_post(
     if media_id:
         payload["mediaIds"] = [media_id]
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{METRICOOL_BASE_URL}/v2/scheduler/posts",
-                json=payload,
-                headers=headers
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            return {"error": f"Scheduling failed: {e.response.text}"}
-        except Exception as e:
-            return {"error": f"Scheduling failed: {str(e)}"}
-
-
-async def get_scheduled_posts(blog_id: str) -> list[dict]:
-    """Get all scheduled posts for a brand"""
+    try:
+        response = await _request(
+            "POST",
+            "/v2/scheduler/posts",
+            idempotent=False,
+            json=payload,
+            headers=headers
+        )
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        return {"error": f"Scheduling failed: {e.response.text}"}
+    except Exception as e:
+        return {"error": f"Scheduling failed: {str(e)}"}
+
+
+async def get_scheduled_posts(
+    blog_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> list[dict]:
+    """
+    Get scheduled posts for a brand, optionally only those publishing between
+    start and end. Follows pages until a short page or one with nothing new
+    (an API ignoring the page parameters returns the same list again), and
+    returns an error rather than a partial list if there are too many pages.
+    """
     headers = get_headers()
     user_id = get_user_id()
 
     if not headers or not user_id:
         return [{"error": "Metricool credentials not configured"}]
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                f"{METRICOOL_BASE_URL}/v2/scheduler/posts",
-                params={"blogId": blog_id, "userId": user_id},
+    params = {"blogId": blog_id, "userId": user_id, "pageSize": SCHEDULED_POSTS_PAGE_SIZE}
+    if start:
+        params["start"] = start.strftime("%Y-%m-%dT%H:%M:%S")
+    if end:
+        params["end"] = end.strftime("%Y-%m-%dT%H:%M:%S")
+
+    posts, seen_ids = [], set()
+    try:
+        for page in range(1, SCHEDULED_POSTS_MAX_PAGES + 1):
+            response = await _request(
+                "GET",
+                "/v2/scheduler/posts",
+                params={**params, "page": page},
                 headers=headers
             )
             response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            return [{"error": f"Failed to fetch posts: {str(e)}"}]
+            body = response.json()
+            items = body.get("data", []) if isinstance(body, dict) else body
+
+            new_items = [item for item in items if str(item.get("id")) not in seen_ids]
+            posts.extend(new_items)
+            seen_ids.update(str(item.get("id")) for item in new_items)
+            if len(items) < SCHEDULED_POSTS_PAGE_SIZE or not new_items:
+                return posts
+    except Exception as e:
+        return [{"error": f"Failed to fetch posts: {str(e)}"}]
+
+    return [{"error": f"Failed to fetch posts: more than {SCHEDULED_POSTS_MAX_PAGES} pages"}]
 
 
 async def delete_scheduled_post(post_id: str) -> dict:
@@ -164,16 +328,16 @@ async def delete_scheduled_post(post_id: str) -> dict:
     if not headers:
         return {"error": "Metricool credentials not configured"}
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.delete(
-                f"{METRICOOL_BASE_URL}/v2/scheduler/posts/{post_id}",
-                headers=headers
-            )
-            response.raise_for_status()
-            return {"success": True}
-        except Exception as e:
-            return {"error": f"Delete failed: {str(e)}"}
+    try:
+        response = await _request(
+            "DELETE",
+            f"/v2/scheduler/posts/{post_id}",
+            headers=headers
+        )
+        response.raise_for_status()
+        return {"success": True}
+    except Exception as e:
+        return {"error": f"Delete failed: {str(e)}"}
 
 
 def validate_metricool_config() -> dict:
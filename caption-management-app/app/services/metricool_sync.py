@@ -0,0 +1,289 @@
+"""
+Metricool Reconciliation Sync
+
+Keeps local Posts in step with what is actually scheduled in Metricool, so
+edits and deletions made in Metricool's own UI show up here instead of
+leaving Post.status stale.
+
+For each client linked to Metricool, a sync:
+1. Fetches Metricool's scheduled posts publishing between the client's
+   cursor (MetricoolSyncState.window_start) and SYNC_HORIZON ahead, every
+   page of them, not the whole history.
+2. Looks up the matching local Posts by metricool_post_id (indexed), and
+   skips any whose Metricool copy hashes the same as at the last sync.
+3. Applies the differences in one bulk UPDATE:
+   - new date or text in Metricool -> scheduled_date / caption / hashtags
+   - published in Metricool, or gone well after its publish time -> POSTED
+   - gone well before its publish time (deleted in Metricool) -> back to
+     APPROVED, unlinked, so it can be scheduled again. Only inferred for
+     posts dated inside the fetched range, and never from an empty
+     response, since unlinking a post that is still scheduled would make
+     it publish twice once it is scheduled again
+4. Moves the cursor up to a day before now, or to the earliest post still
+   waiting to publish if that is earlier.
+
+A background loop runs the sync every METRICOOL_SYNC_INTERVAL_MINUTES
+(default 15, 0 disables it); it can also be triggered per client or for
+everyone through the API.
+"""
+
+import os
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from ..models import Client, Post, PostStatus, MetricoolSyncState
+from . import metricool, scheduling
+
+DEFAULT_INTERVAL_MINUTES = 15
+CURSOR_OVERLAP = timedelta(days=1)
+# How far ahead each sync fetches; posts dated later are left alone until they come into range
+SYNC_HORIZON = timedelta(days=180)
+# Scheduled dates are wall-clock times in the brand's timezone, not UTC
+PUBLISH_GRACE = timedelta(hours=12)
+LOOKUP_CHUNK_SIZE = 500
+PUBLISHED_STATUSES = {"published", "posted", "sent"}
+
+_sync_task: Optional[asyncio.Task] = None
+
+
+def get_sync_interval() -> float:
+    """Read the minutes between automatic syncs (0 disables the loop)."""
+    try:
+        return max(0.0, float(os.getenv("METRICOOL_SYNC_INTERVAL_MINUTES", DEFAULT_INTERVAL_MINUTES)))
+    except ValueError:
+        return DEFAULT_INTERVAL_MINUTES
+
+
+def _remote_hash(remote: dict) -> str:
+    """Fingerprint of the fields we reconcile, to skip posts that haven't changed."""
+    date = (remote.get("publicationDate") or {}).get("dateTime") or ""
+    status = str(remote.get("status") or "")
+    return hashlib.sha256(f"{remote.get('text') or ''}\x00{date}\x00{status}".encode()).hexdigest()
+
+
+def _remote_datetime(remote: dict) -> Optional[datetime]:
+    value = (remote.get("publicationDate") or {}).get("dateTime")
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "")[:19])
+    except ValueError:
+        return None
+
+
+def _split_text(text: str) -> tuple[str, str]:
+    """Split Metricool's text back into caption and hashtags (the form scheduling.build_full_caption sends)."""
+    caption, _, tail = text.rpartition("\n\n")
+    if caption and tail.split() and all(word.startswith("#") for word in tail.split()):
+        return caption, tail
+    return text, ""
+
+
+def _changes_for(post: Post, remote: dict, now: datetime) -> dict:
+    """Column updates that bring a local Post in line with its Metricool copy."""
+    changes = {}
+
+    remote_date = _remote_datetime(remote)
+    local_date = post.scheduled_date.replace(microsecond=0) if post.scheduled_date else None
+    if remote_date and remote_date != local_date:
+        changes["scheduled_date"] = remote_date
+
+    text = remote.get("text")
+    if text is not None and text != scheduling.build_full_caption(post):
+        caption, hashtags = _split_text(text)
+        changes["caption"] = caption
+        changes["hashtags"] = hashtags
+
+    if str(remote.get("status") or "").lower() in PUBLISHED_STATUSES and post.status != PostStatus.POSTED:
+        changes["status"] = PostStatus.POSTED
+        changes["posted_at"] = remote_date or now
+
+    return changes
+
+
+def _get_state(db: Session, client_id: int) -> MetricoolSyncState:
+    state = db.query(MetricoolSyncState).filter(MetricoolSyncState.client_id == client_id).first()
+    if state is None:
+        state = MetricoolSyncState(client_id=client_id)
+        db.add(state)
+        db.flush()
+    return state
+
+
+def _earliest_pending(db: Session, client_id: int) -> Optional[datetime]:
+    return db.query(func.min(Post.scheduled_date)).filter(
+        Post.client_id == client_id,
+        Post.status == PostStatus.SCHEDULED,
+        Post.metricool_post_id.isnot(None)
+    ).scalar()
+
+
+def _load_local_posts(
+    db: Session, client_id: int, remote_ids: list[str], window_start: datetime, window_end: datetime
+) -> list[Post]:
+    """Local posts linked to any of remote_ids, plus scheduled ones in the window that may have vanished."""
+    posts = {}
+    for i in range(0, len(remote_ids), LOOKUP_CHUNK_SIZE):
+        chunk = remote_ids[i:i + LOOKUP_CHUNK_SIZE]
+        for post in db.query(Post).filter(Post.client_id == client_id, Post.metricool_post_id.in_(chunk)):
+            posts[post.id] = post
+
+    for post in db.query(Post).filter(
+        Post.client_id == client_id,
+        Post.status == PostStatus.SCHEDULED,
+        Post.metricool_post_id.isnot(None),
+        Post.scheduled_date >= window_start,
+        Post.scheduled_date < window_end
+    ):
+        posts[post.id] = post
+    return list(posts.values())
+
+
+async def sync_client(db: Session, client: Client) -> dict:
+    """Reconcile one client's Posts with Metricool. Returns a summary of what changed."""
+    if not client.metricool_blog_id:
+        return {"error": "Client not linked to Metricool"}
+
+    now = datetime.utcnow()
+    state = _get_state(db, client.id)
+    window_start = state.window_start or min(filter(None, [_earliest_pending(db, client.id), now - CURSOR_OVERLAP]))
+
+    window_end = now + SYNC_HORIZON
+
+    remote_posts = await metricool.get_scheduled_posts(client.metricool_blog_id, start=window_start, end=window_end)
+    if remote_posts and isinstance(remote_posts, list) and "error" in remote_posts[0]:
+        state.last_status = "error"
+        state.last_error = remote_posts[0]["error"]
+        state.last_synced_at = now
+        db.commit()
+        return {"error": remote_posts[0]["error"]}
+
+    remote_by_id = {str(remote["id"]): remote for remote in remote_posts if remote.get("id") is not None}
+    local_posts = _load_local_posts(db, client.id, list(remote_by_id), window_start, window_end)
+
+    updates = []
+    counts = {"updated": 0, "posted": 0, "unscheduled": 0, "unchanged": 0}
+    for post in local_posts:
+        remote = remote_by_id.get(post.metricool_post_id)
+
+        if remote is None:
+            if post.status != PostStatus.SCHEDULED:
+                continue
+            if not post.scheduled_date or not window_start <= post.scheduled_date < window_end:
+                # Outside the range that was fetched - its absence says nothing
+                continue
+            if post.scheduled_date <= now - PUBLISH_GRACE:
+                # Gone after its publish time: Metricool published it
+                updates.append({"id": post.id, "status": PostStatus.POSTED, "posted_at": post.scheduled_date})
+                counts["posted"] += 1
+            elif post.scheduled_date < now + PUBLISH_GRACE:
+                # Too close to its publish time to tell (dates are in the brand's timezone) - check next run
+                continue
+            elif not remote_by_id:
+                # An empty list is more likely a glitch than every post deleted - don't unlink on it
+                continue
+            else:
+                # Gone well before its publish time: deleted in Metricool
+                updates.append({"id": post.id, "status": PostStatus.APPROVED,
+                                "metricool_post_id": None, "metricool_sync_hash": None})
+                counts["unscheduled"] += 1
+            continue
+
+        remote_hash = _remote_hash(remote)
+        if remote_hash == post.metricool_sync_hash:
+            counts["unchanged"] += 1
+            continue
+
+        changes = _changes_for(post, remote, now)
+        if changes.get("status") == PostStatus.POSTED:
+            counts["posted"] += 1
+        elif changes:
+            counts["updated"] += 1
+        else:
+            counts["unchanged"] += 1
+        updates.append({"id": post.id, "metricool_sync_hash": remote_hash, **changes})
+
+    if updates:
+        for update in updates:
+            update["updated_at"] = now
+        db.bulk_update_mappings(Post, updates)
+
+    # Next run starts a day back, or earlier if something is still waiting to publish
+    state.window_start = min(filter(None, [_earliest_pending(db, client.id), now - CURSOR_OVERLAP]))
+    state.last_synced_at = now
+    state.last_status = "ok"
+    state.last_error = None
+    state.fetched = len(remote_posts)
+    state.changed = counts["updated"] + counts["posted"] + counts["unscheduled"]
+    db.commit()
+
+    if state.changed:
+        print(f"[Metricool Sync] {client.name}: {counts['updated']} updated, {counts['posted']} posted, "
+              f"{counts['unscheduled']} unscheduled ({len(remote_posts)} fetched)")
+
+    linked_ids = {post.metricool_post_id for post in local_posts}
+    return {
+        "client_id": client.id,
+        "fetched": len(remote_posts),
+        "untracked": sum(1 for remote_id in remote_by_id if remote_id not in linked_ids),
+        "window_start": window_start.isoformat(),
+        "window_end": window_end.isoformat(),
+        **counts
+    }
+
+
+async def sync_all_clients() -> list[dict]:
+    """Sync every client linked to Metricool, one after another."""
+    db = SessionLocal()
+    try:
+        clients = db.query(Client).filter(
+            Client.metricool_blog_id.isnot(None),
+            Client.metricool_blog_id != "",
+            Client.is_active == True
+        ).all()
+        results = []
+        for client in clients:
+            try:
+                results.append(await sync_client(db, client))
+            except Exception as e:
+                db.rollback()
+                print(f"[Metricool Sync] {client.name} failed: {e}")
+                results.append({"client_id": client.id, "error": str(e)})
+        return results
+    finally:
+        db.close()
+
+
+async def _sync_loop(interval_minutes: float):
+    while True:
+        if metricool.validate_metricool_config()["configured"]:
+            try:
+                await sync_all_clients()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Metricool Sync] Sync run failed: {e}")
+        await asyncio.sleep(interval_minutes * 60)
+
+
+async def start_sync_loop():
+    """Start the periodic sync. Called from the app startup hook."""
+    global _sync_task
+    interval = get_sync_interval()
+    if _sync_task is None and interval > 0:
+        _sync_task = asyncio.create_task(_sync_loop(interval))
+
+
+async def stop_sync_loop():
+    """Cancel the periodic sync. Called from the app shutdown hook."""
+    global _sync_task
+    if _sync_task is not None:
+        _sync_task.cancel()
+        await asyncio.gather(_sync_task, return_exceptions=True)
+        _sync_task = None
@@ -0,0 +1,120 @@
+"""
+Previous-Post Selection
+
+Picks the handful of earlier captions that go into a generation prompt's
+"do not duplicate" section, without loading a client's whole history.
+
+1. Candidates: the most recent previous posts and generated posts (id,
+   caption and date only, with a SQL limit), plus the captions closest to
+   the requested theme/topic from the client's embedding index.
+2. Score: topical similarity to the theme/topic blended with recency
+   (exponential decay with a 90-day half-life).
+3. Pick: maximal marginal relevance, so the final set is relevant but not
+   ten variations of the same post.
+"""
+
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..models import PreviousPost, Post
+from . import embeddings
+
+PROMPT_PREVIOUS_POSTS = 20
+RECENT_CANDIDATES = 150
+TOPICAL_CANDIDATES = 50
+RECENCY_HALF_LIFE_DAYS = 90.0
+RELEVANCE_WEIGHT = 0.7
+MMR_LAMBDA = 0.7
+
+
+def _recent_candidates(db: Session, client_id: int) -> dict[tuple, dict]:
+    candidates = {}
+    queries = [
+        ("previous", db.query(PreviousPost.id, PreviousPost.caption, PreviousPost.posted_date).filter(
+            PreviousPost.client_id == client_id
+        ).order_by(PreviousPost.posted_date.desc(), PreviousPost.id.desc())),
+        ("post", db.query(Post.id, Post.caption, Post.created_at).filter(
+            Post.client_id == client_id
+        ).order_by(Post.created_at.desc(), Post.id.desc())),
+    ]
+    for source, query in queries:
+        for row_id, caption, date in query.limit(RECENT_CANDIDATES):
+            if caption:
+                candidates[(source, row_id)] = {"caption": caption, "date": date}
+    return candidates
+
+
+def _load_captions(db: Session, keys: list[tuple]) -> dict[tuple, dict]:
+    """Fetch caption and date for (source, id) keys not already among the candidates."""
+    loaded = {}
+    for source, model, date_column in (("previous", PreviousPost, PreviousPost.posted_date), ("post", Post, Post.created_at)):
+        ids = [row_id for key_source, row_id in keys if key_source == source]
+        if not ids:
+            continue
+        for row_id, caption, date in db.query(model.id, model.caption, date_column).filter(model.id.in_(ids)):
+            if caption:
+                loaded[(source, row_id)] = {"caption": caption, "date": date}
+    return loaded
+
+
+def _recency(date: Optional[datetime], now: datetime) -> float:
+    if not date:
+        return 0.0
+    age_days = max((now - date).total_seconds() / 86400, 0.0)
+    return 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS)
+
+
+async def select_previous_captions(
+    db: Session,
+    client_id: int,
+    content_theme: Optional[str] = None,
+    specific_topic: Optional[str] = None,
+    limit: int = PROMPT_PREVIOUS_POSTS
+) -> list[str]:
+    """
+    Return up to `limit` earlier captions for the prompt, least relevant first
+    (prompts read the tail of the list, so the strongest examples come last).
+    """
+    candidates = _recent_candidates(db, client_id)
+    if not candidates:
+        return []
+
+    index = await embeddings.get_client_index(db, client_id)
+    query_text = " ".join(filter(None, [content_theme, specific_topic]))
+    query_vector = (await embeddings.embed_texts([query_text]))[0] if query_text else None
+
+    if query_vector is not None:
+        topical = [key for key, _ in index.search(query_vector, TOPICAL_CANDIDATES) if key not in candidates]
+        candidates.update(_load_captions(db, topical))
+
+    keys = list(candidates)
+    vectors = np.zeros((len(keys), index.dim), dtype=np.float32)
+    for i, key in enumerate(keys):
+        row = index.rows.get(key)
+        if row is not None:
+            vectors[i] = index.matrix[row]
+
+    now = datetime.utcnow()
+    recency = np.array([_recency(candidates[key]["date"], now) for key in keys], dtype=np.float32)
+    if query_vector is not None:
+        relevance = np.clip(vectors @ query_vector, 0.0, 1.0)
+        scores = RELEVANCE_WEIGHT * relevance + (1 - RELEVANCE_WEIGHT) * recency
+    else:
+        scores = recency
+
+    # Maximal marginal relevance: trade score off against similarity to what's already picked
+    selected: list[int] = []
+    max_overlap = np.zeros(len(keys), dtype=np.float32)
+    available = np.ones(len(keys), dtype=bool)
+    for _ in range(min(limit, len(keys))):
+        mmr = MMR_LAMBDA * scores - (1 - MMR_LAMBDA) * max_overlap
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        available[best] = False
+        max_overlap = np.maximum(max_overlap, vectors @ vectors[best])
+
+    return [candidates[keys[i]]["caption"] for i in reversed(selected)]
@@ -0,0 +1,57 @@
+"""
+Post Statistics
+
+Post counts by status and latest activity per client, for pages that show
+numbers for many clients at once (dashboard, client list) or a summary
+above a shortened post list (client page). One GROUP BY query over
+(client_id, status) replaces loading every post just to count it.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models import Post
+
+
+@dataclass
+class PostStats:
+    total: int = 0
+    by_status: dict = field(default_factory=dict)
+    last_activity: Optional[datetime] = None  # Latest post created or edited
+
+    def count(self, status: str) -> int:
+        return self.by_status.get(status, 0)
+
+    def add(self, status: str, count: int, last_activity: Optional[datetime]):
+        self.total += count
+        self.by_status[status] = self.by_status.get(status, 0) + count
+        if last_activity and (self.last_activity is None or last_activity > self.last_activity):
+            self.last_activity = last_activity
+
+
+async def post_stats_by_client(db: AsyncSession, client_id: Optional[int] = None) -> defaultdict:
+    """PostStats per client id (all clients unless client_id is given); clients without posts get empty stats."""
+    query = select(
+        Post.client_id, Post.status, func.count(Post.id), func.max(func.coalesce(Post.updated_at, Post.created_at))
+    ).group_by(Post.client_id, Post.status)
+    if client_id is not None:
+        query = query.where(Post.client_id == client_id)
+
+    stats = defaultdict(PostStats)
+    for row_client_id, status, count, last_activity in await db.execute(query):
+        stats[row_client_id].add(status, count, last_activity)
+    return stats
+
+
+def combined(stats: Iterable[PostStats]) -> PostStats:
+    """Totals over several clients' stats."""
+    total = PostStats()
+    for client_stats in stats:
+        for status, count in client_stats.by_status.items():
+            total.add(status, count, client_stats.last_activity)
+    return total
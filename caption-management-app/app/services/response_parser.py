@@ -0,0 +1,310 @@
+"""
+LLM Response Parsing
+
+Claude is asked to answer with JSON (an array of captions / photo matches,
+or a single strategy object), usually wrapped in a ```json fence and
+sometimes with a sentence before or after it. Every service parses those
+answers through this module instead of slicing between brackets:
+
+- JSONArrayStreamParser reads an array incrementally - feed it text as it
+  streams in and it hands back each object as soon as its closing brace
+  arrives. Stray brackets in surrounding prose are skipped, and if the
+  answer is cut off (max_tokens) the objects before the cut are kept.
+- parse_json_array / parse_json_object parse a complete answer and check
+  each object against a small schema, returning the good items alongside
+  a report of the ones that failed, so one malformed caption no longer
+  throws away the whole batch.
+
+A schema maps field names to specs:
+    {"caption": {"type": str, "required": True},
+     "hashtags": {"type": list, "default": [], "clean": normalize_hashtags}}
+Values of the wrong type are coerced where it is unambiguous (a number in
+a string, a comma-separated string for a list); otherwise the item fails.
+"""
+
+import re
+import json
+from typing import Optional
+
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
+
+class JSONArrayStreamParser:
+    """
+    Incremental parser for the first top-level JSON array of objects in a
+    text stream.
+
+    Usage:
+        parser = JSONArrayStreamParser()
+        async for chunk in stream:
+            for item in parser.feed(chunk):
+                ...
+        parser.finish()
+        parser.failures  # [{"index": 2, "error": "..."}] for objects that could not be read
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.array_started = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.item_start = None
+        self.item_count = 0
+        self.failures: list[dict] = []
+
+    def feed(self, text: str) -> list[dict]:
+        """Add streamed text and return the objects completed by it."""
+        if self.finished:
+            return []
+
+        self.buffer += text
+        items = []
+
+        while self.pos < len(self.buffer):
+            char = self.buffer[self.pos]
+
+            if not self.array_started:
+                if char == "[":
+                    self.array_started = True
+                    self.depth = 1
+                self.pos += 1
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                if self.depth == 1 and char == "{":
+                    self.item_start = self.pos
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 1 and char == "}" and self.item_start is not None:
+                    items.extend(self._close_item(self.buffer[self.item_start:self.pos + 1]))
+                elif self.depth == 0:
+                    if self.item_count == 0:
+                        # Something like "[5]" in the prose before the real array - keep looking
+                        self.array_started = False
+                    else:
+                        self.finished = True
+                        self.pos += 1
+                        break
+
+            self.pos += 1
+
+        self._compact()
+        return items
+
+    def finish(self) -> bool:
+        """
+        Call once the stream has ended. Records a cut-off final object as a
+        failure and returns True if the array was not properly closed.
+        """
+        if self.item_start is not None:
+            self.failures.append({"index": self.item_count, "error": "Response was cut off mid-item"})
+            self.item_start = None
+            self.item_count += 1
+        return self.array_started and not self.finished
+
+    def _close_item(self, raw: str) -> list[dict]:
+        index = self.item_count
+        self.item_count += 1
+        self.item_start = None
+
+        item = _loads_lenient(raw)
+        if item is None:
+            self.failures.append({"index": index, "error": "Invalid JSON object"})
+            return []
+        if not isinstance(item, dict):
+            self.failures.append({"index": index, "error": "Array item is not an object"})
+            return []
+        return [item]
+
+    def _compact(self):
+        """Drop text that can no longer be part of an item."""
+        keep_from = self.item_start if self.item_start is not None else self.pos
+        if keep_from > 0:
+            self.buffer = self.buffer[keep_from:]
+            self.pos -= keep_from
+            if self.item_start is not None:
+                self.item_start -= keep_from
+
+
+class ParseResult:
+    """Valid items from a response plus a report of the ones that were dropped."""
+
+    def __init__(self, items: list[dict], failures: list[dict], truncated: bool = False):
+        self.items = items
+        self.failures = failures
+        self.truncated = truncated
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def describe_failures(self) -> str:
+        return "; ".join(
+            f"item {f['index'] + 1}: {f['error']}" if f["index"] is not None else f["error"]
+            for f in self.failures
+        )
+
+
+def _loads_lenient(raw: str):
+    """json.loads, retried once without trailing commas. Returns None if both fail."""
+    for candidate in (raw, _TRAILING_COMMA_RE.sub(r"\1", raw)):
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def _scan_object(text: str, start: int) -> tuple[Optional[int], list[tuple[int, str]]]:
+    """
+    Scan a JSON object from text[start] ('{').
+    Returns (end index or None if it never closes, [(comma position, closers needed there)]).
+    """
+    stack = []
+    in_string = escape = False
+    commas = []
+    for pos in range(start, len(text)):
+        char = text[pos]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            stack.append("}")
+        elif char == "[":
+            stack.append("]")
+        elif char in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return pos, commas
+        elif char == ",":
+            commas.append((pos, "".join(reversed(stack))))
+    return None, commas
+
+
+def _repair_truncated(text: str, start: int, commas: list[tuple[int, str]]) -> Optional[dict]:
+    """Recover a cut-off object by dropping the unfinished tail and closing what's open."""
+    for pos, closers in reversed(commas[-50:]):
+        value = _loads_lenient(text[start:pos] + closers)
+        if isinstance(value, dict):
+            return value
+    return None
+
+
+def validate_item(item: dict, schema: dict) -> tuple[Optional[dict], Optional[str]]:
+    """Check and coerce one object against a schema. Returns (clean item, None) or (None, error)."""
+    cleaned = dict(item)
+    for field, spec in schema.items():
+        value = cleaned.get(field)
+        expected = spec.get("type")
+
+        if value is None or value == "" or value == []:
+            if spec.get("required"):
+                return None, f"missing {field}"
+            if "default" in spec:
+                cleaned[field] = spec["default"]
+            continue
+
+        if expected is list and isinstance(value, str):
+            value = [part.strip() for part in value.split(",") if part.strip()]
+        elif expected in (int, float) and isinstance(value, str):
+            try:
+                value = expected(value.strip())
+            except ValueError:
+                return None, f"{field} is not a number"
+        elif expected is float and isinstance(value, int) and not isinstance(value, bool):
+            value = float(value)
+        elif expected is str and isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+
+        if expected and not isinstance(value, expected):
+            return None, f"{field} should be {expected.__name__}, got {type(value).__name__}"
+
+        if spec.get("clean"):
+            value = spec["clean"](value)
+        cleaned[field] = value
+    return cleaned, None
+
+
+def _apply_schema(items: list[dict], schema: Optional[dict], failures: list[dict], indexes: list[int]) -> list[dict]:
+    if not schema:
+        return items
+    valid = []
+    for index, item in zip(indexes, items):
+        cleaned, error = validate_item(item, schema)
+        if error:
+            failures.append({"index": index, "error": error})
+        else:
+            valid.append(cleaned)
+    return valid
+
+
+def parse_json_array(text: str, schema: Optional[dict] = None) -> ParseResult:
+    """
+    Parse a complete response that should contain a JSON array of objects.
+    Recovers every readable object even if the array is wrapped in prose or
+    cut off, and validates each against the schema if one is given.
+    """
+    parser = JSONArrayStreamParser()
+    items = parser.feed(text or "")
+    truncated = parser.finish()
+
+    # Indexes of the items that parsed, in order, for failure reporting
+    failed_indexes = {f["index"] for f in parser.failures}
+    indexes = [i for i in range(parser.item_count) if i not in failed_indexes]
+
+    failures = list(parser.failures)
+    if not parser.array_started and not items:
+        failures.append({"index": None, "error": "No JSON array found in response"})
+
+    valid = _apply_schema(items, schema, failures, indexes)
+    failures.sort(key=lambda f: -1 if f["index"] is None else f["index"])
+    return ParseResult(valid, failures, truncated)
+
+
+def parse_json_object(text: str, schema: Optional[dict] = None) -> ParseResult:
+    """
+    Parse a complete response that should contain a single JSON object.
+    Skips prose and fences around it, tolerates trailing commas, and
+    recovers the complete fields of an object that was cut off.
+    """
+    text = text or ""
+    truncated = False
+    value = None
+
+    starts = [m.start() for m in re.finditer(r"\{", text)][:10]
+    for start in starts:
+        end, commas = _scan_object(text, start)
+        if end is not None:
+            value = _loads_lenient(text[start:end + 1])
+        else:
+            value = _repair_truncated(text, start, commas)
+            truncated = value is not None
+        if isinstance(value, dict):
+            break
+        value = None
+
+    if value is None:
+        return ParseResult([], [{"index": None, "error": "No JSON object found in response"}])
+
+    failures = []
+    valid = _apply_schema([value], schema, failures, [None])
+    return ParseResult(valid, failures, truncated)
@@ -0,0 +1,132 @@
+"""
+Batch Scheduling
+
+Pushes every approved, dated post of a batch to Metricool in one go:
+photos are normalized to Metricool mediaIds concurrently (each photo once,
+even if several posts use it), posts are submitted with bounded
+parallelism, and each post's status / metricool_post_id is committed as
+soon as Metricool accepts it, so a crash partway through a batch doesn't
+leave posts scheduled remotely but APPROVED here (and scheduled twice on a
+retry). Each post gets its own result, so one rejected post doesn't hide
+the rest.
+
+Photo URLs sent to Metricool are built from PUBLIC_BASE_URL (the public
+address of this app); without it, posts with photos are reported as errors
+rather than scheduled without their image. mediaIds come from media_cache,
+so photos scheduled before skip the normalize call. Set METRICOOL_MAX_CONCURRENCY to
+change how many requests run at once (default 4). 429s are handled in
+metricool._request.
+"""
+
+import os
+import asyncio
+
+from sqlalchemy.orm import Session, joinedload
+
+from ..models import Client, Post, Batch, PostStatus
+from . import metricool, media_cache
+
+DEFAULT_MAX_CONCURRENCY = 4
+
+
+def get_max_concurrency() -> int:
+    """Read the Metricool request concurrency from the environment."""
+    try:
+        return max(1, int(os.getenv("METRICOOL_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)))
+    except ValueError:
+        return DEFAULT_MAX_CONCURRENCY
+
+
+def build_full_caption(post: Post) -> str:
+    """Caption text as published: the caption followed by its hashtags."""
+    full_caption = post.caption
+    if post.hashtags:
+        full_caption += f"\n\n{post.hashtags}"
+    return full_caption
+
+
+async def schedule_batch(db: Session, client: Client, batch_name: str) -> dict:
+    """
+    Schedule all APPROVED posts of a client's batch that have a date.
+    Returns counts plus a per-post result list.
+    """
+    if not client.metricool_blog_id:
+        return {"error": "Client not linked to Metricool"}
+
+    posts = db.query(Post).options(joinedload(Post.photo)).filter(
+        Post.client_id == client.id,
+        Post.batch_name == batch_name,
+        Post.status == PostStatus.APPROVED
+    ).order_by(Post.scheduled_date, Post.id).all()
+
+    results = {}
+    ready = []
+    for post in posts:
+        if not post.scheduled_date:
+            results[post.id] = {"post_id": post.id, "status": "skipped", "error": "No scheduled date set"}
+        else:
+            ready.append(post)
+
+    semaphore = asyncio.Semaphore(get_max_concurrency())
+
+    photos = {post.photo.id: post.photo for post in ready if post.photo}
+    media = await media_cache.get_media_ids(db, list(photos.values()), semaphore)
+
+    async def submit(post: Post) -> tuple[Post, dict]:
+        media_id = None
+        if post.photo:
+            normalized = media[post.photo.id]
+            if "error" in normalized:
+                return post, normalized
+            media_id = normalized["media_id"]
+
+        async with semaphore:
+            result = await metricool.schedule_post(
+                blog_id=client.metricool_blog_id,
+                caption=build_full_caption(post),
+                platform=post.platform,
+                scheduled_datetime=post.scheduled_date,
+                media_id=media_id
+            )
+        if "error" not in result:
+            # Record it right away; a retry only picks up posts still APPROVED
+            post.status = PostStatus.SCHEDULED
+            post.metricool_post_id = result.get("id")
+            db.commit()
+        return post, result
+
+    scheduled = 0
+    rejected_photos = {}
+    for post, result in await asyncio.gather(*(submit(post) for post in ready)):
+        if "error" in result:
+            results[post.id] = {"post_id": post.id, "status": "failed", "error": result["error"]}
+            if post.photo and "media" in result["error"].lower():
+                # Metricool rejected the attachment - don't keep reusing that mediaId
+                rejected_photos[post.photo.id] = post.photo
+            continue
+        results[post.id] = {"post_id": post.id, "status": "scheduled", "metricool_id": result.get("id")}
+        scheduled += 1
+
+    failed = sum(1 for r in results.values() if r["status"] == "failed")
+    skipped = sum(1 for r in results.values() if r["status"] == "skipped")
+
+    batch = db.query(Batch).filter(Batch.client_id == client.id, Batch.name == batch_name).first()
+    if batch and scheduled and not failed and not skipped:
+        batch.status = "scheduled"
+
+    for photo in rejected_photos.values():
+        media_cache.invalidate_photo(db, photo)
+
+    # Batch status and the dropped mediaIds; the posts were committed one by one
+    db.commit()
+
+    print(f"[Scheduling] {client.name} / {batch_name}: {scheduled} of {len(posts)} approved posts scheduled")
+
+    return {
+        "batch_name": batch_name,
+        "approved": len(posts),
+        "scheduled": scheduled,
+        "failed": failed,
+        "skipped": skipped,
+        "results": [results[post.id] for post in posts]
+    }
@@ -0,0 +1,354 @@
+"""
+Object Storage
+
+Uploaded files (photos, thumbnails, strategy documents) are written and read
+through a storage backend instead of directly on the app's disk, so several
+app instances can serve the same media.
+
+Files are addressed by key, e.g. "acme/3f2a...jpg" or "thumbs/3f2a...-md.jpg".
+Database rows keep their logical path "/static/uploads/<key>"; key_for()
+and path_for() convert between the two.
+
+Backends (STORAGE_BACKEND):
+- "local" (default): files under static/uploads on this instance's disk.
+- "s3": any S3-compatible bucket (AWS, R2, MinIO...). Needs boto3 and
+  S3_BUCKET; optional S3_ENDPOINT_URL, S3_REGION, S3_PREFIX. Credentials
+  come from the usual AWS_* environment variables.
+
+Both hand out time-limited URLs: S3 presigns them, the local backend signs
+/media/<key> links with SECRET_KEY (or APP_PASSWORD) and refuses to without
+one - a built-in key would let anyone who has read the code forge links. Expiry is rounded up to the hour so a
+page renders the same URL for a while and browsers can cache it. Both
+support range reads (resumable downloads, video seeking).
+"""
+
+import os
+import hmac
+import time
+import asyncio
+import hashlib
+import shutil
+from pathlib import Path
+from typing import Optional, AsyncIterator
+from urllib.parse import quote
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+    BOTO3_AVAILABLE = True
+except ImportError:
+    BOTO3_AVAILABLE = False
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+LOCAL_ROOT = BASE_DIR / "static" / "uploads"
+# Outside static/, which is served publicly; beside it so saves are a rename
+DEFAULT_UPLOAD_TMP_DIR = BASE_DIR / ".upload-tmp"
+# Where older versions kept it, inside the public static mount
+LEGACY_UPLOAD_TMP_DIR = LOCAL_ROOT / ".tmp"
+PATH_PREFIX = "/static/uploads/"
+
+DEFAULT_URL_EXPIRY_SECONDS = 6 * 3600
+# Long enough for Metricool to fetch a photo it is normalizing
+EXTERNAL_URL_EXPIRY_SECONDS = 7 * 24 * 3600
+READ_CHUNK_SIZE = 256 * 1024
+# Values from .env.example, as public as having no secret at all
+PLACEHOLDER_SECRETS = {"your_secret_key_for_sessions"}
+
+_backend: Optional["StorageBackend"] = None
+_legacy_tmp_removed = False
+
+
+def key_for(path: str) -> str:
+    """Storage key for a logical /static/uploads/... path."""
+    path = path or ""
+    return path[len(PATH_PREFIX):] if path.startswith(PATH_PREFIX) else path.lstrip("/")
+
+
+def path_for(key: str) -> str:
+    """Logical path stored in the database for a key."""
+    return PATH_PREFIX + key
+
+
+def _rounded_expiry(expires_in: int) -> int:
+    """Absolute expiry rounded up to the hour, so URLs stay stable between renders."""
+    return (int(time.time() + expires_in) // 3600 + 1) * 3600
+
+
+def _signing_key() -> Optional[bytes]:
+    for name in ("SECRET_KEY", "APP_PASSWORD"):
+        value = (os.getenv(name) or "").strip()
+        if value and value not in PLACEHOLDER_SECRETS:
+            return value.encode()
+    return None
+
+
+def check_signing_key():
+    """Raise if local media links would need signing but no secret is configured."""
+    if get_backend().name == "local" and _signing_key() is None:
+        raise RuntimeError("SECRET_KEY is not set - it signs /media links to uploaded files. "
+                           "Set it to a long random string, e.g. `python -c \"import secrets; print(secrets.token_hex(32))\"`")
+
+
+def sign_media(key: str, expires: int) -> str:
+    signing_key = _signing_key()
+    if signing_key is None:
+        raise RuntimeError("SECRET_KEY is not set, media links can't be signed")
+    return hmac.new(signing_key, f"{key}\n{expires}".encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def verify_media_signature(key: str, expires: str, signature: str) -> bool:
+    """Check a /media/<key> link signed by LocalStorageBackend.url."""
+    if not expires.isdigit() or int(expires) < time.time() or _signing_key() is None:
+        return False
+    return hmac.compare_digest(sign_media(key, int(expires)), signature or "")
+
+
+class StorageBackend:
+    """Where uploaded files live. All methods take storage keys."""
+
+    name = ""
+
+    async def save_file(self, key: str, source: Path, content_type: Optional[str] = None):
+        """Store a local file under key. The source file is consumed (moved or deleted)."""
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def size(self, key: str) -> Optional[int]:
+        """Size in bytes, or None if the key doesn't exist."""
+        raise NotImplementedError
+
+    async def read_range(self, key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        """Bytes start..end (inclusive, like an HTTP Range); the whole object by default."""
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def url(self, key: str, expires_in: int = DEFAULT_URL_EXPIRY_SECONDS) -> str:
+        """Time-limited URL a browser can load the file from."""
+        raise NotImplementedError
+
+    def external_url(self, key: str) -> Optional[str]:
+        """URL a third party (Metricool) can fetch the file from, or None if there is none."""
+        raise NotImplementedError
+
+    def location(self, key: str) -> str:
+        """Stable identifier of the stored file, e.g. for cache keys (URLs above may change)."""
+        raise NotImplementedError
+
+    async def read(self, key: str) -> bytes:
+        return await self.read_range(key)
+
+    async def iter_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        """Stream bytes start..end (inclusive) in chunks."""
+        position = start
+        while position <= end:
+            chunk_end = min(position + READ_CHUNK_SIZE - 1, end)
+            yield await self.read_range(key, position, chunk_end)
+            position = chunk_end + 1
+
+    async def fetch_to(self, key: str, destination: Path):
+        """Copy an object to a local file (for tools that need a real path, like Pillow)."""
+        size = await self.size(key)
+        if size is None:
+            raise FileNotFoundError(key)
+        with open(destination, "wb") as out:
+            async for chunk in self.iter_range(key, 0, size - 1):
+                out.write(chunk)
+
+
+class LocalStorageBackend(StorageBackend):
+    """Files on this instance's disk, under static/uploads."""
+
+    name = "local"
+
+    def __init__(self, root: Path = LOCAL_ROOT):
+        self.root = root
+
+    def local_path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    async def save_file(self, key: str, source: Path, content_type: Optional[str] = None):
+        destination = self.local_path(key)
+
+        def move():
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.replace(source, destination)
+            except OSError:
+                # Different filesystem - copy next to the destination, then swap in
+                tmp = destination.with_name(f".{destination.name}.tmp")
+                shutil.copyfile(source, tmp)
+                os.replace(tmp, destination)
+                os.remove(source)
+
+        await asyncio.to_thread(move)
+
+    async def exists(self, key: str) -> bool:
+        return self.local_path(key).is_file()
+
+    async def size(self, key: str) -> Optional[int]:
+        path = self.local_path(key)
+        return path.stat().st_size if path.is_file() else None
+
+    async def read_range(self, key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        path = self.local_path(key)
+
+        def read():
+            with open(path, "rb") as f:
+                f.seek(start)
+                return f.read() if end is None else f.read(end - start + 1)
+
+        return await asyncio.to_thread(read)
+
+    async def delete(self, key: str) -> bool:
+        try:
+            self.local_path(key).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def url(self, key: str, expires_in: int = DEFAULT_URL_EXPIRY_SECONDS) -> str:
+        expires = _rounded_expiry(expires_in)
+        return f"/media/{quote(key)}?expires={expires}&signature={sign_media(key, expires)}"
+
+    def external_url(self, key: str) -> Optional[str]:
+        base_url = os.getenv("PUBLIC_BASE_URL", "").strip().rstrip("/")
+        return f"{base_url}{path_for(quote(key))}" if base_url else None
+
+    def location(self, key: str) -> str:
+        return self.external_url(key) or path_for(key)
+
+
+class S3StorageBackend(StorageBackend):
+    """An S3-compatible bucket, shared by every app instance."""
+
+    name = "s3"
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, region: Optional[str] = None, prefix: str = ""):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            config=BotoConfig(signature_version="s3v4", s3={"addressing_style": "path" if endpoint_url else "auto"},
+                              retries={"max_attempts": 3, "mode": "standard"})
+        )
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    async def save_file(self, key: str, source: Path, content_type: Optional[str] = None):
+        extra = {"ContentType": content_type} if content_type else None
+        await asyncio.to_thread(self.client.upload_file, str(source), self.bucket, self._key(key), ExtraArgs=extra)
+        os.remove(source)
+
+    async def size(self, key: str) -> Optional[int]:
+        try:
+            head = await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return head["ContentLength"]
+
+    async def exists(self, key: str) -> bool:
+        return await self.size(key) is not None
+
+    async def read_range(self, key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        kwargs = {"Bucket": self.bucket, "Key": self._key(key)}
+        if start or end is not None:
+            kwargs["Range"] = f"bytes={start}-{'' if end is None else end}"
+
+        def read():
+            return self.client.get_object(**kwargs)["Body"].read()
+
+        return await asyncio.to_thread(read)
+
+    async def delete(self, key: str) -> bool:
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self._key(key))
+        return True
+
+    def url(self, key: str, expires_in: int = DEFAULT_URL_EXPIRY_SECONDS) -> str:
+        # Presigning is local computation, no request is made
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._key(key)},
+            ExpiresIn=max(_rounded_expiry(expires_in) - int(time.time()), 1)
+        )
+
+    def external_url(self, key: str) -> Optional[str]:
+        return self.url(key, EXTERNAL_URL_EXPIRY_SECONDS)
+
+    def location(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self._key(key)}"
+
+
+def get_backend() -> StorageBackend:
+    """Return the configured storage backend (local disk unless set otherwise)."""
+    global _backend
+    if _backend is None:
+        name = os.getenv("STORAGE_BACKEND", "local").strip().lower()
+        bucket = os.getenv("S3_BUCKET")
+        if name == "s3" and bucket and BOTO3_AVAILABLE:
+            _backend = S3StorageBackend(
+                bucket,
+                endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+                region=os.getenv("S3_REGION"),
+                prefix=os.getenv("S3_PREFIX", "")
+            )
+        else:
+            if name not in ("local", ""):
+                print(f"[Storage] Backend '{name}' not available (needs boto3 and S3_BUCKET), using local disk")
+            _backend = LocalStorageBackend()
+    return _backend
+
+
+def upload_tmp_dir() -> Path:
+    """
+    Scratch folder for files on their way into storage (uploads in progress,
+    thumbnail and strategy parsing work directories). Never under static/,
+    which is served without the password guard. Set UPLOAD_TMP_DIR to keep it
+    on the same filesystem as static/uploads when that is a separate mount;
+    otherwise saves fall back to a copy.
+    """
+    global _legacy_tmp_removed
+    folder = Path(os.getenv("UPLOAD_TMP_DIR") or DEFAULT_UPLOAD_TMP_DIR)
+    folder.mkdir(parents=True, exist_ok=True)
+    if not _legacy_tmp_removed:
+        # Leftovers there would stay downloadable
+        shutil.rmtree(LEGACY_UPLOAD_TMP_DIR, ignore_errors=True)
+        _legacy_tmp_removed = True
+    return folder
+
+
+def media_url(path: Optional[str], expires_in: int = DEFAULT_URL_EXPIRY_SECONDS) -> Optional[str]:
+    """Browser URL for a stored file's logical path (used by templates)."""
+    if not path:
+        return path
+    return get_backend().url(key_for(path), expires_in)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """Parse a single 'bytes=a-b' Range header into an inclusive (start, end), or None for the whole file."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[6:].partition("-")
+    try:
+        if not start_text:
+            length = int(end_text)
+            return (max(size - length, 0), size - 1) if length > 0 else None
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
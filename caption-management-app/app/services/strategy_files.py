@@ -0,0 +1,241 @@
+"""
+Strategy File Processing
+
+Uploading a strategy document only stores it; parsing runs afterwards as a
+background task so a 200-page brand book doesn't hold the request open:
+
+    pending -> extracting (text, in strategy_parser's process pool)
+            -> analyzing  (Claude)
+            -> done / failed
+
+The StrategyFile row is the job handle: the upload returns its id and the
+onboarding page polls /clients/{id}/onboarding/files/{file_id} until the
+status is final. Extracted fields are merged into the client's Strategy
+without overwriting values that are already filled in.
+
+Complete extractions are cached in strategy_extractions by the document's
+content hash, so uploading the same file again skips both the parsing and
+the Claude calls.
+
+Files left mid-parse by a restart are picked up again on startup.
+"""
+
+import asyncio
+import shutil
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from ..models import Strategy, StrategyFile, StrategyExtraction
+from . import storage, strategy_parser
+
+FINAL_STATUSES = ("done", "failed")
+# Strategy fields that collect values from every document
+LIST_FIELDS = ["tone_keywords", "content_pillars", "audience_pain_points", "unique_selling_points",
+               "key_messages", "topics_to_avoid", "platforms"]
+
+_resume_task: Optional[asyncio.Task] = None
+
+
+def apply_to_strategy(strategy: Strategy, extracted: dict):
+    """Merge extracted data into a Strategy (don't overwrite existing values)."""
+    if extracted.get("brand_voice") and not strategy.brand_voice:
+        strategy.brand_voice = extracted["brand_voice"]
+
+    if extracted.get("target_audience") and not strategy.target_audience:
+        strategy.target_audience = extracted["target_audience"]
+
+    if extracted.get("industry") and extracted["industry"] != "default" and not strategy.industry:
+        strategy.industry = extracted["industry"]
+
+    for field in LIST_FIELDS:
+        if extracted.get(field):
+            existing = getattr(strategy, field) or []
+            setattr(strategy, field, list(dict.fromkeys(existing + extracted[field])))
+
+    # Handle hashtags
+    if extracted.get("hashtags_primary") or extracted.get("hashtags_secondary"):
+        existing_sets = dict(strategy.hashtag_sets or {"primary": [], "secondary": []})
+        if extracted.get("hashtags_primary"):
+            existing_sets["primary"] = list(dict.fromkeys(
+                existing_sets.get("primary", []) + extracted["hashtags_primary"]
+            ))
+        if extracted.get("hashtags_secondary"):
+            existing_sets["secondary"] = list(dict.fromkeys(
+                existing_sets.get("secondary", []) + extracted["hashtags_secondary"]
+            ))
+        strategy.hashtag_sets = existing_sets
+
+    if extracted.get("additional_notes"):
+        if strategy.additional_notes:
+            strategy.additional_notes += "\n\n" + extracted["additional_notes"]
+        else:
+            strategy.additional_notes = extracted["additional_notes"]
+
+
+def status_payload(strategy_file: StrategyFile) -> dict:
+    """What the polling endpoint returns for a file."""
+    payload = {
+        "file_id": strategy_file.id,
+        "filename": strategy_file.original_filename,
+        "status": strategy_file.parse_status or "done",
+        "pages": strategy_file.page_count,
+        "summary": strategy_file.extracted_summary or "",
+    }
+    if strategy_file.parse_status == "failed":
+        payload["error"] = strategy_file.parse_error or "Processing failed"
+    if strategy_file.parse_status == "done":
+        payload["extracted"] = strategy_file.extracted_data or {}
+    return payload
+
+
+def _cached_extraction(db: Session, content_hash: Optional[str]) -> Optional[StrategyExtraction]:
+    if not content_hash:
+        return None
+    return db.query(StrategyExtraction).filter(
+        StrategyExtraction.content_hash == content_hash,
+        StrategyExtraction.extractor_version == strategy_parser.EXTRACTOR_VERSION
+    ).first()
+
+
+def _store_extraction(db: Session, content_hash: Optional[str], extracted: dict, page_count: Optional[int]):
+    """Cache a complete extraction (partial ones are retried on the next upload instead)."""
+    if not content_hash or extracted.get("failed_chunks"):
+        return
+    entry = db.query(StrategyExtraction).filter(StrategyExtraction.content_hash == content_hash).first()
+    if entry is None:
+        entry = StrategyExtraction(content_hash=content_hash)
+        db.add(entry)
+    entry.extractor_version = strategy_parser.EXTRACTOR_VERSION
+    entry.extracted_data = extracted
+    entry.page_count = page_count
+    entry.chunk_count = extracted.get("chunks", 1)
+    entry.created_at = datetime.utcnow()
+    entry.last_used_at = entry.created_at
+
+
+def _finish(db: Session, strategy_file: StrategyFile, extracted: dict):
+    """Record a successful extraction and merge it into the client's strategy."""
+    strategy_file.extracted_summary = extracted.get("summary", "")
+    strategy_file.extracted_data = extracted
+    strategy_file.parse_status = "done"
+    strategy_file.processed = True
+    client = strategy_file.client
+    if client and client.strategy:
+        apply_to_strategy(client.strategy, extracted)
+    db.commit()
+
+
+async def _extract(strategy_file: StrategyFile) -> dict:
+    """Extract the text, from the stored file directly or from a temporary copy of it."""
+    backend = storage.get_backend()
+    key = storage.key_for(strategy_file.file_path)
+    if isinstance(backend, storage.LocalStorageBackend):
+        return await strategy_parser.extract_text(str(backend.local_path(key)), strategy_file.original_filename)
+
+    work_dir = tempfile.mkdtemp(dir=storage.upload_tmp_dir())
+    try:
+        source = Path(work_dir) / strategy_file.filename
+        await backend.fetch_to(key, source)
+        return await strategy_parser.extract_text(str(source), strategy_file.original_filename)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+async def process_strategy_file(file_id: int) -> bool:
+    """Parse an uploaded strategy file and merge the results into the client's strategy. Returns True on success."""
+    db = SessionLocal()
+    try:
+        strategy_file = db.query(StrategyFile).filter(StrategyFile.id == file_id).first()
+        if not strategy_file:
+            return False
+
+        def fail(error: str) -> bool:
+            strategy_file.parse_status = "failed"
+            strategy_file.parse_error = error
+            strategy_file.processed = True
+            db.commit()
+            print(f"[Strategy Files] {strategy_file.original_filename}: {error}")
+            return False
+
+        cached = _cached_extraction(db, strategy_file.content_hash)
+        if cached:
+            cached.last_used_at = datetime.utcnow()
+            strategy_file.page_count = cached.page_count
+            _finish(db, strategy_file, dict(cached.extracted_data))
+            print(f"[Strategy Files] {strategy_file.original_filename}: reused cached extraction")
+            return True
+
+        strategy_file.parse_status = "extracting"
+        strategy_file.parse_error = None
+        db.commit()
+
+        try:
+            extraction = await _extract(strategy_file)
+        except FileNotFoundError:
+            return fail("The uploaded file is missing")
+        if "error" in extraction:
+            return fail(extraction["error"])
+
+        strategy_file.parse_status = "analyzing"
+        strategy_file.page_count = extraction["pages"]
+        db.commit()
+
+        client = strategy_file.client
+        extracted = await strategy_parser.analyze_strategy_text(
+            extraction["text"], strategy_file.original_filename, client.name if client else ""
+        )
+        if "error" in extracted:
+            return fail(extracted["error"])
+
+        extracted = {key: value for key, value in extracted.items() if key != "raw_content"}
+        _store_extraction(db, strategy_file.content_hash, extracted, extraction["pages"])
+        _finish(db, strategy_file, extracted)
+        return True
+    except Exception as e:
+        db.rollback()
+        print(f"[Strategy Files] Processing file {file_id} failed: {e}")
+        strategy_file = db.query(StrategyFile).filter(StrategyFile.id == file_id).first()
+        if strategy_file:
+            strategy_file.parse_status = "failed"
+            strategy_file.parse_error = str(e)
+            db.commit()
+        return False
+    finally:
+        db.close()
+
+
+async def resume_unfinished() -> int:
+    """Re-run files whose parsing was interrupted by a restart."""
+    db = SessionLocal()
+    try:
+        file_ids = [row.id for row in db.query(StrategyFile.id).filter(
+            StrategyFile.parse_status.isnot(None),
+            StrategyFile.parse_status.notin_(FINAL_STATUSES)
+        )]
+    finally:
+        db.close()
+
+    for file_id in file_ids:
+        await process_strategy_file(file_id)
+    if file_ids:
+        print(f"[Strategy Files] Resumed {len(file_ids)} unfinished strategy files")
+    return len(file_ids)
+
+
+def start_resume():
+    """Run resume_unfinished in the background. Called from the app startup hook."""
+    global _resume_task
+    if _resume_task is None:
+        _resume_task = asyncio.create_task(resume_unfinished())
+
+
+def shutdown():
+    """Stop resuming and the extraction pool. Called from the app shutdown hook."""
+    if _resume_task is not None:
+        _resume_task.cancel()
+    strategy_parser.shutdown_executor()
@@ -3,88 +3,271 @@ Strategy Document Parser
 
 Parses uploaded strategy files (PDF, DOCX, TXT, Markdown) and extracts key information
 using Claude to intelligently structure the content into strategy fields.
+
+Text extraction is CPU-bound, so it runs in a process pool (STRATEGY_PARSE_WORKERS,
+default 1) and is capped by STRATEGY_MAX_PAGES (default 300), STRATEGY_MAX_CHARS
+(default 400,000) and STRATEGY_PARSE_TIMEOUT_SECONDS (default 120).
+
+Long documents are extracted map-reduce style: split into chunks at section
+boundaries, each chunk extracted by its own Claude call, and the results
+merged with merge_extracted_strategies.
 """
 
 import os
-from anthropic import Anthropic
-from typing import Optional
+import re
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, Optional
 
-client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+from . import llm
+from .response_parser import parse_json_object
 
+DEFAULT_WORKERS = 1
+DEFAULT_MAX_PAGES = 300
+DEFAULT_MAX_CHARS = 400_000
+DEFAULT_TIMEOUT_SECONDS = 120
+# Extra time the worker gets to return what it read before it is killed
+TIMEOUT_GRACE_SECONDS = 15
+TEXT_READ_CHUNK = 64 * 1024
+DEFAULT_CHUNK_CHARS = 40_000
+# Bump when the extraction prompt or merging changes, so cached extractions are redone
+EXTRACTOR_VERSION = 2
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+# Every field is optional - Claude returns null for anything the document doesn't cover
+STRATEGY_SCHEMA = {
+    "brand_voice": {"type": str},
+    "tone_keywords": {"type": list},
+    "content_pillars": {"type": list},
+    "target_audience": {"type": str},
+    "audience_pain_points": {"type": list},
+    "industry": {"type": str},
+    "unique_selling_points": {"type": list},
+    "key_messages": {"type": list},
+    "topics_to_avoid": {"type": list},
+    "hashtags_primary": {"type": list},
+    "hashtags_secondary": {"type": list},
+    "platforms": {"type": list},
+    "additional_notes": {"type": str},
+    "summary": {"type": str},
+}
+
+
+def get_limits() -> dict:
+    """Read the extraction limits from the environment."""
+    limits = {}
+    for key, env_var, default in (
+        ("max_pages", "STRATEGY_MAX_PAGES", DEFAULT_MAX_PAGES),
+        ("max_chars", "STRATEGY_MAX_CHARS", DEFAULT_MAX_CHARS),
+        ("timeout", "STRATEGY_PARSE_TIMEOUT_SECONDS", DEFAULT_TIMEOUT_SECONDS),
+    ):
+        try:
+            limits[key] = max(1, int(os.getenv(env_var, default)))
+        except ValueError:
+            limits[key] = default
+    return limits
+
+
+def get_chunk_chars() -> int:
+    """Read the target chunk size for long documents from the environment."""
+    try:
+        return max(2000, int(os.getenv("STRATEGY_CHUNK_CHARS", DEFAULT_CHUNK_CHARS)))
+    except ValueError:
+        return DEFAULT_CHUNK_CHARS
+
+
+def get_worker_count() -> int:
+    """Read the extraction process pool size from the environment."""
+    try:
+        return max(1, int(os.getenv("STRATEGY_PARSE_WORKERS", DEFAULT_WORKERS)))
+    except ValueError:
+        return DEFAULT_WORKERS
 
-def extract_text_from_file(file_content: bytes, filename: str) -> str:
-    """Extract text content from various file types"""
-    extension = filename.lower().split('.')[-1]
 
-    if extension in ['txt', 'md', 'markdown']:
-        return file_content.decode('utf-8', errors='ignore')
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=get_worker_count())
+    return _executor
 
-    elif extension == 'pdf':
+
+def shutdown_executor(kill: bool = False):
+    """Stop the process pool. Called from the app shutdown hook, and to get rid of a stuck worker."""
+    global _executor
+    if _executor is None:
+        return
+    if kill:
+        # A worker stuck inside a parser can't be cancelled - only terminated
+        for process in list((_executor._processes or {}).values()):
+            process.terminate()
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+
+
+def _iter_pages(path: str, extension: str) -> Iterator[str]:
+    """Yield a document's text one page (PDF) or paragraph (DOCX) at a time."""
+    if extension == 'pdf':
+        # Try PyMuPDF (fitz) first - it's more reliable
         try:
-            import io
-            # Try PyMuPDF (fitz) first - it's more reliable
-            try:
-                import fitz  # PyMuPDF
-                pdf_doc = fitz.open(stream=file_content, filetype="pdf")
-                text = ""
+            import fitz  # PyMuPDF
+        except ImportError:
+            fitz = None
+        if fitz is not None:
+            with fitz.open(path) as pdf_doc:
                 for page in pdf_doc:
-                    text += page.get_text()
-                pdf_doc.close()
-                return text
-            except ImportError:
-                # Fall back to PyPDF2
-                from PyPDF2 import PdfReader
-                pdf_file = io.BytesIO(file_content)
-                reader = PdfReader(pdf_file)
-                text = ""
-                for page in reader.pages:
-                    text += page.extract_text() or ""
-                return text
-        except Exception as e:
-            return f"[Error extracting PDF: {str(e)}]"
+                    yield page.get_text()
+        else:
+            from PyPDF2 import PdfReader
+            for page in PdfReader(path).pages:
+                yield page.extract_text() or ""
 
     elif extension in ['docx', 'doc']:
-        try:
-            import io
-            from docx import Document
-            doc_file = io.BytesIO(file_content)
-            doc = Document(doc_file)
-            text = ""
-            for para in doc.paragraphs:
-                text += para.text + "\n"
-            return text
-        except Exception as e:
-            return f"[Error extracting DOCX: {str(e)}]"
+        from docx import Document
+        for para in Document(path).paragraphs:
+            yield para.text + "\n"
 
     else:
-        # Try to decode as text
-        try:
-            return file_content.decode('utf-8', errors='ignore')
-        except:
-            return "[Unsupported file type]"
+        with open(path, encoding='utf-8', errors='ignore') as f:
+            while chunk := f.read(TEXT_READ_CHUNK):
+                yield chunk
 
 
-def parse_strategy_document(file_content: bytes, filename: str, client_name: str) -> dict:
+def extract_text_from_file(path: str, filename: str, max_pages: int = DEFAULT_MAX_PAGES,
+                           max_chars: int = DEFAULT_MAX_CHARS, time_budget: float = DEFAULT_TIMEOUT_SECONDS) -> dict:
     """
-    Parse a strategy document and extract structured strategy information.
+    Extract text from a strategy document on disk. Runs in a worker process.
 
-    Returns a dict with extracted fields that can be used to populate the strategy form.
+    Pages are read one at a time and collected in a list, stopping at
+    max_pages, max_chars or after time_budget seconds; the text extracted
+    so far is kept and marked as truncated.
+    Returns {"text", "pages", "truncated"} or {"error"}.
     """
-    # Extract text from file
-    text_content = extract_text_from_file(file_content, filename)
+    extension = filename.lower().split('.')[-1]
+    is_paged = extension == 'pdf'
+    deadline = time.monotonic() + time_budget
 
-    if text_content.startswith("[Error") or text_content == "[Unsupported file type]":
-        return {"error": text_content, "raw_content": ""}
+    parts = []
+    chars = 0
+    pages = 0
+    stopped = None
+    try:
+        for part in _iter_pages(path, extension):
+            pages += 1
+            parts.append(part)
+            chars += len(part)
+            if chars >= max_chars:
+                stopped = f"first {max_chars:,} characters"
+            elif is_paged and pages >= max_pages:
+                stopped = f"first {max_pages} pages"
+            elif time.monotonic() > deadline:
+                stopped = f"first {pages} {'page' if is_paged else 'section'}{'s' if pages != 1 else ''} (time limit)"
+            if stopped:
+                break
+    except Exception as e:
+        kind = "PDF" if is_paged else "DOCX" if extension in ['docx', 'doc'] else "file"
+        return {"error": f"[Error extracting {kind}: {str(e)}]"}
 
-    if not text_content.strip():
-        return {"error": "No text content found in file", "raw_content": ""}
+    # Page breaks become paragraph breaks, so a heading at the top of a page can start a chunk
+    text = ("\n\n" if is_paged else "").join(parts)[:max_chars]
+    if stopped:
+        text += f"\n\n[Document truncated: only the {stopped} were read]"
+    return {"text": text, "pages": pages if is_paged else None, "truncated": bool(stopped)}
+
+
+async def extract_text(path: str, filename: str) -> dict:
+    """
+    Extract a document's text in the process pool, so large PDFs don't
+    block the event loop. A worker that overruns the timeout (stuck inside
+    a parser) is killed and the pool restarted.
+    """
+    limits = get_limits()
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(
+        get_executor(), extract_text_from_file, path, filename,
+        limits["max_pages"], limits["max_chars"], limits["timeout"]
+    )
+    try:
+        return await asyncio.wait_for(future, timeout=limits["timeout"] + TIMEOUT_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        print(f"[Strategy Parser] Extracting {filename} timed out, restarting the worker pool")
+        shutdown_executor(kill=True)
+        return {"error": f"Reading the document took longer than {limits['timeout']} seconds"}
+    except BrokenProcessPool:
+        shutdown_executor()
+        return {"error": "The document parser crashed on this file"}
+
+
+def _is_heading(line: str) -> bool:
+    """Rough heading detection for text pulled out of PDFs, DOCX and Markdown."""
+    line = line.strip()
+    if not line or len(line) > 80 or line.endswith(('.', ',', ';')):
+        return False
+    return (
+        line.startswith('#')
+        or bool(re.match(r'^(\d+(\.\d+)*\.?|[IVX]+\.)\s+\S', line))
+        or (line.isupper() and sum(c.isalpha() for c in line) >= 3)
+    )
+
+
+def split_into_chunks(text: str, target_chars: int = DEFAULT_CHUNK_CHARS) -> list[str]:
+    """
+    Split a document into chunks of about target_chars, breaking at section
+    headings where possible, otherwise at paragraphs, lines, and as a last
+    resort mid-line. Short documents come back as a single chunk.
+    """
+    if len(text) <= target_chars:
+        return [text]
+
+    # Paragraphs, with a heading line always starting a new block
+    blocks = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        current = []
+        for line in paragraph.split('\n'):
+            if _is_heading(line) and current:
+                blocks.append('\n'.join(current))
+                current = []
+            current.append(line)
+        if current:
+            blocks.append('\n'.join(current))
+
+    chunks = []
+    current = []
+    size = 0
 
-    # Truncate if too long (Claude context limit consideration)
-    if len(text_content) > 50000:
-        text_content = text_content[:50000] + "\n\n[Content truncated due to length...]"
+    def flush():
+        nonlocal current, size
+        if current:
+            chunks.append('\n\n'.join(current))
+        current, size = [], 0
+
+    for block in blocks:
+        if not block.strip():
+            continue
+        # Past half the target, start a new section in a fresh chunk rather than splitting it later
+        if size + len(block) > target_chars or (size > target_chars // 2 and _is_heading(block.split('\n', 1)[0])):
+            flush()
+        while len(block) > target_chars:
+            cut = block.rfind('\n', 0, target_chars)
+            cut = cut if cut > target_chars // 2 else target_chars
+            chunks.append(block[:cut])
+            block = block[cut:].lstrip('\n')
+        current.append(block)
+        size += len(block) + 2
+    flush()
+    return chunks
 
-    # Use Claude to intelligently extract strategy information
-    prompt = f"""Analyze this strategy/brand document for "{client_name}" and extract relevant information.
+
+def _extraction_prompt(text_content: str, client_name: str, part: Optional[tuple[int, int]] = None) -> str:
+    if part:
+        intro = (f'This is part {part[0]} of {part[1]} of a strategy/brand document for "{client_name}". '
+                 f'Extract the relevant information found in this part only; the parts are combined afterwards.')
+    else:
+        intro = f'Analyze this strategy/brand document for "{client_name}" and extract relevant information.'
+
+    return f"""{intro}
 
 DOCUMENT CONTENT:
 {text_content}
@@ -121,33 +304,104 @@ Be thorough in your extraction. Look for:
 
 Return ONLY the JSON, no other text."""
 
+
+async def _extract_chunk(text_content: str, filename: str, client_name: str, part: Optional[tuple[int, int]] = None) -> dict:
+    """One Claude extraction call. Returns the fields, or {"error": ...}."""
     try:
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2000,
-            messages=[{"role": "user", "content": prompt}]
-        )
-
-        response_text = response.content[0].text.strip()
-
-        # Clean up response if needed
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        if response_text.startswith("```"):
-            response_text = response_text[3:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-
-        import json
-        extracted = json.loads(response_text.strip())
+        response = await llm.create_message(_extraction_prompt(text_content, client_name, part), max_tokens=2000)
+    except Exception as e:
+        return {"error": f"Failed to parse document: {str(e)}"}
+
+    result = parse_json_object(response.content[0].text, STRATEGY_SCHEMA)
+    if not result.items:
+        return {"error": f"Failed to parse document: {result.describe_failures()}"}
+    if result.truncated:
+        print(f"[Strategy Parser] Response for {filename}{f' part {part[0]}' if part else ''} was cut off, kept the complete fields")
+    return result.items[0]
+
+
+async def _summarize(summaries: list[str], client_name: str) -> Optional[str]:
+    """Condense the per-chunk summaries of a long document into one."""
+    listed = "\n".join(f"- {summary}" for summary in summaries)
+    prompt = f"""These are summaries of consecutive parts of one strategy/brand document for "{client_name}":
+
+{listed}
+
+Write a brief 2-3 sentence summary of the overall strategy. Return only the summary text."""
+    try:
+        response = await llm.create_message(prompt, max_tokens=300)
+        return response.content[0].text.strip() or None
+    except Exception as e:
+        print(f"[Strategy Parser] Could not summarize {len(summaries)} parts: {e}")
+        return None
+
+
+def reduce_extracted(parts: list[dict]) -> dict:
+    """
+    Combine per-chunk extractions in document order with merge_extracted_strategies
+    (first value wins for text fields, lists are unioned). Notes from every
+    part are kept, and "default" is only used for the industry if no part found one.
+    """
+    merged = {}
+    notes = []
+    for part in parts:
+        part = dict(part)
+        if part.get("industry") == "default":
+            part.pop("industry")
+        if part.get("additional_notes") and part["additional_notes"] not in notes:
+            notes.append(part["additional_notes"])
+        merged = merge_extracted_strategies(merged, part)
+
+    if notes:
+        merged["additional_notes"] = "\n\n".join(notes)
+    if any(part.get("industry") == "default" for part in parts):
+        merged.setdefault("industry", "default")
+    return merged
+
+
+async def analyze_strategy_text(text_content: str, filename: str, client_name: str) -> dict:
+    """
+    Extract structured strategy information from a document's text with Claude.
+
+    Long documents are split into section-aware chunks (STRATEGY_CHUNK_CHARS,
+    default 40,000) that are extracted concurrently - bounded by the shared
+    Claude concurrency limit - and merged, so nothing past the first chunk
+    is thrown away. Chunks that fail are skipped and counted in
+    "failed_chunks"; the document only fails if every chunk does.
+
+    Returns a dict with extracted fields that can be used to populate the strategy form.
+    """
+    if not text_content.strip():
+        return {"error": "No text content found in file", "raw_content": ""}
+
+    if not llm.get_async_anthropic_client():
+        return {"error": "Anthropic API key not configured", "raw_content": text_content[:5000]}
+
+    chunks = split_into_chunks(text_content, get_chunk_chars())
+    if len(chunks) == 1:
+        extracted = await _extract_chunk(text_content, filename, client_name)
         extracted["raw_content"] = text_content[:5000]  # Store first 5k chars for reference
         return extracted
 
-    except Exception as e:
-        return {
-            "error": f"Failed to parse document: {str(e)}",
-            "raw_content": text_content[:5000]
-        }
+    results = await asyncio.gather(*(
+        _extract_chunk(chunk, filename, client_name, (i + 1, len(chunks)))
+        for i, chunk in enumerate(chunks)
+    ))
+    parts = [result for result in results if "error" not in result]
+    failed = len(results) - len(parts)
+    if not parts:
+        return {"error": results[0]["error"], "raw_content": text_content[:5000]}
+    if failed:
+        print(f"[Strategy Parser] {failed} of {len(chunks)} parts of {filename} could not be extracted")
+
+    extracted = reduce_extracted(parts)
+    summaries = [part["summary"] for part in parts if part.get("summary")]
+    extracted["summary"] = (await _summarize(summaries, client_name) if len(summaries) > 1 else None) \
+        or (summaries[0] if summaries else None)
+    extracted["chunks"] = len(chunks)
+    extracted["failed_chunks"] = failed
+    extracted["raw_content"] = text_content[:5000]
+    return extracted
 
 
 def merge_extracted_strategies(existing: dict, new_data: dict) -> dict:
@@ -0,0 +1,210 @@
+"""
+Photo Thumbnails
+
+Uploaded photos are kept at full resolution for Metricool, but pages only
+ever show them small. After an upload, each photo is resized in a process
+pool (Pillow work is CPU-bound and would otherwise stall the event loop)
+into a few widths, each saved as WebP and JPEG:
+
+    sm  - 160px   client page post list
+    md  - 480px   photo library grid, photo picker
+    lg  - 1200px  post detail, client review portal
+
+Files are named by the photo's content hash ({hash}-{size}.{ext}) and kept
+in storage under thumbs/, so the same image uploaded twice is only resized
+once and the URLs can be cached by browsers forever. /thumbs/{hash}-{size}.jpg
+serves WebP instead when the browser accepts it (sent from disk with local
+storage, redirected to a signed bucket URL otherwise).
+
+Set THUMBNAIL_WORKERS to change the process pool size (default 2).
+"""
+
+import os
+import shutil
+import asyncio
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+from ..database import SessionLocal
+from ..models import Photo
+from . import media_cache, storage
+
+SIZES = {"sm": 160, "md": 480, "lg": 1200}
+DEFAULT_SIZE = "md"
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+DEFAULT_WORKERS = 2
+
+FORMATS = ("webp", "jpg")
+
+_executor: Optional[ProcessPoolExecutor] = None
+_backfill_task: Optional[asyncio.Task] = None
+
+
+def get_worker_count() -> int:
+    """Read the thumbnail process pool size from the environment."""
+    try:
+        return max(1, int(os.getenv("THUMBNAIL_WORKERS", DEFAULT_WORKERS)))
+    except ValueError:
+        return DEFAULT_WORKERS
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=get_worker_count())
+    return _executor
+
+
+def shutdown_executor():
+    """Stop the backfill and the process pool. Called from the app shutdown hook."""
+    global _executor
+    if _backfill_task is not None:
+        _backfill_task.cancel()
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def thumbnail_key(content_hash: str, size: str, ext: str) -> str:
+    return f"thumbs/{content_hash}-{size}.{ext}"
+
+
+def render_thumbnails(source: str, out_dir: str, content_hash: str, wanted: list[tuple[str, str]]) -> list[str]:
+    """
+    Resize one image into the wanted (size, format) pairs, writing them to
+    out_dir. Runs in a worker process. Returns the file names written.
+    """
+    written = []
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+        for size, width in SIZES.items():
+            formats = [ext for wanted_size, ext in wanted if wanted_size == size]
+            if not formats:
+                continue
+            resized = image.copy()
+            resized.thumbnail((width, width * 4), Image.LANCZOS)
+
+            for ext in formats:
+                name = f"{content_hash}-{size}.{ext}"
+                path = Path(out_dir) / name
+                if ext == "webp":
+                    resized.save(path, "WEBP", quality=WEBP_QUALITY, method=4)
+                else:
+                    flat = resized.convert("RGB") if resized.mode != "RGB" else resized
+                    flat.save(path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+                written.append(name)
+    return written
+
+
+def thumbnail_url(photo: Photo, size: str = DEFAULT_SIZE) -> str:
+    """URL to show a photo at a given size; the original until its thumbnails exist."""
+    if photo.thumbnail_path and photo.content_hash and size in SIZES:
+        return f"/thumbs/{photo.content_hash}-{size}.jpg"
+    return storage.media_url(photo.file_path)
+
+
+async def resolve_thumbnail(name: str, accepts_webp: bool) -> Optional[tuple[str, str]]:
+    """
+    Map a /thumbs/ file name to the storage key to send and its media type,
+    upgrading JPEG requests to WebP when the browser accepts it.
+    """
+    stem, _, ext = name.rpartition(".")
+    content_hash, _, size = stem.rpartition("-")
+    if ext not in ("jpg", "webp") or size not in SIZES or len(content_hash) != 64 \
+            or any(c not in "0123456789abcdef" for c in content_hash):
+        return None
+
+    backend = storage.get_backend()
+    if ext == "jpg" and accepts_webp:
+        webp = thumbnail_key(content_hash, size, "webp")
+        if await backend.exists(webp):
+            return webp, "image/webp"
+
+    key = thumbnail_key(content_hash, size, ext)
+    if not await backend.exists(key):
+        return None
+    return key, "image/webp" if ext == "webp" else "image/jpeg"
+
+
+async def generate_for_photo(photo_id: int) -> bool:
+    """Create a photo's thumbnails in the process pool and record them. Returns True on success."""
+    db = SessionLocal()
+    try:
+        photo = db.query(Photo).filter(Photo.id == photo_id).first()
+        if not photo or not photo.file_path:
+            return False
+
+        content_hash = await media_cache.ensure_content_hash(photo)
+        if not content_hash:
+            print(f"[Thumbnails] Photo {photo_id} file is missing")
+            return False
+
+        if not await _render_missing(storage.key_for(photo.file_path), content_hash):
+            return False
+
+        photo.thumbnail_path = f"/thumbs/{content_hash}-{DEFAULT_SIZE}.jpg"
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+async def _render_missing(key: str, content_hash: str) -> bool:
+    """Render the thumbnails that aren't in storage yet (same content uploaded before) and store them."""
+    backend = storage.get_backend()
+    wanted = [(size, ext) for size in SIZES for ext in FORMATS
+              if not await backend.exists(thumbnail_key(content_hash, size, ext))]
+    if not wanted:
+        return True
+
+    work_dir = tempfile.mkdtemp(dir=storage.upload_tmp_dir())
+    try:
+        if isinstance(backend, storage.LocalStorageBackend):
+            source = backend.local_path(key)
+        else:
+            source = Path(work_dir) / "source"
+            await backend.fetch_to(key, source)
+
+        loop = asyncio.get_running_loop()
+        written = await loop.run_in_executor(get_executor(), render_thumbnails, str(source), work_dir, content_hash, wanted)
+        for name in written:
+            content_type = "image/webp" if name.endswith(".webp") else "image/jpeg"
+            await backend.save_file(f"thumbs/{name}", Path(work_dir) / name, content_type)
+        return True
+    except Exception as e:
+        print(f"[Thumbnails] Could not resize {key}: {e}")
+        return False
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+async def backfill_missing() -> int:
+    """Create thumbnails for photos uploaded before this pipeline existed."""
+    db = SessionLocal()
+    try:
+        photo_ids = [row.id for row in db.query(Photo.id).filter(Photo.thumbnail_path.is_(None))]
+    finally:
+        db.close()
+
+    created = 0
+    for photo_id in photo_ids:
+        if await generate_for_photo(photo_id):
+            created += 1
+    if created:
+        print(f"[Thumbnails] Created thumbnails for {created} existing photos")
+    return created
+
+
+def start_backfill():
+    """Run backfill_missing in the background. Called from the app startup hook."""
+    global _backfill_task
+    if _backfill_task is None:
+        _backfill_task = asyncio.create_task(backfill_missing())
@@ -0,0 +1,181 @@
+"""
+Upload Storage
+
+Every uploaded file goes through store_upload, which:
+- rejects files over the size limit before reading them when the size is
+  known, and stops as soon as the limit is passed when it isn't
+- streams the upload to a scratch file in chunks with aiofiles (never the
+  whole file in memory, never a blocking write on the event loop), hashing
+  as it goes, then hands it to the storage backend (services/storage.py)
+- stores files by content hash, so the same file uploaded twice by a
+  client is kept once - the second upload returns the existing record
+- records the result as a StoredObject row
+
+Limits are set with MAX_PHOTO_UPLOAD_MB (default 25) and
+MAX_DOCUMENT_UPLOAD_MB (default 50). Requests whose Content-Length is
+over the largest limit are refused by middleware before the form is
+even parsed. Text uploads that are stored in the
+database instead of on disk (profile and strategy markdown) are read with
+read_text_upload, which applies the document limit the same way.
+"""
+
+import os
+import hashlib
+import secrets
+from pathlib import Path
+
+import aiofiles
+import aiofiles.os
+from fastapi import UploadFile
+from sqlalchemy.orm import Session
+
+from ..models import Client, StoredObject
+from . import storage
+
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_MAX_PHOTO_MB = 25
+DEFAULT_MAX_DOCUMENT_MB = 50
+FORM_OVERHEAD_BYTES = 1024 * 1024
+
+# kind -> (key prefix, allowed extensions, env var for the limit, default MB)
+KINDS = {
+    "photo": ("", {".jpg", ".jpeg", ".png", ".webp", ".gif", ".heic", ".avif", ".bmp", ".tif", ".tiff"}, "MAX_PHOTO_UPLOAD_MB", DEFAULT_MAX_PHOTO_MB),
+    "strategy": ("strategies", {".pdf", ".docx", ".doc", ".txt", ".md", ".markdown"}, "MAX_DOCUMENT_UPLOAD_MB", DEFAULT_MAX_DOCUMENT_MB),
+}
+
+
+class UploadError(Exception):
+    """Raised when an upload is rejected. status_code is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def get_max_bytes(kind: str) -> int:
+    """Read the size limit for a kind of upload from the environment."""
+    _, _, env_var, default = KINDS[kind]
+    try:
+        megabytes = float(os.getenv(env_var, default))
+    except ValueError:
+        megabytes = default
+    return int(megabytes * 1024 * 1024)
+
+
+def get_max_request_bytes() -> int:
+    """Largest request body worth parsing: the biggest file limit plus room for the other form fields."""
+    return max(get_max_bytes(kind) for kind in KINDS) + FORM_OVERHEAD_BYTES
+
+
+def _too_large(max_bytes: int) -> UploadError:
+    return UploadError(f"File is larger than the {max_bytes // (1024 * 1024)} MB limit", status_code=413)
+
+
+def _key_prefix(kind: str, client: Client) -> str:
+    """Storage key folder for a client's uploads of a kind, e.g. "strategies/acme/"."""
+    subfolder = KINDS[kind][0]
+    return "/".join(part for part in (subfolder, client.slug) if part) + "/"
+
+
+async def store_upload(db: Session, client: Client, file: UploadFile, kind: str) -> StoredObject:
+    """
+    Stream an upload to disk and return its StoredObject, reusing the
+    existing one if the client already uploaded the same content.
+    Raises UploadError for a disallowed type or a file over the limit.
+    """
+    ext = Path(file.filename or "").suffix.lower()
+    if ext not in KINDS[kind][1]:
+        raise UploadError(f"Unsupported file type '{ext or 'none'}'")
+
+    max_bytes = get_max_bytes(kind)
+    if file.size is not None and file.size > max_bytes:
+        raise _too_large(max_bytes)
+
+    tmp_path = storage.upload_tmp_dir() / f"upload-{secrets.token_hex(8)}"
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            while chunk := await file.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large(max_bytes)
+                digest.update(chunk)
+                await out.write(chunk)
+    except BaseException:
+        await _remove(tmp_path)
+        raise
+
+    if size == 0:
+        await _remove(tmp_path)
+        raise UploadError("File is empty")
+
+    content_hash = digest.hexdigest()
+    filename = f"{content_hash[:32]}{ext}"
+    key = _key_prefix(kind, client) + filename
+    backend = storage.get_backend()
+
+    existing = db.query(StoredObject).filter(
+        StoredObject.client_id == client.id,
+        StoredObject.kind == kind,
+        StoredObject.content_hash == content_hash
+    ).first()
+    if existing and await backend.exists(storage.key_for(existing.path)):
+        await _remove(tmp_path)
+        return existing
+
+    try:
+        await backend.save_file(key, tmp_path, file.content_type)
+    finally:
+        await _remove(tmp_path)
+
+    stored = existing or StoredObject(client_id=client.id, kind=kind, content_hash=content_hash)
+    stored.path = storage.path_for(key)
+    stored.filename = filename
+    stored.original_filename = file.filename
+    stored.content_type = file.content_type
+    stored.size = size
+    if not existing:
+        db.add(stored)
+    db.commit()
+    return stored
+
+
+async def read_text_upload(file: UploadFile, kind: str = "strategy") -> str:
+    """Read a text upload that is kept in the database, enforcing the size limit while reading."""
+    max_bytes = get_max_bytes(kind)
+    if file.size is not None and file.size > max_bytes:
+        raise _too_large(max_bytes)
+
+    chunks = []
+    size = 0
+    while chunk := await file.read(CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_bytes:
+            raise _too_large(max_bytes)
+        chunks.append(chunk)
+    return b"".join(chunks).decode("utf-8", errors="ignore")
+
+
+async def release(db: Session, client_id: int, path: str, still_used: bool) -> bool:
+    """
+    Delete a stored file and its record once nothing refers to it.
+    still_used says whether any other row still points at path.
+    Returns True if the file was removed.
+    """
+    if still_used:
+        return False
+    db.query(StoredObject).filter(
+        StoredObject.client_id == client_id,
+        StoredObject.path == path
+    ).delete(synchronize_session=False)
+    return await storage.get_backend().delete(storage.key_for(path))
+
+
+async def _remove(path: Path) -> bool:
+    try:
+        await aiofiles.os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
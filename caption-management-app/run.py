@@ -5,7 +5,9 @@ Caption Management App - Run Script
 Usage:
     python run.py
 
-Or with uvicorn directly:
+Applies pending database migrations, then starts the dev server.
+
+Or with uvicorn directly (after `python -m app.migrations upgrade`):
     uvicorn app.main:app --reload --host 0.0.0.0 --port 8000
 """
 import uvicorn
@@ -24,6 +26,14 @@ if __name__ == "__main__":
     if not os.getenv("METRICOOL_USER_TOKEN"):
         print("⚠️  Warning: METRICOOL_USER_TOKEN not set. Publishing to Metricool will not work.\n")
 
+    if not os.getenv("SECRET_KEY") and not os.getenv("APP_PASSWORD"):
+        print("⚠️  Warning: SECRET_KEY not set. The app won't start with local storage until it is.\n")
+
+    # Deployments run this as a release step; locally, keep the database current on every start
+    from app.database import engine
+    from app import migrations
+    migrations.upgrade(engine)
+
     print("🚀 Starting Caption Management App...")
     print("   Dashboard: http://localhost:8000")
     print("   Press Ctrl+C to stop\n")
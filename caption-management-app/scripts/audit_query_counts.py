@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Count the SQL statements behind each agency and review page, at two
+client counts, to catch N+1 loads (a query per client or per post).
+
+Usage (from caption-management-app/):
+    python scripts/audit_query_counts.py [--small 3] [--large 30] [--posts 25]
+
+A throwaway SQLite database is migrated and seeded with --small clients,
+every page is rendered through the app while statements on the async
+engine are counted, then more clients are added up to --large and the
+pages are rendered again. A page whose statement count changes with the
+number of clients or posts is reported and the script exits with status 1,
+so it can run as a check before merging changes to these routes.
+"""
+import io
+import os
+import sys
+import argparse
+import secrets
+import tempfile
+from contextlib import contextmanager, redirect_stdout
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+parser = argparse.ArgumentParser(description="Check that page renders run a fixed number of SQL statements")
+parser.add_argument("--small", type=int, default=3, help="clients seeded for the first pass")
+parser.add_argument("--large", type=int, default=30, help="clients seeded for the second pass")
+parser.add_argument("--posts", type=int, default=25, help="posts per client")
+args = parser.parse_args()
+
+# Configure the app before importing it
+os.environ["DATABASE_URL"] = f"sqlite:///{Path(tempfile.mkdtemp()) / 'query_counts.db'}"
+os.environ["APP_PASSWORD"] = ""
+os.environ.setdefault("SECRET_KEY", secrets.token_hex(16))
+
+from sqlalchemy import event  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from app import migrations  # noqa: E402
+from app.database import engine, async_engine, SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import (  # noqa: E402
+    Client, Strategy, Post, Photo, PostStatus, ClientProfile, PlatformStrategy
+)
+
+STATUSES = [PostStatus.DRAFT, PostStatus.CLIENT_REVIEW, PostStatus.APPROVED, PostStatus.SCHEDULED]
+
+
+def seed(count: int) -> tuple[int, str]:
+    """Add audit clients up to count; returns the first client's id and review token."""
+    db = SessionLocal()
+    try:
+        existing = db.query(Client).filter(Client.slug.like("audit-%")).count()
+        for i in range(existing, count):
+            client = Client(name=f"Audit {i}", slug=f"audit-{i}", review_token=f"audit-token-{i}")
+            db.add(client)
+            db.flush()
+            db.add(Strategy(client_id=client.id, platforms=["instagram", "facebook"]))
+            db.add(ClientProfile(client_id=client.id, profile_markdown="# Profile"))
+            db.add_all(PlatformStrategy(client_id=client.id, platform=platform, strategy_markdown="# Strategy")
+                       for platform in ("instagram", "facebook"))
+            photos = [Photo(client_id=client.id, filename=f"audit-{i}-{n}.jpg",
+                            file_path=f"/static/uploads/audit-{i}-{n}.jpg") for n in range(3)]
+            db.add_all(photos)
+            db.flush()
+            db.add_all(Post(
+                client_id=client.id, caption=f"Caption {n}", hashtags="#audit", platform="instagram",
+                status=STATUSES[n % len(STATUSES)], batch_name="Audit",
+                photo_id=photos[n % len(photos)].id if n % 2 else None
+            ) for n in range(args.posts))
+        db.commit()
+        first = db.query(Client).filter(Client.slug == "audit-0").one()
+        return first.id, first.review_token
+    finally:
+        db.close()
+
+
+@contextmanager
+def count_statements():
+    counter = {"statements": 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter["statements"] += 1
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+def measure(http: TestClient, client_id: int, review_token: str) -> dict:
+    pages = {
+        "dashboard": "/",
+        "client list": "/clients",
+        "client page": f"/clients/{client_id}",
+        "review portal": f"/review/{review_token}",
+        "posts API": f"/api/clients/{client_id}/posts",
+    }
+    counts = {}
+    for name, path in pages.items():
+        with count_statements() as counter:
+            response = http.get(path)
+        if response.status_code != 200:
+            raise SystemExit(f"GET {path} returned {response.status_code}")
+        counts[name] = counter["statements"]
+    return counts
+
+
+def main():
+    with redirect_stdout(io.StringIO()):
+        migrations.upgrade(engine)
+
+    with TestClient(app) as http:
+        small = measure(http, *seed(args.small))
+        large = measure(http, *seed(args.large))
+
+    print(f"SQL statements per render, {args.posts} posts per client\n")
+    print(f"{'page':<16}{args.small:>6} clients{args.large:>6} clients")
+    failed = []
+    for name in small:
+        flag = "" if small[name] == large[name] else "  <- grows with data"
+        print(f"{name:<16}{small[name]:>14}{large[name]:>14}{flag}")
+        if flag:
+            failed.append(name)
+
+    if failed:
+        print(f"\nStatement count depends on the data for: {', '.join(failed)}")
+        sys.exit(1)
+    print("\nEvery page runs a fixed number of statements")
+
+
+if __name__ == "__main__":
+    main()
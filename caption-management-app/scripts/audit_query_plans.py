@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Check that the hot queries on posts, photos, previous posts and platform
+strategies are answered from an index, not a full table scan.
+
+Usage (from caption-management-app/):
+    python scripts/audit_query_plans.py            # throwaway SQLite DB with seeded data
+    python scripts/audit_query_plans.py --db captions.db   # an existing SQLite database
+
+Each query below mirrors one in the app (the location is noted next to
+it). The script runs EXPLAIN QUERY PLAN on it after ANALYZE, prints the
+plan, and exits 1 if any of them scans a whole table - so it can run in
+CI next to the indexes declared in app/models.py. The temp DB is built by
+the migrations, so an index missing from them fails here too; an existing
+--db is audited as it is. "temp b-tree" lines mean
+SQLite sorts the matching rows itself; that is reported but allowed.
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+parser = argparse.ArgumentParser(description="Audit query plans of the hot queries")
+parser.add_argument("--db", default=None, help="existing SQLite database to audit (default: seeded temp DB)")
+parser.add_argument("--posts", type=int, default=5000, help="posts to seed in the temp DB")
+args = parser.parse_args()
+
+DB_PATH = Path(args.db) if args.db else Path(tempfile.mkdtemp()) / "audit_query_plans.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from sqlalchemy import text  # noqa: E402
+from app import migrations  # noqa: E402
+from app.database import engine, SessionLocal  # noqa: E402
+from app.models import Client, Post, PostStatus, PreviousPost, Photo, PlatformStrategy  # noqa: E402
+
+CLIENTS = 20
+PLATFORMS = ["instagram", "facebook", "linkedin", "gbp"]
+
+
+def seed(db):
+    rng = random.Random(7)
+    clients = [Client(name=f"Client {i}", slug=f"client-{i}", review_token=f"token-{i}") for i in range(CLIENTS)]
+    db.add_all(clients)
+    db.commit()
+
+    start = datetime(2025, 1, 1)
+    statuses = list(PostStatus)
+    db.add_all(Post(
+        client_id=clients[i % CLIENTS].id,
+        caption=f"Caption {i}",
+        platform=PLATFORMS[i % len(PLATFORMS)],
+        status=rng.choice(statuses),
+        batch_name=f"Week {i // 100}",
+        was_edited=rng.random() < 0.2,
+        original_caption=f"Original {i}",
+        scheduled_date=start + timedelta(hours=i),
+        created_at=start + timedelta(minutes=i),
+        updated_at=start + timedelta(minutes=2 * i)
+    ) for i in range(args.posts))
+    db.add_all(PreviousPost(client_id=clients[i % CLIENTS].id, caption=f"Old {i}", posted_date=start - timedelta(days=i))
+               for i in range(args.posts // 2))
+    db.add_all(Photo(client_id=clients[i % CLIENTS].id, filename=f"p{i}.jpg", file_path=f"/static/uploads/p{i}.jpg")
+               for i in range(args.posts // 5))
+    db.add_all(PlatformStrategy(client_id=client.id, platform=platform, strategy_markdown="...")
+               for client in clients for platform in PLATFORMS)
+    db.commit()
+
+
+def hot_queries(db, client_id: int) -> dict:
+    return {
+        # main.view_client
+        "client page posts": db.query(Post).filter(Post.client_id == client_id).order_by(Post.created_at.desc()),
+        "client page photos": db.query(Photo).filter(Photo.client_id == client_id),
+        "client page platform strategies": db.query(PlatformStrategy).filter(PlatformStrategy.client_id == client_id),
+        # main.client_review_portal
+        "review portal": db.query(Post).filter(
+            Post.client_id == client_id, Post.status == PostStatus.CLIENT_REVIEW.value
+        ).order_by(Post.scheduled_date),
+        # main.api_get_posts, without and with ?status=
+        "posts API": db.query(Post).filter(Post.client_id == client_id).order_by(Post.created_at.desc()),
+        "posts API by status": db.query(Post).filter(
+            Post.client_id == client_id, Post.status == PostStatus.APPROVED.value
+        ).order_by(Post.created_at.desc()),
+        # generation.generate_posts_for_client - learning from edits
+        "learning from edits": db.query(Post).filter(
+            Post.client_id == client_id, Post.was_edited == True, Post.original_caption.isnot(None)  # noqa: E712
+        ).order_by(Post.updated_at.desc()).limit(10),
+        # generation.generate_posts_for_client - platform strategy
+        "platform strategy": db.query(PlatformStrategy).filter(
+            PlatformStrategy.client_id == client_id, PlatformStrategy.platform == "instagram"
+        ),
+        # post_selection._recent_candidates
+        "recent previous posts": db.query(PreviousPost.id, PreviousPost.caption, PreviousPost.posted_date).filter(
+            PreviousPost.client_id == client_id
+        ).order_by(PreviousPost.posted_date.desc(), PreviousPost.id.desc()).limit(200),
+        # scheduling.schedule_batch
+        "batch scheduling": db.query(Post).filter(
+            Post.client_id == client_id, Post.batch_name == "Week 1", Post.status == PostStatus.APPROVED.value
+        ).order_by(Post.scheduled_date, Post.id),
+        # metricool_sync._load_local_posts
+        "metricool sync window": db.query(Post).filter(
+            Post.client_id == client_id, Post.status == PostStatus.SCHEDULED.value,
+            Post.metricool_post_id.isnot(None), Post.scheduled_date >= datetime(2025, 3, 1)
+        ),
+        # main.dashboard
+        "dashboard recent posts": db.query(Post).order_by(Post.created_at.desc()).limit(10),
+    }
+
+
+def explain(conn, query) -> list[str]:
+    sql = str(query.statement.compile(engine, compile_kwargs={"literal_binds": True}))
+    return [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+
+
+def is_full_scan(step: str) -> bool:
+    # "SCAN posts" reads every row; "SEARCH ... USING INDEX" and "SCAN ... USING INDEX" (ordered, with LIMIT) don't
+    return step.startswith("SCAN ") and " USING " not in step
+
+
+def main_audit() -> int:
+    if not args.db:
+        migrations.upgrade(engine)
+        db = SessionLocal()
+        seed(db)
+    else:
+        db = SessionLocal()
+
+    client_id = db.query(Client.id).order_by(Client.id).limit(1).scalar() or 1
+    failures = 0
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE"))
+        for name, query in hot_queries(db, client_id).items():
+            plan = explain(conn, query)
+            full_scans = [step for step in plan if is_full_scan(step)]
+            failures += bool(full_scans)
+            print(f"{'FAIL' if full_scans else 'ok  '} {name}")
+            for step in plan:
+                print(f"       {step}")
+    db.close()
+
+    print(f"\n{failures} quer{'y' if failures == 1 else 'ies'} doing full table scans" if failures
+          else "\nAll hot queries use an index")
+    return failures
+
+
+if __name__ == "__main__":
+    try:
+        failed = main_audit()
+    finally:
+        if not args.db:
+            DB_PATH.unlink(missing_ok=True)
+    sys.exit(1 if failed else 0)
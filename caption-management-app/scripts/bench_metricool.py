@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Load test: bulk scheduling through the real scheduling/metricool modules
+against the fake Metricool API (scripts/fake_metricool.py).
+
+Usage (from caption-management-app/):
+    python scripts/bench_metricool.py [--posts 200] [--concurrency 1,4,8] [--photos 20]
+                                      [--latency-ms 80] [--error-rate 0.02] [--rate-limit 10]
+    python scripts/bench_metricool.py --url http://127.0.0.1:8765   # fake running separately
+
+Without --url the fake runs in-process (httpx ASGI transport), so results
+measure our client - concurrency, retries, 429 backoff, media caching -
+rather than a network. Each concurrency level schedules a fresh batch of
+--posts approved posts in a throwaway SQLite database and reports
+throughput and p50/p95/p99 latency of every Metricool call.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(SCRIPTS_DIR.parent))
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+import fake_metricool  # noqa: E402
+
+parser = argparse.ArgumentParser(description="Benchmark bulk Metricool scheduling")
+parser.add_argument("--posts", type=int, default=200, help="approved posts per run")
+parser.add_argument("--photos", type=int, default=20, help="distinct photos shared by the posts (0 = text only)")
+parser.add_argument("--concurrency", default="1,4,8", help="comma-separated METRICOOL_MAX_CONCURRENCY values")
+parser.add_argument("--url", default=None, help="base URL of a running fake (default: in-process)")
+fake_metricool.add_arguments(parser)
+args = parser.parse_args()
+
+# Configure the app before importing it
+DB_PATH = Path(tempfile.mkdtemp()) / "bench_metricool.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ.update(METRICOOL_USER_TOKEN="bench", METRICOOL_USER_ID="1", PUBLIC_BASE_URL="https://bench.example.com")
+if args.url:
+    os.environ["METRICOOL_BASE_URL"] = args.url
+
+import httpx  # noqa: E402
+from app.database import Base, engine, SessionLocal  # noqa: E402
+from app.models import Client, Post, Photo, PostStatus  # noqa: E402
+from app.services import metricool, scheduling  # noqa: E402
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def instrument(timings: dict):
+    """Time every Metricool call made through the service module, retries included."""
+    for name in ("schedule_post", "normalize_media"):
+        original = getattr(metricool, name)
+
+        async def timed(*a, _original=original, _name=name, **kw):
+            start = time.perf_counter()
+            try:
+                return await _original(*a, **kw)
+            finally:
+                timings.setdefault(_name, []).append((time.perf_counter() - start) * 1000)
+
+        setattr(metricool, name, timed)
+
+
+def seed(db, client, photos, batch_name):
+    start = datetime(2030, 1, 1, 9)
+    db.add_all([
+        Post(
+            client_id=client.id,
+            caption=f"Benchmark caption {i} for {batch_name}",
+            hashtags="#bench",
+            platform=["instagram", "facebook", "linkedin"][i % 3],
+            batch_name=batch_name,
+            status=PostStatus.APPROVED,
+            scheduled_date=start + timedelta(hours=i),
+            photo_id=photos[i % len(photos)].id if photos else None
+        )
+        for i in range(args.posts)
+    ])
+    db.commit()
+
+
+async def main():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+
+    client = Client(name="Bench Client", slug="bench-client", metricool_blog_id="1000")
+    db.add(client)
+    db.commit()
+
+    photos = []
+    for i in range(args.photos):
+        photo = Photo(client_id=client.id, filename=f"bench{i}.jpg", file_path=f"/static/uploads/bench/bench{i}.jpg",
+                      content_hash=f"{i:064x}")
+        db.add(photo)
+        photos.append(photo)
+    db.commit()
+
+    fake_app = None
+    if args.url:
+        metricool.get_client()
+    else:
+        fake_app = fake_metricool.app_from_args(args)
+        await metricool.close_client()
+        metricool._client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=fake_app),
+            base_url="http://fake-metricool",
+            timeout=metricool.TIMEOUT
+        )
+
+    timings: dict[str, list[float]] = {}
+    instrument(timings)
+
+    if args.url:
+        print(f"{args.posts} posts, {args.photos} photos, against {args.url}")
+    else:
+        print(f"{args.posts} posts, {args.photos} photos, latency {args.latency_ms:.0f}+/-{args.jitter_ms:.0f} ms, "
+              f"error rate {args.error_rate:.0%}, rate limit {args.rate_limit or 'none'}")
+    print(f"{'conc':>4} {'wall s':>7} {'posts/s':>8} {'ok':>5} {'fail':>5} {'429s':>5} "
+          f"{'call':>16} {'n':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+
+    for level in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+        os.environ["METRICOOL_MAX_CONCURRENCY"] = str(level)
+        batch_name = f"bench-c{level}"
+        seed(db, client, photos, batch_name)
+        timings.clear()
+        if fake_app:
+            fake_app.state.stats.update({key: 0 for key in fake_app.state.stats})
+
+        start = time.perf_counter()
+        result = await scheduling.schedule_batch(db, client, batch_name)
+        wall = time.perf_counter() - start
+
+        rate_limited = fake_app.state.stats["rate_limited"] if fake_app else "-"
+        first = True
+        for name, values in sorted(timings.items()):
+            prefix = (f"{level:>4} {wall:>7.2f} {result['scheduled'] / wall:>8.1f} {result['scheduled']:>5} "
+                      f"{result['failed']:>5} {rate_limited:>5}") if first else " " * 38
+            print(f"{prefix} {name:>16} {len(values):>5} {percentile(values, 50):>8.1f} "
+                  f"{percentile(values, 95):>8.1f} {percentile(values, 99):>8.1f}")
+            first = False
+
+        errors = Counter(r["error"][:60] for r in result["results"] if r["status"] == "failed")
+        for error, n in errors.most_common(3):
+            print(f"{'':>38} {n:>3} x {error}")
+
+    db.close()
+    await metricool.close_client()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    finally:
+        DB_PATH.unlink(missing_ok=True)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark: expert-framework prompt build time, cold vs precompiled sections.
+
+Usage (from caption-management-app/):
+    python scripts/bench_prompt_build.py [iterations]
+
+"Cold" clears the section cache before every call, which is what every
+build_enhanced_caption_prompt call cost before the cache existed.
+"""
+import sys
+import time
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.expert_frameworks import (  # noqa: E402
+    build_enhanced_caption_prompt,
+    get_prompt_sections,
+    warm_prompt_section_cache,
+    INDUSTRY_EXPERT_MAPPING,
+    PILLAR_EXPERT_EMPHASIS,
+)
+
+PLATFORMS = ["instagram", "facebook", "linkedin", "gbp"]
+PREVIOUS_POSTS = [f"Previous caption number {i} about our services and community." for i in range(40)]
+
+
+def build_cases():
+    cases = []
+    for industry in INDUSTRY_EXPERT_MAPPING:
+        for pillar in [None] + list(PILLAR_EXPERT_EMPHASIS):
+            for platform in PLATFORMS:
+                strategy = {
+                    "industry": industry,
+                    "brand_voice": "Warm and expert",
+                    "tone_keywords": ["friendly", "expert"],
+                    "content_pillars": ["education", "tips"],
+                    "target_audience": "Busy local families",
+                    "key_messages": ["Quality first"],
+                    "unique_selling_points": ["Family owned"],
+                }
+                cases.append((strategy, pillar, platform))
+    return cases
+
+
+def run(cases, iterations, cold):
+    timings = []
+    for _ in range(iterations):
+        for strategy, pillar, platform in cases:
+            if cold:
+                get_prompt_sections.cache_clear()
+            start = time.perf_counter()
+            build_enhanced_caption_prompt(strategy, PREVIOUS_POSTS, 5, platform, pillar, None)
+            timings.append((time.perf_counter() - start) * 1_000_000)
+    return timings
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<8} mean {statistics.mean(timings):8.1f} us   p50 {statistics.median(timings):8.1f} us   p95 {p95:8.1f} us")
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    cases = build_cases()
+
+    cold = run(cases, iterations, cold=True)
+
+    get_prompt_sections.cache_clear()
+    warm_start = time.perf_counter()
+    combos = warm_prompt_section_cache()
+    warm_ms = (time.perf_counter() - warm_start) * 1000
+
+    warm = run(cases, iterations, cold=False)
+
+    print(f"{len(cases)} cases x {iterations} iterations; warm-up built {combos} section sets in {warm_ms:.1f} ms")
+    report("before", cold)
+    report("after", warm)
+    print(f"speedup  {statistics.mean(cold) / statistics.mean(warm):.1f}x")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Round-trip a file through the configured storage backend: save, size,
+range reads, signed URL fetch, delete. Use it to check bucket settings
+before switching STORAGE_BACKEND on a deployment.
+
+Usage (from caption-management-app/):
+    python scripts/check_storage.py [--size-kb 600]
+
+    # against the fake bucket (python scripts/fake_s3.py) or a local MinIO
+    STORAGE_BACKEND=s3 S3_BUCKET=uploads S3_ENDPOINT_URL=http://127.0.0.1:9100 \\
+    AWS_ACCESS_KEY_ID=x AWS_SECRET_ACCESS_KEY=x S3_REGION=us-east-1 \\
+    python scripts/check_storage.py
+
+The local backend's signed URL is a /media/ link served by the app, so it
+is only checked for a valid signature; S3 URLs are fetched directly.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import secrets
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+from app.services import storage  # noqa: E402
+
+parser = argparse.ArgumentParser(description="Check the configured storage backend")
+parser.add_argument("--size-kb", type=int, default=600, help="size of the test file")
+args = parser.parse_args()
+
+
+def check(label: str, ok: bool, detail: str = ""):
+    print(f"  {'ok  ' if ok else 'FAIL'} {label}{f' ({detail})' if detail else ''}")
+    if not ok:
+        check.failed += 1
+
+
+check.failed = 0
+
+
+async def main():
+    backend = storage.get_backend()
+    print(f"Backend: {backend.name} ({backend.location('')})")
+
+    data = os.urandom(args.size_kb * 1024)
+    key = f"_check/{secrets.token_hex(6)}.bin"
+    source = storage.upload_tmp_dir() / f"check-{secrets.token_hex(4)}"
+    source.write_bytes(data)
+
+    start = time.perf_counter()
+    await backend.save_file(key, source, "application/octet-stream")
+    check("save_file", await backend.exists(key), f"{(time.perf_counter() - start) * 1000:.0f} ms")
+    check("source consumed", not source.exists())
+    check("size", await backend.size(key) == len(data))
+
+    check("read whole", await backend.read(key) == data)
+    check("read range", await backend.read_range(key, 100, 199) == data[100:200])
+    check("read to end", await backend.read_range(key, len(data) - 10) == data[-10:])
+    chunks = [chunk async for chunk in backend.iter_range(key, 0, len(data) - 1)]
+    check("iter_range", b"".join(chunks) == data, f"{len(chunks)} chunks")
+
+    url = backend.url(key)
+    if isinstance(backend, storage.LocalStorageBackend):
+        query = parse_qs(urlparse(url).query)
+        check("signed url", storage.verify_media_signature(key, query["expires"][0], query["signature"][0]), url[:60])
+        check("tampered url rejected", not storage.verify_media_signature(key + "x", query["expires"][0], query["signature"][0]))
+    else:
+        async with httpx.AsyncClient(timeout=30) as http:
+            response = await http.get(url, headers={"Range": "bytes=0-99"})
+            check("presigned url range", response.status_code == 206 and response.content == data[:100],
+                  f"HTTP {response.status_code}")
+
+    await backend.delete(key)
+    check("delete", not await backend.exists(key))
+
+    print("All checks passed" if not check.failed else f"{check.failed} check(s) failed")
+    return check.failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(main()) else 0)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Metricool API, for load-testing scheduling without
+touching real accounts.
+
+Usage (from caption-management-app/):
+    python scripts/fake_metricool.py [--port 8765] [--latency-ms 80] [--jitter-ms 40]
+                                     [--error-rate 0.02] [--rate-limit 10] [--burst 20]
+
+Then point the app (or scripts/bench_metricool.py --url) at it:
+    METRICOOL_BASE_URL=http://127.0.0.1:8765 METRICOOL_USER_TOKEN=x METRICOOL_USER_ID=1
+
+Implements the endpoints app/services/metricool.py calls:
+    GET    /admin/simpleProfiles
+    GET    /actions/normalize/image/url
+    GET    /v2/scheduler/posts       (paged with page / pageSize)
+    POST   /v2/scheduler/posts
+    DELETE /v2/scheduler/posts/{id}
+and PUT /v2/scheduler/posts/{id} to simulate edits made in Metricool,
+plus GET /_stats (request, 429 and injected-error counts) and POST /_reset.
+
+Every request waits latency +/- jitter. --error-rate returns that share of
+requests as 503. --rate-limit is a token bucket (requests/second, --burst
+deep) shared by all endpoints; when it is empty the request gets a 429
+with a Retry-After header, like the real API.
+"""
+import time
+import random
+import asyncio
+import argparse
+from itertools import count
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token. Returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+def create_app(
+    latency_ms: float = 80.0,
+    jitter_ms: float = 40.0,
+    error_rate: float = 0.0,
+    rate_limit: float = 0.0,
+    burst: int = 20,
+    brands: int = 5,
+    seed: int = None
+) -> FastAPI:
+    """Build the fake API. rate_limit=0 disables 429s."""
+    app = FastAPI(title="Fake Metricool")
+    rng = random.Random(seed)
+    bucket = TokenBucket(rate_limit, burst) if rate_limit > 0 else None
+    ids = count(1)
+    posts: dict[int, dict] = {}
+    stats = {"requests": 0, "rate_limited": 0, "errors": 0, "scheduled": 0, "normalized": 0, "deleted": 0}
+
+    @app.middleware("http")
+    async def simulate(request: Request, call_next):
+        if request.url.path.startswith("/_"):
+            return await call_next(request)
+
+        stats["requests"] += 1
+        await asyncio.sleep(max(latency_ms + rng.uniform(-jitter_ms, jitter_ms), 0) / 1000)
+
+        if bucket:
+            wait = bucket.take()
+            if wait:
+                stats["rate_limited"] += 1
+                return JSONResponse({"error": "Too many requests"}, status_code=429,
+                                    headers={"Retry-After": f"{wait:.2f}"})
+
+        if error_rate and rng.random() < error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"error": "Service unavailable"}, status_code=503)
+
+        if request.headers.get("X-Mc-Auth") is None:
+            return JSONResponse({"error": "Missing X-Mc-Auth"}, status_code=401)
+
+        return await call_next(request)
+
+    @app.get("/admin/simpleProfiles")
+    async def simple_profiles(userId: str):
+        return [{"id": 1000 + i, "label": f"Fake Brand {i}", "blogId": 1000 + i} for i in range(brands)]
+
+    @app.get("/actions/normalize/image/url")
+    async def normalize(url: str):
+        stats["normalized"] += 1
+        return {"mediaId": f"fake-media-{abs(hash(url)) % 10 ** 10}"}
+
+    @app.get("/v2/scheduler/posts")
+    async def list_posts(blogId: str, userId: str, start: str = None, end: str = None,
+                         page: int = 1, pageSize: int = 100):
+        matching = [
+            post for post in posts.values()
+            if str(post["blogId"]) == blogId
+            and (not start or post["publicationDate"]["dateTime"] >= start)
+            and (not end or post["publicationDate"]["dateTime"] < end)
+        ]
+        return matching[(page - 1) * pageSize:page * pageSize]
+
+    @app.post("/v2/scheduler/posts")
+    async def create_post(request: Request):
+        payload = await request.json()
+        missing = [key for key in ("blogId", "userId", "text", "networks", "publicationDate") if not payload.get(key)]
+        if missing:
+            return JSONResponse({"error": f"Missing fields: {', '.join(missing)}"}, status_code=400)
+
+        post_id = next(ids)
+        posts[post_id] = {"id": post_id, **payload}
+        stats["scheduled"] += 1
+        return {"id": post_id, **payload}
+
+    @app.put("/v2/scheduler/posts/{post_id}")
+    async def update_post(post_id: int, request: Request):
+        # Not called by the app - lets load tests simulate edits made in Metricool itself
+        if post_id not in posts:
+            return JSONResponse({"error": "Post not found"}, status_code=404)
+        posts[post_id].update(await request.json())
+        return posts[post_id]
+
+    @app.delete("/v2/scheduler/posts/{post_id}")
+    async def delete_post(post_id: int):
+        if posts.pop(post_id, None) is None:
+            return JSONResponse({"error": "Post not found"}, status_code=404)
+        stats["deleted"] += 1
+        return {"success": True}
+
+    @app.get("/_stats")
+    async def get_stats():
+        return {**stats, "stored_posts": len(posts)}
+
+    @app.post("/_reset")
+    async def reset():
+        posts.clear()
+        for key in stats:
+            stats[key] = 0
+        return {"success": True}
+
+    app.state.stats = stats
+    app.state.posts = posts
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-ms", type=float, default=80.0, help="mean response latency")
+    parser.add_argument("--jitter-ms", type=float, default=40.0, help="+/- uniform jitter on latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests/second before 429s (0 = unlimited)")
+    parser.add_argument("--burst", type=int, default=20, help="token bucket depth for --rate-limit")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for latency and errors")
+
+
+def app_from_args(args: argparse.Namespace) -> FastAPI:
+    return create_app(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        burst=args.burst,
+        seed=args.seed
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake Metricool API for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    uvicorn.run(app_from_args(args), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an S3-compatible bucket (MinIO-style, path addressing),
+for trying STORAGE_BACKEND=s3 without a real bucket.
+
+Usage (from caption-management-app/):
+    python scripts/fake_s3.py [--port 9100]
+
+Then point the app (or scripts/check_storage.py) at it:
+    STORAGE_BACKEND=s3 S3_BUCKET=uploads S3_ENDPOINT_URL=http://127.0.0.1:9100 \\
+    AWS_ACCESS_KEY_ID=x AWS_SECRET_ACCESS_KEY=x S3_REGION=us-east-1
+
+Implements what app/services/storage.py uses through boto3:
+    PUT    /{bucket}/{key}                        PutObject / UploadPart
+    POST   /{bucket}/{key}?uploads                CreateMultipartUpload
+    POST   /{bucket}/{key}?uploadId=              CompleteMultipartUpload
+    GET    /{bucket}/{key}   (Range supported)    GetObject
+    HEAD   /{bucket}/{key}                        HeadObject
+    DELETE /{bucket}/{key}                        DeleteObject
+plus GET /_stats. Objects are kept in memory, any bucket name is accepted
+and request signatures are not checked - presigned URLs work as long as
+they point here.
+"""
+import re
+import hashlib
+import argparse
+from itertools import count
+
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+
+def _error(code: str, message: str, status_code: int) -> Response:
+    body = f"{XML_HEADER}<Error><Code>{code}</Code><Message>{message}</Message></Error>"
+    return Response(body, status_code=status_code, media_type="application/xml")
+
+
+def _decode_aws_chunked(body: bytes) -> bytes:
+    """Strip aws-chunked framing ("<hex size>[;chunk-signature=...]\\r\\n<data>\\r\\n" ... "0\\r\\n<trailers>")."""
+    data = bytearray()
+    position = 0
+    while True:
+        line_end = body.index(b"\r\n", position)
+        size = int(body[position:line_end].split(b";")[0], 16)
+        if size == 0:
+            return bytes(data)
+        start = line_end + 2
+        data += body[start:start + size]
+        position = start + size + 2
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(title="Fake S3")
+    objects: dict[tuple[str, str], dict] = {}
+    uploads: dict[str, dict[int, bytes]] = {}
+    upload_types: dict[str, str] = {}
+    upload_ids = count(1)
+    stats = {"put": 0, "get": 0, "range_get": 0, "head": 0, "delete": 0}
+
+    async def read_body(request: Request) -> bytes:
+        body = await request.body()
+        if "aws-chunked" in request.headers.get("content-encoding", "") \
+                or request.headers.get("x-amz-content-sha256", "").startswith("STREAMING-"):
+            body = _decode_aws_chunked(body)
+        return body
+
+    def store(bucket: str, key: str, data: bytes, content_type: str):
+        objects[(bucket, key)] = {
+            "data": data,
+            "content_type": content_type or "binary/octet-stream",
+            "etag": f'"{hashlib.md5(data).hexdigest()}"'
+        }
+
+    @app.put("/{bucket}/{key:path}")
+    async def put_object(bucket: str, key: str, request: Request):
+        data = await read_body(request)
+        upload_id = request.query_params.get("uploadId")
+        if upload_id:
+            if upload_id not in uploads:
+                return _error("NoSuchUpload", "Upload not found", 404)
+            uploads[upload_id][int(request.query_params["partNumber"])] = data
+            return Response(headers={"ETag": f'"{hashlib.md5(data).hexdigest()}"'})
+
+        stats["put"] += 1
+        store(bucket, key, data, request.headers.get("content-type"))
+        return Response(headers={"ETag": objects[(bucket, key)]["etag"]})
+
+    @app.post("/{bucket}/{key:path}")
+    async def multipart(bucket: str, key: str, request: Request):
+        if "uploads" in request.query_params:
+            upload_id = str(next(upload_ids))
+            uploads[upload_id] = {}
+            upload_types[upload_id] = request.headers.get("content-type")
+            body = (f"{XML_HEADER}<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                    f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+            return Response(body, media_type="application/xml")
+
+        upload_id = request.query_params.get("uploadId")
+        if upload_id not in uploads:
+            return _error("NoSuchUpload", "Upload not found", 404)
+        await request.body()
+        parts = uploads.pop(upload_id)
+        content_type = upload_types.pop(upload_id, None)
+        stats["put"] += 1
+        store(bucket, key, b"".join(parts[n] for n in sorted(parts)), content_type)
+        body = (f"{XML_HEADER}<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                f"<ETag>{objects[(bucket, key)]['etag']}</ETag></CompleteMultipartUploadResult>")
+        return Response(body, media_type="application/xml")
+
+    @app.get("/{bucket}/{key:path}")
+    async def get_object(bucket: str, key: str, request: Request):
+        obj = objects.get((bucket, key))
+        if obj is None:
+            return _error("NoSuchKey", "The specified key does not exist.", 404)
+
+        data = obj["data"]
+        headers = {"ETag": obj["etag"], "Accept-Ranges": "bytes"}
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", request.headers.get("range", ""))
+        if not match or not any(match.groups()):
+            stats["get"] += 1
+            return Response(data, media_type=obj["content_type"], headers=headers)
+
+        stats["range_get"] += 1
+        size = len(data)
+        if match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        else:
+            start, end = max(size - int(match.group(2)), 0), size - 1
+        if start >= size or end < start:
+            return _error("InvalidRange", "The requested range is not satisfiable", 416)
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return Response(data[start:end + 1], status_code=206, media_type=obj["content_type"], headers=headers)
+
+    @app.head("/{bucket}/{key:path}")
+    async def head_object(bucket: str, key: str):
+        stats["head"] += 1
+        obj = objects.get((bucket, key))
+        if obj is None:
+            return Response(status_code=404)
+        return Response(headers={
+            "Content-Length": str(len(obj["data"])),
+            "Content-Type": obj["content_type"],
+            "ETag": obj["etag"],
+            "Accept-Ranges": "bytes"
+        })
+
+    @app.delete("/{bucket}/{key:path}")
+    async def delete_object(bucket: str, key: str):
+        stats["delete"] += 1
+        objects.pop((bucket, key), None)
+        return Response(status_code=204)
+
+    @app.get("/_stats")
+    async def get_stats():
+        return {**stats, "objects": len(objects), "bytes": sum(len(o["data"]) for o in objects.values())}
+
+    app.state.objects = objects
+    app.state.stats = stats
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake S3-compatible bucket for local testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level="warning")